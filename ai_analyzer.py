@@ -1,44 +1,346 @@
-import requests
-
-def get_ai_analysis(ticker_code, current_price, tech_data, news_list, api_key):
-    if not api_key: return "APIキー未設定"
-
-    model_name = "gemini-2.5-flash"
-    url = f"https://generativelanguage.googleapis.com/v1/models/{model_name}:generateContent?key={api_key}"
-    
-    news_text = "\n".join([f"・{n['title']}" for n in news_list]) if news_list else "特になし"
-    
-    # 💡 指標の「見せ方」を細かく指定したプロンプト
-    prompt = f"""
-    銘柄:{ticker_code} / 現在値:{current_price}円
-    テクニカルデータ:{tech_data}
-    ニュース:{news_text}
-    
-    あなたはプロのAI参謀「IPPO」です。挨拶不要。
-    提供されたデータを統合分析し、以下の構成でレポートを出力してください。
-    ※重要: ```html などのマークダウン記法は絶対に避け、純粋なHTMLタグとテキストのみを出力してください。
-
-    【出力構成ルール】
-    1. 最初に「📊 主要テクニカル指標」という小見出し（<h4>タグ等）をつけ、指標を見やすく整理して箇条書き（<ul><li>）で出力してください。
-       - ボリンジャーバンドは「±2σ」「±3σ」など、関連するものを1行にまとめるなどしてスッキリ見せること。
-       - もし提供されたデータ内に「前日比」や「前日の数値」があれば、必ず併記して比較できるようにすること。
-    2. その下に「💡 IPPOの分析見解」という小見出しをつけ、結論から鋭く語る200文字程度の分析コメントを記述してください。
-    """
-
-    payload = {"contents": [{"parts": [{"text": prompt}]}]}
-
-    try:
-        response = requests.post(url, json=payload, timeout=30)
-        res_data = response.json()
-
-        if response.status_code == 200:
-            answer = res_data['candidates'][0]['content']['parts'][0]['text']
-            # 装飾タグの強制除去
-            answer = answer.replace("```html\n", "").replace("```html", "").replace("```", "").strip()
-            return answer
-        else:
-            err_msg = res_data.get('error', {}).get('message', '不明なエラー')
-            return f"<div style='color:#ff4d4d;'>【APIエラー】<br>理由: {err_msg}</div>"
-
-    except Exception as e:
-        return f"<p style='color:red;'>通信エラー: {str(e)}</p>"
\ No newline at end of file
+import concurrent.futures
+import hashlib
+import html
+import json
+import os
+import sqlite3
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from metrics import count, timer
+
+# 💡 Gemini 呼び出しは全モジュールでこの共有クライアントを使う（15RPM の上限はトークンバケットで守る）
+GEMINI_BASE_URL = os.environ.get("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com/v1")
+GEMINI_MODEL = "gemini-2.5-flash"
+GEMINI_RPM = 15
+GEMINI_BURST = 3
+GEMINI_MAX_CONCURRENCY = 4
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# 💡 同じ入力（プロンプト・モデル）への応答は再利用する（手動再実行・リトライ・動きの無い銘柄で API を呼ばない）
+AI_CACHE_PATH = os.path.join("data_cache", "ai_cache.db")
+AI_CACHE_TTL_SEC = 3 * 24 * 3600
+AI_CACHE_MAX_ENTRIES = 2000
+
+# 監視銘柄の分析は、この件数ずつ1リクエストにまとめて JSON で受け取る
+AI_BATCH_SIZE = 8
+BATCH_RESPONSE_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "code": {"type": "STRING"},
+            "indicators": {"type": "ARRAY", "items": {"type": "STRING"}},
+            "analysis": {"type": "STRING"},
+        },
+        "required": ["code", "indicators", "analysis"],
+    },
+}
+
+class GeminiError(Exception):
+    pass
+
+class TokenBucket:
+    """rate_per_min のペースでトークンを補充し、最大 capacity 個まで連続取得を許すスレッドセーフなレート制限"""
+    def __init__(self, rate_per_min, capacity, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate_per_min / 60.0
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """トークンが1個取れるまで待つ。待った秒数を返す"""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = self.clock()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            self.sleep(wait)
+            waited += wait
+
+    def penalize(self, seconds):
+        """Retry-After を受けたら、その秒数ぶん全スレッドの次の取得を遅らせる"""
+        with self.lock:
+            self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+class CommentaryCache:
+    """
+    プロンプトとモデル名のハッシュをキーにした AI 応答の永続キャッシュ（SQLite）。
+    ttl_sec を過ぎた応答は使わず、max_entries を超えたら最後に使われたのが古い順に捨てる。
+    """
+    def __init__(self, path=AI_CACHE_PATH, ttl_sec=AI_CACHE_TTL_SEC, max_entries=AI_CACHE_MAX_ENTRIES, clock=time.time):
+        self.path = path
+        self.ttl_sec = ttl_sec
+        self.max_entries = max_entries
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("CREATE TABLE IF NOT EXISTS commentary (key TEXT PRIMARY KEY, model TEXT, text TEXT, created REAL, last_used REAL)")
+        return conn
+
+    @staticmethod
+    def key(model, prompt):
+        # 行ごとの字下げや空白の違いではキーが変わらないように正規化する
+        normalized = "\n".join(" ".join(line.split()) for line in prompt.strip().splitlines() if line.strip())
+        return hashlib.sha256(f"{model}\n{normalized}".encode("utf-8")).hexdigest()
+
+    def get(self, model, prompt):
+        key, now = self.key(model, prompt), self.clock()
+        with self.lock:
+            conn = self._connect()
+            try:
+                row = conn.execute("SELECT text, created FROM commentary WHERE key = ?", (key,)).fetchone()
+                if row and now - row[1] <= self.ttl_sec:
+                    with conn:
+                        conn.execute("UPDATE commentary SET last_used = ? WHERE key = ?", (now, key))
+                    self.stats["hits"] += 1
+                    return row[0]
+                self.stats["misses"] += 1
+                return None
+            finally:
+                conn.close()
+
+    def put(self, model, prompt, text):
+        key, now = self.key(model, prompt), self.clock()
+        with self.lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute("INSERT OR REPLACE INTO commentary VALUES (?, ?, ?, ?, ?)", (key, model, text, now, now))
+                    conn.execute("DELETE FROM commentary WHERE created < ?", (now - self.ttl_sec,))
+                    count = conn.execute("SELECT COUNT(*) FROM commentary").fetchone()[0]
+                    if count > self.max_entries:
+                        conn.execute("DELETE FROM commentary WHERE key IN (SELECT key FROM commentary ORDER BY last_used LIMIT ?)",
+                                     (count - self.max_entries,))
+                        self.stats["evictions"] += count - self.max_entries
+            finally:
+                conn.close()
+
+class GeminiClient:
+    """
+    接続を使い回すスレッドセーフな Gemini クライアント。
+    同時実行数はセマフォで、毎分の回数はトークンバケットで制限し、429/5xx は Retry-After に従って再試行する。
+    base_url を差し替えればローカルのスタブサーバーに向けて試験できる。
+    """
+    def __init__(self, api_key, base_url=GEMINI_BASE_URL, model=GEMINI_MODEL, rpm=GEMINI_RPM, burst=GEMINI_BURST,
+                 max_concurrency=GEMINI_MAX_CONCURRENCY, max_retries=3, timeout=30, sleep=time.sleep, cache=None):
+        self.api_key = api_key
+        self.model = model
+        self.cache = cache
+        self.url = f"{base_url.rstrip('/')}/models/{model}:generateContent"
+        self.bucket = TokenBucket(rpm, burst, sleep=sleep)
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.sleep = sleep
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_maxsize=max_concurrency))
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=max_concurrency))
+        self.stats = {"requests": 0, "retries": 0, "wait_sec": 0.0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, key, value=1):
+        with self._stats_lock:
+            self.stats[key] += value
+
+    @staticmethod
+    def _retry_after(response, attempt):
+        value = response.headers.get("Retry-After") if response is not None else None
+        try:
+            return max(0.0, float(value))
+        except (TypeError, ValueError):
+            return 2.0 * (2 ** attempt)
+
+    def generate(self, prompt, generation_config=None, validate=None):
+        """
+        プロンプトを送り、応答テキストを返す（キャッシュにあれば API は呼ばない）。失敗時は GeminiError（API のエラーメッセージ付き）。
+        generation_config は JSON 出力の指定など、validate を渡すとそれが真を返した応答だけをキャッシュする。
+        """
+        cache_key = prompt if generation_config is None else f"{prompt}\n{json.dumps(generation_config, sort_keys=True)}"
+        if self.cache is not None:
+            cached = self.cache.get(self.model, cache_key)
+            if cached is not None:
+                count("ai.cache_hits")
+                return cached
+        with timer("ai.gemini"):
+            text = self._post(prompt, generation_config)
+        if self.cache is not None and (validate is None or validate(text)):
+            self.cache.put(self.model, cache_key, text)
+        return text
+
+    def _post(self, prompt, generation_config=None):
+        payload = {"contents": [{"parts": [{"text": prompt}]}]}
+        if generation_config:
+            payload["generationConfig"] = generation_config
+        for attempt in range(self.max_retries + 1):
+            self._count("wait_sec", self.bucket.acquire())
+            response = None
+            try:
+                with self.semaphore:
+                    self._count("requests")
+                    count("ai.requests")
+                    response = self.session.post(self.url, params={"key": self.api_key}, json=payload, timeout=self.timeout)
+                count("ai.bytes_downloaded", len(response.content))
+                if response.status_code == 200:
+                    return response.json()['candidates'][0]['content']['parts'][0]['text']
+                if response.status_code not in RETRY_STATUS:
+                    raise GeminiError(self._error_message(response))
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.max_retries:
+                    raise GeminiError(f"通信エラー: {e}") from e
+            if attempt >= self.max_retries:
+                raise GeminiError(self._error_message(response))
+
+            wait = self._retry_after(response, attempt)
+            if response is not None and response.status_code == 429:
+                self.bucket.penalize(wait)
+            else:
+                self.sleep(wait)
+            self._count("retries")
+            count("ai.retries")
+        raise GeminiError("不明なエラー")
+
+    @staticmethod
+    def _error_message(response):
+        if response is None:
+            return "不明なエラー"
+        try:
+            return response.json().get('error', {}).get('message', '不明なエラー')
+        except ValueError:
+            return f"HTTP {response.status_code}"
+
+_clients = {}
+_clients_lock = threading.Lock()
+_cache = CommentaryCache()
+
+def get_client(api_key):
+    """APIキーごとにプロセス内で1つの共有クライアントを返す（レート制限と応答キャッシュを全呼び出し元で共有するため）"""
+    with _clients_lock:
+        if api_key not in _clients:
+            _clients[api_key] = GeminiClient(api_key, cache=_cache)
+        return _clients[api_key]
+
+def cache_stats():
+    """今回の実行での AI 応答キャッシュのヒット・ミス・破棄の件数"""
+    return dict(_cache.stats)
+
+def strip_markdown(answer):
+    # 装飾タグの強制除去
+    return answer.replace("```html\n", "").replace("```html", "").replace("```", "").strip()
+
+def get_ai_analysis(ticker_code, current_price, tech_data, news_list, api_key):
+    if not api_key: return "APIキー未設定"
+
+    news_text = "\n".join([f"・{n['title']}" for n in news_list]) if news_list else "特になし"
+
+    # 💡 指標の「見せ方」を細かく指定したプロンプト
+    prompt = f"""
+    銘柄:{ticker_code} / 現在値:{current_price}円
+    テクニカルデータ:{tech_data}
+    ニュース:{news_text}
+
+    あなたはプロのAI参謀「IPPO」です。挨拶不要。
+    提供されたデータを統合分析し、以下の構成でレポートを出力してください。
+    ※重要: ```html などのマークダウン記法は絶対に避け、純粋なHTMLタグとテキストのみを出力してください。
+
+    【出力構成ルール】
+    1. 最初に「📊 主要テクニカル指標」という小見出し（<h4>タグ等）をつけ、指標を見やすく整理して箇条書き（<ul><li>）で出力してください。
+       - ボリンジャーバンドは「±2σ」「±3σ」など、関連するものを1行にまとめるなどしてスッキリ見せること。
+       - もし提供されたデータ内に「前日比」や「前日の数値」があれば、必ず併記して比較できるようにすること。
+    2. その下に「💡 IPPOの分析見解」という小見出しをつけ、結論から鋭く語る200文字程度の分析コメントを記述してください。
+    """
+
+    try:
+        return strip_markdown(get_client(api_key).generate(prompt))
+    except GeminiError as e:
+        return f"<div style='color:#ff4d4d;'>【APIエラー】<br>理由: {e}</div>"
+    except Exception as e:
+        return f"<p style='color:red;'>通信エラー: {str(e)}</p>"
+
+def _render_analysis(indicators, analysis):
+    items = "".join(f"<li>{html.escape(str(x))}</li>" for x in indicators)
+    return f"<h4>📊 主要テクニカル指標</h4><ul>{items}</ul><h4>💡 IPPOの分析見解</h4><p>{html.escape(analysis)}</p>"
+
+def parse_batch_response(text, codes):
+    """
+    バッチ応答（JSON配列）を銘柄コードごとの HTML に分ける。
+    依頼していないコード・指標が空・見解が空などスキーマに合わない要素は捨てる（呼び出し側で個別に取り直す）。
+    """
+    try:
+        entries = json.loads(text)
+    except (TypeError, ValueError):
+        return {}
+    if not isinstance(entries, list):
+        return {}
+    results = {}
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        code, indicators, analysis = str(entry.get("code", "")), entry.get("indicators"), entry.get("analysis")
+        if code not in codes or code in results:
+            continue
+        if not isinstance(indicators, list) or not indicators or not isinstance(analysis, str) or not analysis.strip():
+            continue
+        results[code] = _render_analysis(indicators, analysis.strip())
+    return results
+
+def _batch_prompt(items):
+    tickers = [{
+        "code": item["code"], "price": item["price"], "technical": item["tech_data"],
+        "news": [n['title'] for n in item.get("news") or []] or ["特になし"],
+    } for item in items]
+    return f"""
+    あなたはプロのAI参謀「IPPO」です。挨拶不要。
+    以下の各銘柄について、提供されたデータを統合分析してください。
+    銘柄データ(JSON):{json.dumps(tickers, ensure_ascii=False)}
+
+    【出力ルール】
+    各銘柄につき1要素の JSON 配列で出力してください（code は入力と同じ文字列）。
+    - indicators: 主要テクニカル指標を見やすく整理した短い文の配列。関連する指標は1行にまとめ、前日比や前日の数値があれば必ず併記すること。
+    - analysis: 結論から鋭く語る200文字程度の分析コメント（HTMLタグやマークダウンは使わない）。
+    """
+
+def get_ai_analysis_batch(items, api_key, batch_size=AI_BATCH_SIZE):
+    """
+    複数銘柄の分析を batch_size 件ずつ1リクエストにまとめ、JSON スキーマ指定の応答を銘柄ごとに分けて返す。
+    items は {"code", "price", "tech_data", "news"} のリスト。戻り値は {銘柄コード: HTML}。
+    バッチの失敗・検証に通らなかった銘柄だけ get_ai_analysis で個別に取り直す。
+    """
+    if not api_key or not items:
+        return {}
+    client = get_client(api_key)
+    config = {"responseMimeType": "application/json", "responseSchema": BATCH_RESPONSE_SCHEMA}
+    batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+
+    def run_batch(batch):
+        codes = {item["code"] for item in batch}
+        try:
+            text = client.generate(_batch_prompt(batch), config, validate=lambda t: len(parse_batch_response(t, codes)) == len(codes))
+            return parse_batch_response(text, codes)
+        except Exception as e:
+            print(f"AI一括分析エラー（個別に再取得します）: {e}")
+            return {}
+
+    results = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=GEMINI_MAX_CONCURRENCY) as executor:
+        for part in executor.map(run_batch, batches):
+            results.update(part)
+
+        missing = [item for item in items if item["code"] not in results]
+        singles = executor.map(lambda item: get_ai_analysis(item["code"], item["price"], item["tech_data"], item.get("news"), api_key), missing)
+        for item, comment in zip(missing, singles):
+            results[item["code"]] = comment
+    return results
@@ -1,187 +1,346 @@
-import yfinance as yf
 import pandas as pd
+import numpy as np
 import json
 import os
+import sys
 from datetime import datetime, timedelta, timezone
-from scanner import SCAN_UNIVERSE
-import concurrent.futures
-import time
+from scanner import load_universe
+from price_store import get_history, get_histories
+from technical_calc import add_indicators
+from signal_rules import DEFAULT_PARAMS, required_columns, rule_source, evaluate, market_frame
+from backtest_cache import MARKET_COLUMNS, BacktestCache, data_fingerprint, rules_key
+from metrics import timer
+from strategy_stats import SUMMARY_PATH
+from portfolio import close_matrix, run_portfolio, sweep_settings, write_portfolio
+from exit_rules import EXIT_PROFILES, PRICE_COLUMNS, REASON_NAMES, strategy_exits, summarize_exits
 
 JST = timezone(timedelta(hours=9))
 
-def process_backtest_ticker(code, nk_data, start_str, end_str):
-    max_retries = 3
-    base_wait = 2
+STRATEGIES = ("BREAKOUT", "PULLBACK", "REVERSAL")
+STRATEGY_NAMES = {
+    "BREAKOUT": "🚀 上昇加速型",
+    "PULLBACK": "🟢 押し目拾い型",
+    "REVERSAL": "🔄 底打ち確認型"
+}
 
-    stats = {
-        "BREAKOUT": {"trades": 0, "wins": 0, "return_pct": 0.0},
-        "PULLBACK": {"trades": 0, "wins": 0, "return_pct": 0.0},
-        "REVERSAL": {"trades": 0, "wins": 0, "return_pct": 0.0}
+# シグナル翌日の始値で買い、h営業日後の終値で売る（サマリーは従来どおり5日後決済）
+HOLDING_PERIODS = (1, 3, 5, 10, 20)
+SUMMARY_HOLDING = 5
+TRADES_PATH = "public/backtest_trades.csv"
+# 💡 バックテストの銘柄は全市場スキャン用の tse_universe.csv とは別に持つ（CSV を JPX の全銘柄一覧に置き換えても、日次のバックテストは全銘柄を取得しない）
+# backtest_universe.csv（tse_universe.csv と同じ形式）があればその銘柄、無ければ監視リスト
+BACKTEST_UNIVERSE_PATH = "backtest_universe.csv"
+BACKTEST_UNIVERSE = load_universe(BACKTEST_UNIVERSE_PATH)
+# これより日足の短い銘柄（新規上場など）はバックテストしない
+MIN_BACKTEST_ROWS = 250
+# トレード記録の形式を変えたら上げる（バックテストキャッシュを作り直す）
+CACHE_VERSION = 1
+
+# ブートストラップ信頼区間（再標本化の回数・信頼水準。1回の配列演算に載せる要素数の上限を超える分は分割する）
+BOOTSTRAP_RESAMPLES = 5000
+BOOTSTRAP_CONFIDENCE = 95
+BOOTSTRAP_MAX_ELEMENTS = 5_000_000
+
+# signal_masks が使う列（戦術の条件としきい値 DEFAULT_PARAMS は signal_rules に定義）
+SIGNAL_COLUMNS = required_columns(STRATEGIES)
+
+def signal_masks(cols, params=None):
+    """
+    戦術ごとのシグナル発生（ブール配列）を求める。cols は SIGNAL_COLUMNS をキーにした同じ形の配列で、
+    1銘柄の1次元でも (銘柄 × 日) の2次元でもよい（NaN を含む比較は False）。
+    """
+    masks = evaluate(cols, STRATEGIES, params)
+    return {strategy: masks[strategy] for strategy in STRATEGIES}
+
+def forward_returns(opens, closes, holding_periods=HOLDING_PERIODS):
+    """
+    全日付について「翌日始値で買い、h日後の終値で売った場合」の騰落率(%)をずらした配列で一括計算する。
+    opens・closes は最後の軸が日付の配列（1銘柄の1次元でも (銘柄 × 日) でもよい）。
+    戻り値は (翌日始値の配列, {h: 騰落率の配列})。期間が足りない・価格が無い日は NaN。
+    """
+    n = opens.shape[-1]
+    entry = np.full(opens.shape, np.nan)
+    entry[..., :-1] = opens[..., 1:]
+    entry[entry == 0] = np.nan
+
+    returns = {}
+    for h in holding_periods:
+        exit_price = np.full(closes.shape, np.nan)
+        if h < n:
+            exit_price[..., :-h] = closes[..., h:]
+        returns[h] = (exit_price - entry) / entry * 100
+    return entry, returns
+
+def stack_backtest_frames(frames, nk_data, since=None):
+    """
+    指標列を追加済みの複数銘柄の日足を、最終日をそろえた (銘柄 × 日) の配列に積む（signal_masks 用の列・OHLC・日付）。
+    since（{コード: 'YYYY-MM-DD'}）がある銘柄は、その前日から末尾までだけを積む（前日比の列 Prev_* のために1日前から）。
+    """
+    since = since or {}
+    base = sorted({col[5:] if col.startswith("Prev_") else col for col in SIGNAL_COLUMNS} - {"Is_Good_Market"} | set(PRICE_COLUMNS))
+    codes = list(frames)
+    starts = [max(int(frames[c].index.searchsorted(pd.Timestamp(since[c]))) - 1, 0) if since.get(c) else 0 for c in codes]
+    length = max((len(frames[c]) - start for c, start in zip(codes, starts)), default=0)
+
+    values = np.full((len(codes), length, len(base)), np.nan)
+    dates = np.full((len(codes), length), np.datetime64("NaT"), dtype="datetime64[ns]")
+    for i, (code, start) in enumerate(zip(codes, starts)):
+        df = frames[code]
+        # 列名での選択（df[base]）は銘柄数ぶん積み重なると重いので、位置で取り出す
+        block = df.iloc[start:].to_numpy(dtype=float)[:, [df.columns.get_loc(col) for col in base]]
+        values[i, length - len(block):] = block
+        dates[i, length - len(block):] = df.index.values[start:]
+
+    cols = {col: values[:, :, j] for j, col in enumerate(base)}
+    for col in SIGNAL_COLUMNS:
+        if col.startswith("Prev_"):
+            cols[col] = np.concatenate([np.full((len(codes), 1), np.nan), cols[col[5:]][:, :-1]], axis=1)
+    # 地合い判定は、各銘柄の日付以前で最後の日経平均の値（frame_columns の前方埋めと同じ）
+    if nk_data is None:
+        cols["Is_Good_Market"] = np.full(dates.shape, np.nan)
+    else:
+        market = nk_data["Is_Good_Market"].to_numpy(dtype=float)
+        pos = nk_data.index.values.searchsorted(dates, side="right") - 1
+        cols["Is_Good_Market"] = np.where((pos >= 0) & ~np.isnat(dates), market[np.maximum(pos, 0)], np.nan)
+    return codes, dates, cols
+
+def backtest_frames(frames, nk_data, holding_periods=HOLDING_PERIODS, params=None, exit_profiles=None, since=None):
+    """
+    複数銘柄をまとめてバックテストし、シグナル1件（銘柄×日付×戦術）につき1行のトレード記録を DataFrame で返す。
+    return_{h}d は h日後の終値で決済した場合、exit_* は戦術ごとの手仕舞いルール（exit_rules.EXIT_PROFILES）で決済した場合。
+    シグナル判定・手仕舞い・h日後リターンはすべて (銘柄 × 日) の配列で一括計算する（銘柄ごとのループは積む処理だけ）。
+    since（{コード: 'YYYY-MM-DD'}）がある銘柄は、その日以降のシグナルだけを計算する（指標列は計算済みなので末尾だけでよい）。
+    """
+    columns = trade_columns(holding_periods)
+    frames = {code: df for code, df in frames.items() if df is not None and len(df) >= MIN_BACKTEST_ROWS}
+    if not frames:
+        return pd.DataFrame(columns=columns)
+
+    codes, dates, cols = stack_backtest_frames(frames, nk_data, since)
+    masks = signal_masks(cols, params)
+    if since:
+        first = np.array([np.datetime64(since[c]) if since.get(c) else np.datetime64("NaT") for c in codes], dtype="datetime64[ns]")
+        recent = np.isnat(first)[:, None] | (dates >= first[:, None])
+        masks = {strategy: mask & recent for strategy, mask in masks.items()}
+
+    # 💡 全銘柄・全戦術のシグナルをまとめて1回で手仕舞い判定する
+    exits = strategy_exits({col: cols[col] for col in PRICE_COLUMNS}, masks, exit_profiles)
+    rows, days, entry = exits["rows"], exits["days"], exits["entry"]
+    if len(rows) == 0:
+        return pd.DataFrame(columns=columns)
+
+    # シグナル翌日の始値で買い、h日後の終値で売った場合（期間が足りなければ NaN）
+    closes = cols["Close"]
+    trades = {"code": np.array(codes, dtype=object)[rows], "date": pd.DatetimeIndex(dates[rows, days]).strftime('%Y-%m-%d').to_numpy(),
+              "strategy": exits["strategy"], "entry": entry}
+    for h in holding_periods:
+        exit_day = days + h
+        exit_price = np.where(exit_day < closes.shape[1], closes[rows, np.minimum(exit_day, closes.shape[1] - 1)], np.nan)
+        trades[f"return_{h}d"] = (exit_price - entry) / entry * 100
+    trades["exit_return"] = exits["exit_return"]
+    trades["exit_days"] = exits["exit_days"]
+    trades["exit_reason"] = exits["exit_reason"]
+    return sort_trades(pd.DataFrame(trades), codes)
+
+def sort_trades(trades, codes):
+    """トレード記録を 銘柄（codes の順）→ 戦術 → 日付 の順に並べる"""
+    code_order = {code: i for i, code in enumerate(codes)}
+    strategy_order = {strategy: i for i, strategy in enumerate(STRATEGIES)}
+    order = np.lexsort((trades["date"].to_numpy(), trades["strategy"].map(strategy_order).to_numpy(), trades["code"].map(code_order).to_numpy()))
+    return trades.iloc[order].reset_index(drop=True)
+
+def summarize(returns):
+    """騰落率(%)の配列から回数・勝率・平均リターンを求める（NaN = 未決済は除外）"""
+    returns = np.asarray(returns, dtype=float)
+    returns = returns[~np.isnan(returns)]
+    trades = len(returns)
+    win_rate = float(np.mean(returns > 0) * 100) if trades else 0.0
+    avg_return = float(np.mean(returns)) if trades else 0.0
+    return {"total_signals": trades, "win_rate": round(win_rate, 2), "avg_return": round(avg_return, 2)}
+
+def exit_summary(trades):
+    """手仕舞いルールで決済した場合の成績"""
+    return summarize_exits(trades["exit_return"], trades["exit_days"], trades["exit_reason"])
+
+def bootstrap_ci(returns, resamples=BOOTSTRAP_RESAMPLES, confidence=BOOTSTRAP_CONFIDENCE, seed=0):
+    """
+    騰落率(%)の配列を復元抽出で resamples 回作り直し、勝率と平均リターンの信頼区間を求める。
+    再標本化は (resamples × 件数) の添字配列で一括して行う（Python のループは使わない）。件数が足りなければ None。
+    """
+    returns = np.asarray(returns, dtype=float)
+    returns = returns[~np.isnan(returns)]
+    n = len(returns)
+    if n < 2:
+        return None
+    rng = np.random.default_rng(seed)
+    values = returns.astype(np.float32)   # 再標本は単精度で十分（メモリと時間を半分にする）
+    block = max(1, BOOTSTRAP_MAX_ELEMENTS // n)
+    win_rates, means = [], []
+    for start in range(0, resamples, block):
+        samples = values[rng.integers(0, n, size=(min(block, resamples - start), n), dtype=np.int32)]
+        win_rates.append((samples > 0).mean(axis=1) * 100)
+        means.append(samples.mean(axis=1, dtype=np.float64))
+    win_rates, means = np.concatenate(win_rates), np.concatenate(means)
+    tail = (100 - confidence) / 2
+    return {
+        "confidence": confidence,
+        "resamples": resamples,
+        "win_rate": [round(float(v), 2) for v in np.percentile(win_rates, [tail, 100 - tail])],
+        "avg_return": [round(float(v), 2) for v in np.percentile(means, [tail, 100 - tail])],
+        # 再標本の平均リターンがプラスだった割合（100%に近いほど「たまたまプラス」ではない）
+        "prob_positive": round(float(np.mean(means > 0) * 100), 1),
+    }
+
+def build_summary(trades, holding_periods=HOLDING_PERIODS, exit_profiles=None):
+    col = f"return_{SUMMARY_HOLDING}d"
+    overall = summarize(trades[col])
+    profiles = {**EXIT_PROFILES, **(exit_profiles or {})}
+    summary = {
+        "total_signals": overall["total_signals"],
+        "win_rate": overall["win_rate"],
+        "avg_return": overall["avg_return"],
+        "expectancy": overall["avg_return"],
+        "strategies": {},
+        "holding_periods": {str(h): summarize(trades[f"return_{h}d"]) for h in holding_periods},
+        "exits": exit_summary(trades),
+        "ci": bootstrap_ci(trades[col])
     }
+    for strategy in STRATEGIES:
+        st_trades = trades[trades["strategy"] == strategy]
+        summary["strategies"][strategy] = summarize(st_trades[col])
+        summary["strategies"][strategy]["ci"] = bootstrap_ci(st_trades[col])
+        summary["strategies"][strategy]["holding_periods"] = {str(h): summarize(st_trades[f"return_{h}d"]) for h in holding_periods}
+        summary["strategies"][strategy]["exits"] = exit_summary(st_trades)
+        summary["strategies"][strategy]["exit_profile"] = profiles[strategy]
+    return summary
 
-    for attempt in range(max_retries):
-        try:
-            df = yf.Ticker(f"{code}.T").history(start=start_str, end=end_str)
-            if df.empty or len(df) < 250:
-                return stats
-
-            df.index = df.index.tz_localize(None)
-            
-            df['MA5'] = df['Close'].rolling(window=5).mean()
-            df['MA25'] = df['Close'].rolling(window=25).mean()  # 💡 MA25を追加
-            df['MA75'] = df['Close'].rolling(window=75).mean()
-            df['MA200'] = df['Close'].rolling(window=200).mean()
-            df['Vol_Avg20'] = df['Volume'].rolling(window=20).mean().shift(1)
-            df['Vol_Ratio'] = df['Volume'] / df['Vol_Avg20']
-            df['Prev_High'] = df['High'].shift(1)
-            
-            df['High_20'] = df['High'].rolling(window=20).max().shift(1)
-            df['Low_20'] = df['Low'].rolling(window=20).min().shift(1)
-            
-            delta = df['Close'].diff()
-            gain = delta.where(delta > 0, 0).ewm(alpha=1/14, adjust=False).mean()
-            loss = (-delta.where(delta < 0, 0)).ewm(alpha=1/14, adjust=False).mean()
-            rs = gain / loss
-            df['RSI'] = 100 - (100 / (1 + rs))
-            
-            df = df.join(nk_data[['Is_Good_Market']], how='left')
-            df['Is_Good_Market'] = df['Is_Good_Market'].ffill()
-
-            is_yosen = df['Close'] > df['Open']
-            
-            m_breakout = (
-                (df['Is_Good_Market'] == True) & 
-                (df['Vol_Ratio'] >= 2.5) & 
-                (df['Close'] > df['Prev_High']) & 
-                (df['Close'] > df['MA200']) &
-                (df['Close'] > df['High_20'])
-            )
-            
-            # 💡 底打ち確認型の超・厳格化
-            m_reversal = (
-                (df['Low'] <= df['Low_20'] * 1.05) & 
-                (df['Low'] >= df['Low_20']) & 
-                is_yosen & 
-                (df['RSI'] <= 30) &
-                (df['Close'] < df['MA25'] * 0.95) &
-                (df['Close'] > df['MA5'])
-            )
-            
-            ma75_supp = (df['Low'] <= df['MA75'] * 1.03) & (df['Close'] > df['MA75'])
-            ma200_supp = (df['Low'] <= df['MA200'] * 1.03) & (df['Close'] > df['MA200'])
-            m_pullback = (ma75_supp | ma200_supp) & is_yosen & (~m_reversal)
-
-            signal_indices = df[m_breakout | m_pullback | m_reversal].index
-
-            for signal_date in signal_indices:
-                idx = df.index.get_loc(signal_date)
-                
-                if idx + 5 < len(df):
-                    buy_price = df.iloc[idx + 1]['Open']
-                    sell_price = df.iloc[idx + 5]['Close']
-                    
-                    if pd.isna(buy_price) or pd.isna(sell_price) or buy_price == 0:
-                        continue
-
-                    trade_return = (sell_price - buy_price) / buy_price * 100
-                    is_win = 1 if trade_return > 0 else 0
-                    
-                    if m_breakout.loc[signal_date]:
-                        stats["BREAKOUT"]["trades"] += 1
-                        stats["BREAKOUT"]["wins"] += is_win
-                        stats["BREAKOUT"]["return_pct"] += trade_return
-                        
-                    if m_pullback.loc[signal_date]:
-                        stats["PULLBACK"]["trades"] += 1
-                        stats["PULLBACK"]["wins"] += is_win
-                        stats["PULLBACK"]["return_pct"] += trade_return
-                        
-                    if m_reversal.loc[signal_date]:
-                        stats["REVERSAL"]["trades"] += 1
-                        stats["REVERSAL"]["wins"] += is_win
-                        stats["REVERSAL"]["return_pct"] += trade_return
-
-            return stats
-
-        except Exception as e:
-            if attempt < max_retries - 1:
-                time.sleep(base_wait * (2 ** attempt))
-            else:
-                return stats
-
-def analyze():
+def load_backtest_data(universe=None, days=700):
+    """
+    バックテスト用に日経平均（地合い判定付き）と universe（既定は BACKTEST_UNIVERSE）の指標付き日足を用意する。
+    株価は一括取得し、指標は technical_calc でまとめて1回で計算する。
+    """
+    universe = universe or BACKTEST_UNIVERSE
     end_date = datetime.now(JST)
-    start_date = end_date - timedelta(days=700)
-    start_str = start_date.strftime('%Y-%m-%d')
+    start_str = (end_date - timedelta(days=days)).strftime('%Y-%m-%d')
     end_str = (end_date + timedelta(days=1)).strftime('%Y-%m-%d')
 
+    nk = market_frame(get_history("^N225", start_str, end_str))
+
+    frames = get_histories([f"{code}.T" for code in universe.keys()], start_str, end_str)
+    frames = add_indicators({code: frames[f"{code}.T"] for code in universe.keys()})
+    return frames, nk
+
+def settled_mask(trades, holding_periods=HOLDING_PERIODS):
+    """すべての保有期間と手仕舞いルールの決済が済んだ（今後データが増えても結果が変わらない）トレード"""
+    settled = trades["exit_reason"] != "open"
+    for h in holding_periods:
+        settled &= trades[f"return_{h}d"].notna()
+    return settled.to_numpy(dtype=bool)
+
+def backtest_rules_key(params=None, exit_profiles=None, holding_periods=HOLDING_PERIODS):
+    """バックテスト結果を左右する設定（条件式・しきい値・手仕舞いルール・保有日数）のハッシュ"""
+    return rules_key(CACHE_VERSION, rule_source(STRATEGIES), {**DEFAULT_PARAMS, **(params or {})},
+                     {**EXIT_PROFILES, **(exit_profiles or {})}, list(holding_periods), MIN_BACKTEST_ROWS)
+
+def trade_columns(holding_periods=HOLDING_PERIODS):
+    """トレード記録の列"""
+    return (["code", "date", "strategy", "entry"] + [f"return_{h}d" for h in holding_periods] +
+            ["exit_return", "exit_days", "exit_reason"])
+
+def backtest_trades(frames, nk, universe=None, cache=None, params=None, exit_profiles=None):
+    """
+    全銘柄のトレード記録を返す。cache（BacktestCache）を渡すと、ルールと株価の指紋が前回と同じ銘柄は
+    確定済みのトレードを使い回し、未確定のトレードと新しい日足の分だけを（全銘柄まとめて）計算して追記する。
+    """
+    universe = universe or BACKTEST_UNIVERSE
+    frames = {code: frames.get(code) for code in universe.keys()}
+    frames = {code: df for code, df in frames.items() if df is not None and len(df) >= MIN_BACKTEST_ROWS}
+    if cache is None:
+        return backtest_frames(frames, nk, params=params, exit_profiles=exit_profiles)
+
+    rules = backtest_rules_key(params, exit_profiles)
+    meta, cached = cache.load(rules)
+    last_dates = {code: df.index[-1].strftime('%Y-%m-%d') for code, df in frames.items()}
+    nk_prints = {}
+    def fingerprint(code, until):
+        if until not in nk_prints:
+            nk_prints[until] = data_fingerprint(nk, until, MARKET_COLUMNS)
+        return data_fingerprint(frames[code], until) + nk_prints[until]
+
+    # 前回と同じ日足なら全部使い回し、日足が増えただけなら再計算を始める日（resume）より前を使い回す
+    keep_until, since, full = {}, {}, []
+    for code in frames:
+        m = meta.get(code)
+        if m and m["fingerprint"] == fingerprint(code, m["last_date"]):
+            keep_until[code] = "9999-12-31" if m["last_date"] == last_dates[code] else m["resume"]
+            if m["last_date"] != last_dates[code]:
+                since[code] = m["resume"]
+        else:
+            full.append(code)
+
+    parts = [backtest_frames({c: frames[c] for c in since}, nk, params=params, exit_profiles=exit_profiles, since=since),
+             backtest_frames({c: frames[c] for c in full}, nk, params=params, exit_profiles=exit_profiles)]
+    if cached is not None and keep_until:
+        parts.insert(0, cached[cached["date"] < cached["code"].map(keep_until).fillna("")])
+    trades = pd.concat([p for p in parts if len(p)], ignore_index=True) if any(len(p) for p in parts) else parts[-1]
+    # 取得期間の外に出た古いトレードは捨てる（毎回全部計算した場合と同じ範囲にそろえる）
+    first_dates = {code: df.index[0].strftime('%Y-%m-%d') for code, df in frames.items()}
+    trades = sort_trades(trades[trades["date"] >= trades["code"].map(first_dates)], list(frames))
+
+    # 計算し直した銘柄は、決済が済んでいない最初のトレードの日（無ければ最終日）から次回また計算する
+    if since or full:
+        pending = trades[~settled_mask(trades)]
+        first_pending = pending.groupby("code")["date"].min()
+        for code in list(since) + full:
+            meta[code] = {"last_date": last_dates[code], "fingerprint": fingerprint(code, last_dates[code]),
+                          "resume": min(last_dates[code], first_pending.get(code, last_dates[code]))}
+    cache.save(rules, {code: meta[code] for code in frames if code in meta}, trades)
+    print(f"🗃️ バックテストキャッシュ: 再利用 {len(frames) - len(since) - len(full)}銘柄 / 追記 {len(since)}銘柄 / 全計算 {len(full)}銘柄")
+    return trades
+
+def analyze(incremental=True):
+    """
+    戦術別バックテストを実行して performance_summary.json などを書き出し、サマリーを返す。
+    incremental=True なら銘柄ごとの結果をキャッシュし、前回から増えた日足の分だけ計算する（main.py の日次実行向け）。
+    """
     try:
-        nk = yf.Ticker("^N225").history(start=start_str, end=end_str)
-        nk.index = nk.index.tz_localize(None)
-        nk['MA200'] = nk['Close'].rolling(window=200).mean()
-        nk['Is_Good_Market'] = nk['Close'] > nk['MA200']
+        frames, nk = load_backtest_data()
     except Exception as e:
         print(f"日経平均データの取得に失敗: {e}")
-        return
-
-    agg_stats = {
-        "BREAKOUT": {"trades": 0, "wins": 0, "return_pct": 0.0},
-        "PULLBACK": {"trades": 0, "wins": 0, "return_pct": 0.0},
-        "REVERSAL": {"trades": 0, "wins": 0, "return_pct": 0.0}
-    }
+        return None
 
     print("🔍 スイングトレード（5日後決済）の戦術別バックテストを開始します...")
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-        futures = {executor.submit(process_backtest_ticker, code, nk, start_str, end_str): code for code in SCAN_UNIVERSE.keys()}
-        
-        for future in concurrent.futures.as_completed(futures):
-            res = future.result()
-            for strategy in agg_stats.keys():
-                agg_stats[strategy]["trades"] += res[strategy]["trades"]
-                agg_stats[strategy]["wins"] += res[strategy]["wins"]
-                agg_stats[strategy]["return_pct"] += res[strategy]["return_pct"]
-
-    total_trades = sum(agg_stats[s]["trades"] for s in agg_stats)
-    total_wins = sum(agg_stats[s]["wins"] for s in agg_stats)
-    total_return = sum(agg_stats[s]["return_pct"] for s in agg_stats)
-    
-    overall_win_rate = (total_wins / total_trades * 100) if total_trades > 0 else 0.0
-    overall_avg_return = (total_return / total_trades) if total_trades > 0 else 0.0
+    with timer("backtest.trades"):
+        trades = backtest_trades(frames, nk, cache=BacktestCache() if incremental else None)
+    summary = build_summary(trades)
 
-    summary = {
-        "total_signals": total_trades,
-        "win_rate": round(overall_win_rate, 2),
-        "avg_return": round(overall_avg_return, 2),
-        "expectancy": round(overall_avg_return, 2),
-        "strategies": {}
-    }
-
-    strategy_names = {
-        "BREAKOUT": "🚀 上昇加速型",
-        "PULLBACK": "🟢 押し目拾い型",
-        "REVERSAL": "🔄 底打ち確認型"
-    }
+    for strategy in STRATEGIES:
+        st = summary["strategies"][strategy]
+        ci = f" ({st['ci']['confidence']}%区間 勝率 {st['ci']['win_rate'][0]}〜{st['ci']['win_rate'][1]}% / 平均 {st['ci']['avg_return'][0]}〜{st['ci']['avg_return'][1]}%)" if st["ci"] else ""
+        print(f"[{STRATEGY_NAMES[strategy]}] 回数: {st['total_signals']} | 勝率: {round(st['win_rate'], 1)}% | 平均リターン: {st['avg_return']}%{ci}")
+    for h, st in summary["holding_periods"].items():
+        print(f"  保有{h}日: 回数 {st['total_signals']} | 勝率 {st['win_rate']}% | 平均リターン {st['avg_return']}%")
+    for strategy in STRATEGIES:
+        ex = summary["strategies"][strategy]["exits"]
+        reasons = " / ".join(f"{REASON_NAMES[r]} {n}" for r, n in ex["reasons"].items() if n)
+        print(f"  [{STRATEGY_NAMES[strategy]}] 手仕舞いルール: 勝率 {ex['win_rate']}% | 平均リターン {ex['avg_return']}% | 平均保有 {ex['avg_days']}日 ({reasons})")
 
-    for strategy, data in agg_stats.items():
-        st_trades = data["trades"]
-        st_win_rate = (data["wins"] / st_trades * 100) if st_trades > 0 else 0.0
-        st_avg_return = (data["return_pct"] / st_trades) if st_trades > 0 else 0.0
-        
-        summary["strategies"][strategy] = {
-            "total_signals": st_trades,
-            "win_rate": round(st_win_rate, 2),
-            "avg_return": round(st_avg_return, 2)
-        }
-        
-        display_name = strategy_names[strategy]
-        print(f"[{display_name}] 回数: {st_trades} | 勝率: {round(st_win_rate, 1)}% | 平均リターン: {round(st_avg_return, 2)}%")
-
-    print(f"✅ 全テスト完了: 合計トレード {total_trades}回 / 全体勝率 {round(overall_win_rate, 2)}%")
+    print(f"✅ 全テスト完了: 合計トレード {summary['total_signals']}回 / 全体勝率 {summary['win_rate']}%")
 
     os.makedirs("public", exist_ok=True)
-    with open("public/performance_summary.json", "w", encoding="utf-8") as f:
+    with open(SUMMARY_PATH, "w", encoding="utf-8") as f:
         json.dump(summary, f, ensure_ascii=False, indent=2)
+    trades.round(4).to_csv(TRADES_PATH, index=False)
+
+    # 💡 資金・同時保有数・100株単位・手数料を考慮した口座全体の成績（同時保有数と1銘柄の比率も探索して並べる）
+    closes = close_matrix(frames)
+    portfolio = run_portfolio(trades, closes)
+    write_portfolio(portfolio, sweep=sweep_settings(trades, closes))
+    print(f"💼 ポートフォリオ（最大{portfolio['settings']['max_positions']}銘柄）: 総リターン {portfolio['total_return']}% | "
+          f"最大ドローダウン {portfolio['max_drawdown']}% | 回転率 {portfolio['turnover']}回/年 | 売買 {portfolio['trades']}回")
+    return summary
 
 if __name__ == "__main__":
-    analyze()
+    # python analyze_performance.py --full でキャッシュを使わずに全銘柄を計算し直す
+    analyze(incremental="--full" not in sys.argv)
@@ -1,38 +1,46 @@
 import os
-import json
 import time
-import yfinance as yf
 from datetime import datetime, timedelta, timezone
-from watcher import analyze_watch_tickers
-from scanner import scan_b_type
+from watcher import analyze_watch_tickers, WATCH_TICKERS
+from scanner import scan_b_type, load_watchlist
+from price_store import get_histories
+from history_store import HISTORY_DIR, save_report
+from run_context import RunContext
 
 JST = timezone(timedelta(hours=9))
-HISTORY_DIR = "public/history"
 
-def get_trading_days(days_back):
+def get_trading_days(days_back, ctx):
     """7203(トヨタ)を基準に、過去の『実際の営業日』リストを取得する"""
-    end = datetime.now(JST)
-    start = end - timedelta(days=days_back * 2) # 祝日を加味して余裕を持って取得
-    ticker = yf.Ticker("7203.T")
-    df = ticker.history(start=start.strftime('%Y-%m-%d'), end=end.strftime('%Y-%m-%d'))
+    dates = ctx.trading_days(days_back * 2) # 祝日を加味して余裕を持って取得
     
-    if df.empty:
+    if not dates:
         return []
-        
-    df.index = df.index.tz_localize(None)
-    dates = df.index.strftime('%Y-%m-%d').tolist()
     
     # 当日（今日）のデータは、日次の main.py に任せるため除外
-    today_str = end.strftime('%Y-%m-%d')
+    today_str = ctx.now.strftime('%Y-%m-%d')
     past_dates = [d for d in dates if d < today_str]
     
     return past_dates[-days_back:]
 
 def run_backfill(days_back=10):
     os.makedirs(HISTORY_DIR, exist_ok=True)
-    trading_days = get_trading_days(days_back)
+    ctx = RunContext()
+    trading_days = get_trading_days(days_back, ctx)
+    
+    pending = [d for d in trading_days if not os.path.exists(os.path.join(HISTORY_DIR, f"{d}.json"))]
     
     print(f"--- バックフィル開始: 過去 {len(trading_days)} 営業日 ---")
+
+    # 💡 対象全期間（最古の対象日の500日前〜最新の対象日）を全銘柄まとめて1回だけ取得し、
+    #    各営業日の分析はメモリ上でその日時点に切り出して行う（日ごとの再ダウンロード・待機は不要）
+    frames = None
+    if pending:
+        started = time.perf_counter()
+        start_str = (datetime.strptime(pending[0], '%Y-%m-%d') - timedelta(days=500)).strftime('%Y-%m-%d')
+        end_str = (datetime.strptime(pending[-1], '%Y-%m-%d') + timedelta(days=2)).strftime('%Y-%m-%d')
+        symbols = ["^N225"] + [f"{code}.T" for code in list(WATCH_TICKERS) + list(load_watchlist())]
+        frames = get_histories(symbols, start_str, end_str)
+        print(f"📥 株価取得完了: {len(symbols)}銘柄 / {time.perf_counter() - started:.1f}秒")
     
     for date_str in trading_days:
         filepath = os.path.join(HISTORY_DIR, f"{date_str}.json")
@@ -45,7 +53,7 @@ def run_backfill(days_back=10):
         print(f"⏳ 処理中: {date_str} ...", end="", flush=True)
         
         # 1. 指定日の監視銘柄データを取得
-        watch_data = analyze_watch_tickers(date_str)
+        watch_data = analyze_watch_tickers(date_str, frames=frames, ctx=ctx)
         
         # --- 🛡️ データの健全性チェック（GPT防衛線） ---
         # 取得したデータの「最新日付」が、本当に target_date と一致しているか検証
@@ -63,7 +71,7 @@ def run_backfill(days_back=10):
             continue
             
         # 2. 指定日のスキャンデータを取得
-        scan_data = scan_b_type(date_str)
+        scan_data = scan_b_type(date_str, frames=frames, ctx=ctx)
         
         # 3. JSON保存（HTML等の公開ファイルは上書きせず、純粋な履歴のみ生成）
         report_dict = {
@@ -73,12 +81,11 @@ def run_backfill(days_back=10):
             "scan_data": scan_data
         }
         
-        with open(filepath, "w", encoding="utf-8") as f:
-            json.dump(report_dict, f, ensure_ascii=False, indent=2)
+        save_report(filepath, report_dict)
             
         print(f" ✅ 保存完了")
-        time.sleep(2) # yfinanceへのAPIリクエスト過多（Rate Limit）を防ぐためのインターバル
         
+    ctx.print_report()
     print("--- バックフィル完了 ---")
     print("💡 次回の main.py 実行時、performance_tracker がこれらの過去シグナルに対するリターンを自動計算します。")
 
@@ -0,0 +1,54 @@
+import hashlib
+import json
+import os
+import pickle
+import pandas as pd
+
+# 💡 銘柄ごとのバックテスト結果（トレード記録）を、入力の株価と戦術ルールの指紋つきで保存しておく
+# 次回は指紋が変わらない銘柄の確定済みトレードを使い回し、新しく増えた日足の分だけ計算して追記する
+BACKTEST_CACHE_PATH = os.path.join("data_cache", "backtest_cache.pkl")
+
+# 株価が書き換わっていないか（配当・分割の調整など）は、前回の最終日までの直近この本数で確かめる
+FINGERPRINT_ROWS = 20
+PRICE_COLUMNS = ("Open", "High", "Low", "Close", "Volume")
+# 日経平均は地合い判定に使う列だけを確かめる
+MARKET_COLUMNS = ("Close", "Is_Good_Market")
+
+def rules_key(*parts):
+    """戦術の条件式・しきい値・手仕舞いルール・保有日数など、結果を左右する設定のハッシュ"""
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+def data_fingerprint(df, until, columns=PRICE_COLUMNS):
+    """until 日までの直近 FINGERPRINT_ROWS 本の columns（日付を含む）のハッシュ"""
+    end = int(df.index.searchsorted(pd.Timestamp(until), side="right"))
+    start = max(end - FINGERPRINT_ROWS, 0)
+    tail = df.iloc[start:end]
+    values = tail.to_numpy(dtype=float)[:, [df.columns.get_loc(col) for col in columns]]
+    return hashlib.sha1(tail.index.values.tobytes() + values.tobytes()).hexdigest()
+
+class BacktestCache:
+    """
+    全銘柄のトレード記録と、銘柄ごとの「最終日・株価の指紋・再計算を始める日」を1つのファイルに持つキャッシュ。
+    再計算を始める日（resume）は、まだ決済が済んでいない最初のトレードの日（無ければ最終日）。
+    ルールのハッシュが保存時と違えば、何も無かったものとして扱う。
+    """
+    def __init__(self, path=BACKTEST_CACHE_PATH):
+        self.path = path
+
+    def load(self, rules):
+        """({コード: {"last_date", "fingerprint", "resume"}}, トレード記録の DataFrame or None)"""
+        try:
+            with open(self.path, "rb") as f:
+                data = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return {}, None
+        if data.get("rules") != rules:
+            return {}, None
+        return data["tickers"], data["trades"]
+
+    def save(self, rules, tickers, trades):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump({"rules": rules, "tickers": tickers, "trades": trades}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.path)
@@ -0,0 +1,213 @@
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+import numpy as np
+import pandas as pd
+import replay
+from price_store import get_histories
+from technical_calc import add_indicators, stack_frames, compute_indicators
+from signal_rules import market_frame
+from scanner import SCAN_INDICATORS, evaluate_scan_signals, process_ticker, scan_b_type
+from watcher import process_watch_ticker, analyze_watch_tickers
+from analyze_performance import MIN_BACKTEST_ROWS, signal_masks, backtest_trades, build_summary
+from exit_rules import strategy_exits
+from portfolio import close_matrix, run_portfolio
+from parameter_sweep import build_arrays
+from report_generator import generate_files
+from history_store import HISTORY_DIR, save_report, previous_day
+from run_context import RunContext
+
+JST = timezone(timedelta(hours=9))
+
+# 💡 段階ごとの処理時間を、合成データ（銘柄数を変えて）と録画データの再生で計測し、コミットごとに JSON で残す
+SCALES = (12, 500, 4000)
+SYNTHETIC_DAYS = 520
+RESULTS_DIR = "benchmarks"
+REPO_FILES = ("watchlist.json", "tse_universe.csv")
+
+def synthetic_fixture(n_tickers, days=SYNTHETIC_DAYS, seed=0):
+    """ランダムウォークの日足を n_tickers 銘柄分（＋日経平均）作り、録画データと同じ形で返す"""
+    rng = np.random.default_rng(seed)
+    index = pd.bdate_range(end=pd.Timestamp(datetime.now(JST).date()), periods=days)
+    fixture = replay.Fixture(f"synthetic-{n_tickers}")
+    symbols = ["^N225"] + [f"{1000 + i}.T" for i in range(n_tickers)]
+    for symbol in symbols:
+        close = 1000 * np.exp(np.cumsum(rng.normal(0, 0.02, days)))
+        open_ = close * (1 + rng.normal(0, 0.01, days))
+        volume = rng.integers(100_000, 10_000_000, days).astype(float)
+        volume[-1] *= rng.choice([1, 4])
+        fixture.prices[symbol] = pd.DataFrame({
+            "Open": open_, "High": np.maximum(open_, close) * 1.01, "Low": np.minimum(open_, close) * 0.99,
+            "Close": close, "Volume": volume}, index=index)
+    return fixture
+
+@contextlib.contextmanager
+def workdir():
+    """キャッシュや public/ を汚さないよう、一時ディレクトリで実行する"""
+    cwd = os.getcwd()
+    tmp = tempfile.mkdtemp(prefix="bench-")
+    for name in REPO_FILES:
+        if os.path.exists(name):
+            shutil.copy(name, tmp)
+    os.chdir(tmp)
+    try:
+        yield tmp
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp, ignore_errors=True)
+
+class Timer:
+    def __init__(self):
+        self.stages = {}
+
+    @contextlib.contextmanager
+    def __call__(self, name):
+        started = time.perf_counter()
+        yield
+        self.stages[name] = round(time.perf_counter() - started, 4)
+
+def bench_synthetic(n_tickers):
+    fixture = synthetic_fixture(n_tickers)
+    symbols = list(fixture.prices)
+    codes = [s[:-2] for s in symbols if s.endswith(".T")]
+    now = datetime.now(JST)
+    start_str = (now - timedelta(days=800)).strftime('%Y-%m-%d')
+    end_str = (now + timedelta(days=1)).strftime('%Y-%m-%d')
+    timer = Timer()
+
+    with workdir(), replay.replaying(fixture):
+        with timer("fetch_cold"):
+            frames = get_histories(symbols, start_str, end_str)
+        with timer("fetch_warm"):
+            frames = get_histories(symbols, start_str, end_str)
+        nk = market_frame(frames.pop("^N225"))
+        frames = {s[:-2]: df for s, df in frames.items()}
+
+        with timer("indicators"):
+            frames_ind = add_indicators(frames)
+        with timer("signals"):
+            keys, arrays = stack_frames(frames)
+            ind = compute_indicators(arrays, SCAN_INDICATORS)
+            spike, group_a = evaluate_scan_signals(arrays, ind, True)
+            cols, _ = build_arrays(frames_ind, nk)
+            masks = signal_masks(cols)
+        bt_frames = {code: df for code, df in frames_ind.items() if len(df) >= MIN_BACKTEST_ROWS}
+        _, bt_prices = stack_frames(bt_frames)
+        with timer("exits"):
+            exits = strategy_exits(bt_prices, masks)
+        with timer("backtest"):
+            trades = backtest_trades(frames_ind, nk, universe={code: code for code in codes})
+            build_summary(trades)
+        closes = close_matrix(frames_ind)
+        with timer("portfolio"):
+            run_portfolio(trades, closes)
+
+        watch = [process_watch_ticker(code, code, frames_ind[code]) for code in codes[:12]]
+        scan_a, scan_b = [], []
+        for i in np.flatnonzero(spike):
+            result = process_ticker(keys[i], keys[i], frames_ind[keys[i]], True, nk)
+            if result:
+                (scan_a if result["group"] == "A" else scan_b).append(result["data"])
+        scan = {"market_info": {"is_good": True, "text": "benchmark", "nikkei_data": {}}, "scan_a": scan_a, "scan_b": scan_b}
+        report = {"updated_at": now.strftime('%Y/%m/%d %H:%M'), "date": now.strftime('%Y-%m-%d'), "watch_data": watch, "scan_data": scan}
+
+        with timer("history_write"):
+            save_report(os.path.join(HISTORY_DIR, f"{report['date']}.json"), report)
+            previous_day()
+        with timer("report_render"):
+            generate_files(watch, scan)
+
+    rows = int(sum(len(df) for df in frames.values()))
+    return {"tickers": n_tickers, "rows": rows, "spikes": int(spike.sum()), "group_a": int(group_a.sum()),
+            "signals": {k: int(v.sum()) for k, v in masks.items()}, "trades": len(trades), "exits": len(exits["rows"]), "stages": timer.stages}
+
+def bench_replay(name):
+    """録画データで本番と同じ処理（監視銘柄・スキャン・レポート生成）を再生して計測する"""
+    fixture = replay.Fixture(name, os.path.abspath(replay.FIXTURE_DIR)).load()
+    timer = Timer()
+    with workdir(), replay.replaying(fixture):
+        ctx = RunContext()
+        # 録画に Gemini 応答があれば、AI 呼び出しも再生する（watcher は環境変数からキーを読む）
+        api_key = "replay" if fixture.gemini else ""
+        saved_key = os.environ.pop("GEMINI_API_KEY", None)
+        if api_key:
+            os.environ["GEMINI_API_KEY"] = api_key
+        with timer("watch"):
+            watch = analyze_watch_tickers(ctx=ctx)
+        os.environ.pop("GEMINI_API_KEY", None)
+        if saved_key is not None:
+            os.environ["GEMINI_API_KEY"] = saved_key
+        with timer("scan"):
+            scan = scan_b_type(api_key=api_key, ctx=ctx)
+        with timer("report_render"):
+            generate_files(watch, scan, ctx=ctx)
+    return {"fixture": name, "stages": timer.stages}
+
+def record(name):
+    """本番と同じ処理を実際の外部サービスに対して1回実行し、応答を fixtures/<name>/ に録画する"""
+    fixture_dir = os.path.abspath(replay.FIXTURE_DIR)
+    with workdir(), replay.recording(name, fixture_dir) as fixture:
+        ctx = RunContext()
+        analyze_watch_tickers(ctx=ctx)
+        scan_b_type(api_key=os.environ.get("GEMINI_API_KEY", ""), ctx=ctx)
+    print(f"🎥 録画完了: {fixture.dir}（株価 {len(fixture.prices)}銘柄 / ニュース {len(fixture.news)}件 / Gemini {len(fixture.gemini)}件）")
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+def _compare(results, previous):
+    """前回の結果と段階ごとに比べ、遅くなった割合を表示する"""
+    for key, run in results["runs"].items():
+        before = previous.get("runs", {}).get(key)
+        if not before:
+            continue
+        for stage, sec in run["stages"].items():
+            old = before["stages"].get(stage)
+            if old:
+                change = (sec - old) / old * 100
+                mark = "⚠️" if change > 20 else "  "
+                print(f"  {mark} {key} {stage}: {old:.3f}s → {sec:.3f}s ({change:+.0f}%)")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="段階別ベンチマーク（合成データ・録画データの再生）")
+    parser.add_argument("--scales", default=",".join(map(str, SCALES)), help="合成データの銘柄数（カンマ区切り）")
+    parser.add_argument("--replay", help="fixtures/<名前> の録画データを再生して計測する")
+    parser.add_argument("--record", help="実際の外部サービスに対して実行し fixtures/<名前> に録画する")
+    args = parser.parse_args(argv)
+
+    if args.record:
+        record(args.record)
+        return
+
+    results = {"commit": _commit(), "created_at": datetime.now(JST).strftime('%Y-%m-%d %H:%M:%S'), "runs": {}}
+    for n in [int(x) for x in args.scales.split(",") if x]:
+        print(f"⏱️ 合成データ {n}銘柄 ...")
+        results["runs"][f"synthetic_{n}"] = run = bench_synthetic(n)
+        print("   " + " / ".join(f"{k} {v:.3f}s" for k, v in run["stages"].items()))
+    if args.replay:
+        print(f"⏱️ 録画データ {args.replay} ...")
+        results["runs"][f"replay_{args.replay}"] = run = bench_replay(args.replay)
+        print("   " + " / ".join(f"{k} {v:.3f}s" for k, v in run["stages"].items()))
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    previous = sorted(f for f in os.listdir(RESULTS_DIR) if f.endswith(".json"))
+    if previous:
+        with open(os.path.join(RESULTS_DIR, previous[-1]), "r", encoding="utf-8") as f:
+            _compare(results, json.load(f))
+    path = os.path.join(RESULTS_DIR, f"{datetime.now(JST).strftime('%Y%m%d-%H%M%S')}-{results['commit']}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"✅ 結果を保存しました: {path}")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
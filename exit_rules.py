@@ -0,0 +1,137 @@
+import numpy as np
+
+# 💡 手仕舞いルール（損切り・利確・トレーリングストップ・期日決済）を、日足の高値・安値から全シグナル一括で判定する
+# シグナル1件 × 保有日数の窓を2次元配列で切り出し、各行で最初に条件を満たした日（first hit）を argmax で求める（トレードごとの Python ループは使わない）
+
+# 戦術ごとの手仕舞いルール（stop/target/trail は買値・最高値からの比率、None は使わない。max_hold 営業日目の終値で期日決済）
+EXIT_PROFILES = {
+    "BREAKOUT": {"stop": 0.05, "target": 0.15, "trail": 0.07, "max_hold": 20},   # 伸びる銘柄はトレーリングで追いかける
+    "PULLBACK": {"stop": 0.04, "target": 0.08, "trail": None, "max_hold": 10},   # 支持線割れで早めに切り、戻りで利確
+    "REVERSAL": {"stop": 0.05, "target": 0.10, "trail": 0.05, "max_hold": 15},   # 直近安値割れで撤退、反発が鈍れば期日で手仕舞い
+}
+
+# 決済理由（同じ日に損切りと利確の両方に届いた場合は、保守的に損切りが先とみなす）
+EXIT_REASONS = ("stop", "trail", "target", "time", "open")
+REASON_NAMES = {"stop": "損切り", "trail": "トレーリング", "target": "利確", "time": "期日", "open": "未決済"}
+
+PRICE_COLUMNS = ("Open", "High", "Low", "Close")
+
+def _ratio(value):
+    return np.nan if value is None else float(value)
+
+def simulate_exits(prices, rows, days, stop, target, trail, max_hold):
+    """
+    prices は PRICE_COLUMNS をキーにした (銘柄 × 日) の2次元配列、(rows[i], days[i]) がシグナル発生日。
+    シグナル翌日の始値で買い、stop/target/trail（シグナルごとの比率、NaN は使わない）と max_hold で手仕舞う。
+    窓の日ごとに 損切り線 = max(買値 × (1 - stop), 前日までの最高値 × (1 - trail)) と 利確線 = 買値 × (1 + target) を求め、
+    安値が損切り線以下・高値が利確線以上になった最初の日に決済する（寄り付きで線を越えていれば始値で約定）。
+    戻り値は {"entry", "exit_price", "exit_return"(%), "exit_days", "exit_reason"} の配列。期間が足りず決済できないものは NaN / "open"。
+    """
+    rows = np.asarray(rows, dtype=int)
+    days = np.asarray(days, dtype=int)
+    max_hold = np.asarray(max_hold, dtype=int)
+    n_days = prices["Close"].shape[1]
+    window = int(max_hold.max()) if len(rows) else 1
+
+    offsets = np.arange(window)
+    pos = days[:, None] + 1 + offsets
+    in_range = pos < n_days
+    active = in_range & (offsets < max_hold[:, None])
+    pos = np.minimum(pos, n_days - 1)
+    opens, highs, lows, closes = (np.where(in_range, prices[col][rows[:, None], pos], np.nan) for col in PRICE_COLUMNS)
+
+    entry = opens[:, 0]
+    with np.errstate(invalid="ignore"):
+        stop_level = entry * (1 - stop)
+        target_level = entry * (1 + target)
+        # 前日までの最高値（初日は買値）。取引の無い日 (NaN) は fmax で読み飛ばす
+        peak = np.fmax.accumulate(np.concatenate([entry[:, None], highs[:, :-1]], axis=1), axis=1)
+        trail_level = peak * (1 - trail[:, None])
+        stop_line = np.fmax(stop_level[:, None], trail_level)
+
+        hit_stop = active & (lows <= stop_line)
+        hit_target = active & (highs >= target_level[:, None])
+    hit = hit_stop | hit_target
+    first = hit.argmax(axis=1)
+    any_hit = hit.any(axis=1)
+    idx = np.arange(len(rows))
+
+    # 期日決済は max_hold 営業日目の終値（データがまだ無ければ未決済）
+    last = max_hold - 1
+    time_ok = in_range[idx, last]
+    exit_price = np.where(time_ok, closes[idx, last], np.nan)
+    exit_days = np.where(time_ok, max_hold, 0)
+    exit_reason = np.where(time_ok, "time", "open").astype(object)
+
+    stopped = any_hit & hit_stop[idx, first]
+    stop_price = np.fmin(opens[idx, first], stop_line[idx, first])
+    exit_price = np.where(stopped, stop_price, exit_price)
+    exit_reason[stopped] = np.where(trail_level[idx, first] > stop_level, "trail", "stop")[stopped]
+
+    targeted = any_hit & ~stopped
+    target_price = np.fmax(opens[idx, first], target_level)
+    exit_price = np.where(targeted, target_price, exit_price)
+    exit_reason[targeted] = "target"
+
+    exit_days = np.where(any_hit, first + 1, exit_days)
+    with np.errstate(invalid="ignore"):
+        exit_return = (exit_price - entry) / entry * 100
+    return {"entry": entry, "exit_price": exit_price, "exit_return": exit_return, "exit_days": exit_days, "exit_reason": exit_reason}
+
+def strategy_exits(prices, masks, profiles=None):
+    """
+    戦術ごとのシグナル (masks: 戦術名 → prices と同じ形のブール配列) を全戦術まとめて1回の simulate_exits で手仕舞いする。
+    翌日の始値が無いシグナルは除く。戻り値は simulate_exits の結果に "strategy", "rows", "days" を加えたもの（戦術順・日付順）。
+    """
+    profiles = {**EXIT_PROFILES, **(profiles or {})}
+    closes = prices["Close"]
+    next_open = np.full(closes.shape, np.nan)
+    next_open[:, :-1] = prices["Open"][:, 1:]
+    tradable = ~np.isnan(next_open) & (next_open != 0)
+
+    strategies, rows, days, params = [], [], [], []
+    for strategy, mask in masks.items():
+        r, d = np.nonzero(np.atleast_2d(mask) & tradable)
+        p = profiles[strategy]
+        strategies.append(np.full(len(r), strategy, dtype=object))
+        rows.append(r)
+        days.append(d)
+        params.append(np.repeat([[_ratio(p["stop"]), _ratio(p["target"]), _ratio(p["trail"]), p["max_hold"]]], len(r), axis=0))
+    rows, days = np.concatenate(rows), np.concatenate(days)
+    params = np.concatenate(params)
+
+    result = simulate_exits(prices, rows, days, params[:, 0], params[:, 1], params[:, 2], params[:, 3].astype(int))
+    return {"strategy": np.concatenate(strategies), "rows": rows, "days": days, **result}
+
+def exit_rule_text(profile):
+    """手仕舞いルールの短い説明（例: 損切り-5% / 利確+15% / トレーリング-7% / 20日）"""
+    parts = []
+    if profile.get("stop") is not None:
+        parts.append(f"損切り-{profile['stop'] * 100:g}%")
+    if profile.get("target") is not None:
+        parts.append(f"利確+{profile['target'] * 100:g}%")
+    if profile.get("trail") is not None:
+        parts.append(f"トレーリング-{profile['trail'] * 100:g}%")
+    if profile.get("max_hold"):
+        parts.append(f"{profile['max_hold']}日")
+    return " / ".join(parts)
+
+def summarize_exits(returns, exit_days, reasons):
+    """手仕舞いルールでの成績（決済済みのみ）と決済理由の内訳"""
+    returns = np.asarray(returns, dtype=float)
+    exit_days = np.asarray(exit_days, dtype=float)
+    reasons = np.asarray(reasons, dtype=object)
+    closed = ~np.isnan(returns)
+    r = returns[closed]
+    trades = len(r)
+    wins, losses = r[r > 0], r[r <= 0]
+    return {
+        "total_signals": trades,
+        "win_rate": round(float(np.mean(r > 0) * 100), 2) if trades else 0.0,
+        "avg_return": round(float(np.mean(r)), 2) if trades else 0.0,
+        "avg_win": round(float(np.mean(wins)), 2) if len(wins) else 0.0,
+        "avg_loss": round(float(np.mean(losses)), 2) if len(losses) else 0.0,
+        "profit_factor": round(float(wins.sum() / -losses.sum()), 2) if losses.sum() < 0 else None,
+        "avg_days": round(float(np.mean(exit_days[closed])), 1) if trades else 0.0,
+        "reasons": {reason: int(np.sum(reasons == reason)) for reason in EXIT_REASONS},
+    }
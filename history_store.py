@@ -0,0 +1,322 @@
+import gzip
+import json
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from metrics import count, timer
+from price_store import adjusted_at, stored_history
+from signal_rules import chart_history
+from technical_calc import add_technicals
+
+JST = timezone(timedelta(hours=9))
+
+# 💡 日次の履歴JSONはその日のシグナル・数値だけを持ち、チャート用の株価は銘柄ごとの共有系列に1本だけ保存する
+HISTORY_DIR = "public/history"
+PRICES_DIR = "public/prices"
+HISTORY_FORMAT = 2
+# 復元する history_data の本数（signal_rules.chart_history と同じ）
+HISTORY_BARS = 120
+
+# 日付 → シグナル・A/B群・価格・一推しの索引（履歴JSONを開かずに前日のA群などを引くため）
+INDEX_PATH = os.path.join(HISTORY_DIR, "index.json")
+INDEX_FORMAT = 1
+# シグナル文言に含まれる戦術名 → 戦術ID
+SIGNAL_TAGS = {"上昇加速型": "BREAKOUT", "押し目拾い型": "PULLBACK", "底打ち確認型": "REVERSAL", "天井警戒型": "TOP_WARNING"}
+# 索引の群: A = 本命, B = 出来高急増, W = 監視銘柄
+INDEX_GROUPS = (("scan_a", "A"), ("scan_b", "B"), ("watch_data", "W"))
+
+_index_lock = threading.Lock()
+
+# 株価系列の列（history_data の各キー）と丸め桁数（None は整数）
+PRICE_FIELDS = {"open": 2, "high": 2, "low": 2, "close": 2, "volume": None, "ma25": 2, "ma75": 2, "ma200": 2}
+# 共有株価系列の1行の並び（日付 + PRICE_FIELDS）
+SERIES_FIELDS = ["time"] + list(PRICE_FIELDS)
+
+def _price_path(code):
+    return os.path.join(PRICES_DIR, f"{code}.json")
+
+def _legacy_price_path(code):
+    # 以前の gzip 形式（毎日ファイル全体が書き換わり git の差分圧縮が効かないため廃止）
+    return os.path.join(PRICES_DIR, f"{code}.json.gz")
+
+def _round(value, digits):
+    if value is None:
+        return None
+    return int(round(value)) if digits is None else round(float(value), digits)
+
+def _atomic_write(path, data):
+    count("persist.bytes_written", len(data))
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def load_series(code):
+    """銘柄の共有株価系列 {"code", "fields", "rows": [[日付, 始値, ...], ...]} を読む（旧 gzip 形式も読める）。無ければ None"""
+    path = _price_path(code)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    legacy = _legacy_price_path(code)
+    if not os.path.exists(legacy):
+        return None
+    with open(legacy, "rb") as f:
+        old = json.loads(gzip.decompress(f.read()).decode("utf-8"))
+    return {"code": code, "fields": SERIES_FIELDS, "rows": [list(r) for r in zip(old["time"], *(old[k] for k in PRICE_FIELDS))]}
+
+def save_series(code, series):
+    # 💡 圧縮しないJSONで1行に日足1本を書く（毎日の追記は末尾の数行の差分になり、git の差分圧縮が効く）
+    head = json.dumps({k: v for k, v in series.items() if k != "rows"}, ensure_ascii=False, separators=(",", ":"))
+    rows = ",\n".join(json.dumps(row, ensure_ascii=False, separators=(",", ":")) for row in series["rows"])
+    _atomic_write(_price_path(code), f'{head[:-1]},"rows":[\n{rows}\n]}}\n'.encode("utf-8"))
+    if os.path.exists(_legacy_price_path(code)):
+        os.remove(_legacy_price_path(code))
+
+def _series_row(row):
+    return [row["time"]] + [_round(row.get(k), d) for k, d in PRICE_FIELDS.items()]
+
+def rebuild_series(code):
+    """price_store に保存済みの全期間の日足から系列を作り直す（保存期間より古い日付は、調整前の株価なので捨てる）"""
+    df = stored_history(f"{code}.T")
+    if df.empty:
+        return None
+    rows = chart_history(add_technicals(df), bars=len(df))
+    return {"code": code, "fields": SERIES_FIELDS, "rows": [_series_row(row) for row in rows]}
+
+def append_bars(code, history_data):
+    """
+    history_data（日足の辞書リスト）のうち、系列に無い日付だけを丸めて追記する（保存済みの日付は書き換えない）。
+    ただし前回の保存以降に price_store が配当・分割の再調整で株価を取り直していれば、系列全体を作り直す。
+    系列が変わった場合のみ True を返す。
+    """
+    series = load_series(code)
+    adjusted = adjusted_at(f"{code}.T")
+    rewrite = series is not None and not os.path.exists(_price_path(code))
+    if series is None:
+        series = {"code": code, "fields": SERIES_FIELDS, "rows": []}
+        if adjusted:
+            series["adjusted_at"] = adjusted
+    elif adjusted and adjusted > series.get("adjusted_at", 0):
+        series = {**(rebuild_series(code) or series), "adjusted_at": adjusted}
+        rewrite = True
+
+    known = {row[0] for row in series["rows"]}
+    new_rows = [_series_row(row) for row in history_data if row.get("time") and row["time"] not in known]
+    if not new_rows and not rewrite:
+        return False
+    series["rows"] = sorted(series["rows"] + new_rows, key=lambda r: r[0])
+    save_series(code, series)
+    return True
+
+def compact_report(report):
+    """
+    レポートの各銘柄から history_data を取り除き、株価は共有系列へ追記する。
+    チャートの印（history_data の "signal"）は共有系列に入れないので、[日付, ルール名] の組で markers に残す。
+    元の辞書は書き換えず、コンパクト化した辞書を返す。
+    """
+    def strip(item):
+        if "history_data" not in item:
+            return item
+        append_bars(item["code"], item["history_data"])
+        compact_item = {k: v for k, v in item.items() if k != "history_data"}
+        markers = [[row["time"], row["signal"]] for row in item["history_data"] if row.get("signal")]
+        if markers:
+            compact_item["markers"] = markers
+        return compact_item
+
+    # 初期の履歴は scan_data がリスト（株価系列なし）なのでそのまま残す
+    scan = report.get("scan_data")
+    if isinstance(scan, dict):
+        scan = {k: [strip(item) for item in v] if k in ("scan_a", "scan_b") else v for k, v in scan.items()}
+    compact = {"format": HISTORY_FORMAT, **{k: v for k, v in report.items() if k not in ("watch_data", "scan_data")}}
+    compact["watch_data"] = [strip(item) for item in report.get("watch_data") or []]
+    compact["scan_data"] = scan
+    return compact
+
+def _report_items(report):
+    scan = report.get("scan_data") if isinstance(report.get("scan_data"), dict) else {}
+    return list(report.get("watch_data") or []) + list(scan.get("scan_a") or []) + list(scan.get("scan_b") or [])
+
+def expand_report(report, bars=HISTORY_BARS):
+    """コンパクト形式のレポートに、共有系列からその日時点の history_data（直近 bars 本・丸め済みの値）を復元して従来の形に戻す"""
+    date_str = report.get("date", "")
+    cache = {}
+    for item in _report_items(report):
+        if item.get("error") or "history_data" in item or "code" not in item:
+            continue
+        code = item["code"]
+        if code not in cache:
+            cache[code] = load_series(code)
+        series = cache[code]
+        markers = dict(item.pop("markers", None) or [])
+        if not series:
+            continue
+        rows = [row for row in series["rows"] if row[0] <= date_str][-bars:]
+        item["history_data"] = []
+        for row in rows:
+            bar = {"time": row[0], **{k: (float(v) if v is not None else None) for k, v in zip(PRICE_FIELDS, row[1:])}}
+            if row[0] in markers:
+                bar["signal"] = markers[row[0]]
+            item["history_data"].append(bar)
+    return report
+
+@timer("persist.report")
+def save_report(path, report, index=True):
+    """レポートをコンパクト形式（history_data 無し・インデント無し）で保存し、index=True なら索引も更新する"""
+    body = json.dumps(compact_report(report), ensure_ascii=False, separators=(",", ":"))
+    _atomic_write(path, body.encode("utf-8"))
+    if index:
+        update_index(report)
+
+def load_report(date_str, history_dir=HISTORY_DIR, expand=True):
+    """
+    date_str（YYYY-MM-DD）の履歴JSONを読む。expand=True なら共有系列から history_data を復元して従来のレポート形式で返す
+    （旧形式のファイルはそのまま）。無ければ None。
+    """
+    path = os.path.join(history_dir, f"{date_str}.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        report = json.load(f)
+    if expand and report.get("format") == HISTORY_FORMAT:
+        report.pop("format")
+        expand_report(report)
+    return report
+
+def _is_compact(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read(32).startswith(f'{{"format":{HISTORY_FORMAT}')
+
+def migrate_history(history_dir=HISTORY_DIR, extra_paths=("public/report.json",)):
+    """
+    旧形式（銘柄ごとに120本の history_data を埋め込んだ）の履歴JSONをコンパクト形式に変換する。
+    古い日付から順に処理し、各日付の株価は最初に記録された値を共有系列に残す。変換した件数を返す。
+    """
+    paths = []
+    if os.path.exists(history_dir):
+        paths += [os.path.join(history_dir, f) for f in sorted(os.listdir(history_dir)) if f.endswith(".json") and f != os.path.basename(INDEX_PATH)]
+    paths += [p for p in extra_paths if os.path.exists(p)]
+
+    migrated = 0
+    for path in paths:
+        try:
+            if _is_compact(path):
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                report = json.load(f)
+            save_report(path, report, index=path.startswith(history_dir))
+            migrated += 1
+        except Exception as e:
+            print(f"履歴の変換に失敗: {path} ({e})")
+    return migrated
+
+def signal_tags(signals):
+    """シグナル文言のリストから戦術ID（BREAKOUT など）を取り出す"""
+    return [tag for name, tag in SIGNAL_TAGS.items() if any(name in s for s in signals or [])]
+
+def _index_entry(report):
+    scan = report.get("scan_data") if isinstance(report.get("scan_data"), dict) else {}
+    sections = {"watch_data": report.get("watch_data") or [], **scan}
+    names, rows, top_pick = {}, [], None
+    for key, group in INDEX_GROUPS:
+        for item in sections.get(key) or []:
+            if item.get("error") or "code" not in item:
+                continue
+            names[item["code"]] = item.get("name", "")
+            rows.append([item["code"], group, item.get("price"), signal_tags(item.get("signals"))])
+            if item.get("is_top_pick"):
+                top_pick = item["code"]
+    market_good = (scan.get("market_info") or {}).get("is_good")
+    return names, {"market_good": market_good, "top_pick": top_pick, "rows": rows}
+
+def _empty_index():
+    return {"format": INDEX_FORMAT, "names": {}, "days": {}}
+
+def _save_index(index, path):
+    body = json.dumps(index, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+    _atomic_write(path, body.encode("utf-8"))
+
+def update_index(report, path=INDEX_PATH):
+    """1日分のレポートを索引に反映する（一時ファイルへ書いてから置き換えるので、読み手が壊れた索引を見ることはない）"""
+    date_str = report.get("date")
+    if not date_str:
+        return
+    with _index_lock:
+        index = load_index(path)
+        names, entry = _index_entry(report)
+        index["names"].update(names)
+        index["days"][date_str] = entry
+        _save_index(index, path)
+
+def rebuild_index(history_dir=HISTORY_DIR, path=INDEX_PATH):
+    """履歴JSONを全件読み直して索引を作り直す（索引が無いときの初回作成用）"""
+    index = _empty_index()
+    if os.path.exists(history_dir):
+        for f_name in sorted(os.listdir(history_dir)):
+            if not f_name.endswith(".json") or os.path.join(history_dir, f_name) == path:
+                continue
+            try:
+                with open(os.path.join(history_dir, f_name), "r", encoding="utf-8") as f:
+                    report = json.load(f)
+            except Exception as e:
+                print(f"索引の作成で履歴の読み込みに失敗: {f_name} ({e})")
+                continue
+            report.setdefault("date", f_name[:-len(".json")])
+            names, entry = _index_entry(report)
+            index["names"].update(names)
+            index["days"][report["date"]] = entry
+    _save_index(index, path)
+    return index
+
+def load_index(path=INDEX_PATH):
+    if not os.path.exists(path):
+        return rebuild_index(path=path) if path == INDEX_PATH else _empty_index()
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _row_dict(index, date_str, row):
+    code, group, price, tags = row
+    return {"date": date_str, "code": code, "name": index["names"].get(code, ""), "group": group, "price": price, "strategies": tags}
+
+def query_signals(code=None, strategy=None, group=None, days=None, end_date=None, path=INDEX_PATH):
+    """
+    索引から条件に合う記録を日付順に返す。
+    例: query_signals(code="8035", strategy="BREAKOUT", days=60) → 8035 の直近60日の上昇加速型シグナル
+    """
+    index = load_index(path)
+    end_date = end_date or datetime.now(JST).strftime('%Y-%m-%d')
+    since = (datetime.strptime(end_date, '%Y-%m-%d') - timedelta(days=days)).strftime('%Y-%m-%d') if days else ""
+    results = []
+    for date_str in sorted(index["days"]):
+        if date_str < since or date_str > end_date:
+            continue
+        for row in index["days"][date_str]["rows"]:
+            if code and row[0] != code:
+                continue
+            if group and row[1] != group:
+                continue
+            if strategy and strategy not in row[3]:
+                continue
+            results.append(_row_dict(index, date_str, row))
+    return results
+
+def previous_day(before=None, path=INDEX_PATH):
+    """
+    before（既定は今日）より前で最新の営業日の記録を、群ごとに分けて返す。無ければ None。
+    戻り値: {"date", "market_good", "top_pick", "scan_a", "scan_b", "watch_data"}（各要素は code/name/price/strategies）
+    """
+    index = load_index(path)
+    before = before or datetime.now(JST).strftime('%Y-%m-%d')
+    dates = [d for d in index["days"] if d < before]
+    if not dates:
+        return None
+    date_str = max(dates)
+    day = index["days"][date_str]
+    result = {"date": date_str, "market_good": day["market_good"], "top_pick": day["top_pick"]}
+    for key, group in INDEX_GROUPS:
+        result[key] = [_row_dict(index, date_str, row) for row in day["rows"] if row[1] == group]
+    return result
+
+if __name__ == "__main__":
+    print(f"✅ 履歴JSONを変換しました: {migrate_history()}件")
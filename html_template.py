@@ -0,0 +1,42 @@
+import html
+import string
+
+# 💡 ダッシュボードの HTML 部品は import 時に一度だけ解析（コンパイル）し、描画時は値を差し込むだけにする
+_formatter = string.Formatter()
+
+class Template:
+    """
+    {name}・{name:,}（書式指定）・{name!e}（HTML エスケープ）の差し込み位置を事前に解析したテンプレート。
+    波括弧そのものは f 文字列と同じく {{ }} と書く。
+    """
+    def __init__(self, text):
+        self.parts = []
+        literal = ""
+        for text_part, field, spec, conversion in _formatter.parse(text):
+            literal += text_part
+            if field is None:
+                continue
+            if not field.isidentifier():
+                raise ValueError(f"テンプレートの差し込み名が不正です: {field!r}")
+            self.parts.append((literal, field, spec or "", conversion))
+            literal = ""
+        self.tail = literal
+
+    def chunks(self, values):
+        for literal, field, spec, conversion in self.parts:
+            if literal:
+                yield literal
+            value = values[field]
+            if conversion == "e":
+                value = html.escape(str(value))
+            yield format(value, spec) if spec else str(value)
+        if self.tail:
+            yield self.tail
+
+    def render(self, **values):
+        return "".join(self.chunks(values))
+
+    def stream(self, write, **values):
+        """描画結果を文字列に組み立てず、部品ごとに write（ファイルの write など）へ流す"""
+        for chunk in self.chunks(values):
+            write(chunk)
@@ -1,17 +1,26 @@
 import os
 import sys
 import smtplib
-import yfinance as yf
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from datetime import datetime, timedelta, timezone
-from scanner import scan_b_type
-from watcher import analyze_watch_tickers
+from scanner import scan_b_type, load_watchlist
+from watcher import WATCH_TICKERS, analyze_watch_tickers
+from price_store import get_histories
 from report_generator import generate_files, load_previous_report
+from run_context import CALENDAR_SYMBOL, RunContext
+from pipeline import Pipeline
+from history_store import migrate_history
+from ai_analyzer import cache_stats
+from analyze_performance import analyze
+import metrics
 
 # 日本時間のタイムゾーン設定
 JST = timezone(timedelta(hours=9))
 
+# 監視銘柄の分析とスキャンが読む日足の期間（暦日）
+HISTORY_DAYS = 500
+
 # 🚨【新規追加】APIキーを環境変数またはテキストファイルから読み込む
 def load_api_key():
     key = os.environ.get("GEMINI_API_KEY", "")
@@ -39,16 +48,14 @@ def send_email(text_body, subject=None):
     except Exception:
         pass
 
-def check_market_updated():
-    today_str = datetime.now(JST).strftime('%Y-%m-%d')
+def check_market_updated(ctx):
+    today_str = ctx.now.strftime('%Y-%m-%d')
     try:
-        ticker = yf.Ticker("7203.T")
-        df = ticker.history(period="5d")
-        if df.empty:
+        dates = ctx.trading_days(10)
+        if not dates:
             return False, "データ取得失敗"
         
-        df.index = df.index.tz_localize(None)
-        latest_date = df.index[-1].strftime('%Y-%m-%d')
+        latest_date = dates[-1]
         
         if latest_date == today_str:
             return True, latest_date
@@ -57,40 +64,7 @@ def check_market_updated():
     except Exception as e:
         return False, str(e)
 
-def main():
-    today_str = datetime.now(JST).strftime('%Y-%m-%d')
-    
-    is_updated, latest_date = check_market_updated()
-    
-    if not is_updated:
-        subject = f"🚨【休場・未更新】株価データ処理スキップ [{today_str}]"
-        body = f"本日（{today_str}）の株価データが提供元に未反映、または休場日のため、\n"
-        body += f"分析と履歴の保存を安全に停止しました。\n\n"
-        body += f"最新取得日：{latest_date}\n\n"
-        body += "誤ったデータによる統計汚染を防ぐための正常な処理ストップです。\n"
-        body += "相場再開日のデータが揃い次第、自動的に正常稼働いたします。\n"
-        print(f"データ未更新のため本来はここで終了します。最新データ日付: {latest_date}")
-        # sys.exit(0)
-
-    print("🚀 [START] 株価分析システム 本番バッチ処理を開始します...")
-    
-    print("\n🔍 監視銘柄の分析を開始...")
-    watch_results = analyze_watch_tickers()
-    print(f"✅ 監視銘柄の分析完了: {len(watch_results)}銘柄")
-
-    print("\n🔍 市場全体のスキャンを開始...")
-    # 🚨【修正】APIキーを取得してスキャナーに渡す
-    gemini_api_key = load_api_key()
-    scan_results = scan_b_type(api_key=gemini_api_key)
-    print(f"✅ スキャン完了: A群 {len(scan_results['scan_a'])}銘柄 / B群 {len(scan_results['scan_b'])}銘柄")
-
-    print("\n📊 ダッシュボードの生成を開始...")
-    os.makedirs("public", exist_ok=True)
-    prev_report = load_previous_report()
-    generate_files(watch_results, scan_results, prev_report=prev_report)
-    print("✅ ダッシュボード生成完了: public/index.html")
-    
-    print("\n📧 メール配信準備中...")
+def build_email_body(watch_results, scan_results):
     market_info = scan_results.get("market_info", {})
     scan_a = scan_results.get("scan_a", [])
     
@@ -125,7 +99,109 @@ def main():
     pages_url = f"https://{username}.github.io/{repo_name}/"
     
     body += f"ダッシュボードはこちら: {pages_url}\n\n"
-    send_email(body)
+    return body
+
+def main(resume=True):
+    metrics.reset()
+    # 💡 営業日カレンダー・地合い・マクロ情報などは、この実行コンテキストで1回だけ取得して各モジュールで共有する
+    ctx = RunContext()
+    today_str = ctx.now.strftime('%Y-%m-%d')
+    # 🚨【修正】APIキーを取得してスキャナーに渡す
+    gemini_api_key = load_api_key()
+
+    def prices():
+        # 💡 営業日カレンダー・監視銘柄・スキャンが読む銘柄の不足分を、ここで1回だけまとめて取得する
+        #    （並列に走る後続ステージがそれぞれ同じ末尾をダウンロードし、同じキャッシュに書き込み合わないように）
+        start_str = (ctx.now - timedelta(days=HISTORY_DAYS)).strftime('%Y-%m-%d')
+        end_str = (ctx.now + timedelta(days=1)).strftime('%Y-%m-%d')
+        codes = dict.fromkeys(list(WATCH_TICKERS) + list(load_watchlist()))
+        symbols = ["^N225", CALENDAR_SYMBOL] + [f"{code}.T" for code in codes]
+        frames = get_histories(symbols, start_str, end_str)
+        print(f"✅ 株価データの準備完了: {len(frames)}銘柄")
+        return frames
+
+    def market_check(prices):
+        # 営業日カレンダーは prices で取得済みの基準銘柄をキャッシュから読む
+        is_updated, latest_date = check_market_updated(ctx)
+        if not is_updated:
+            subject = f"🚨【休場・未更新】株価データ処理スキップ [{today_str}]"
+            body = f"本日（{today_str}）の株価データが提供元に未反映、または休場日のため、\n"
+            body += f"分析と履歴の保存を安全に停止しました。\n\n"
+            body += f"最新取得日：{latest_date}\n\n"
+            body += "誤ったデータによる統計汚染を防ぐための正常な処理ストップです。\n"
+            body += "相場再開日のデータが揃い次第、自動的に正常稼働いたします。\n"
+            print(f"データ未更新のため本来はここで終了します。最新データ日付: {latest_date}")
+            # sys.exit(0)
+        return is_updated, latest_date
+
+    def watch(prices):
+        print("\n🔍 監視銘柄の分析を開始...")
+        watch_results = analyze_watch_tickers(frames=prices, ctx=ctx)
+        print(f"✅ 監視銘柄の分析完了: {len(watch_results)}銘柄")
+        return watch_results
+
+    def scan(prices):
+        print("\n🔍 市場全体のスキャンを開始...")
+        scan_results = scan_b_type(api_key=gemini_api_key, frames=prices, ctx=ctx)
+        print(f"✅ スキャン完了: A群 {len(scan_results['scan_a'])}銘柄 / B群 {len(scan_results['scan_b'])}銘柄")
+        return scan_results
+
+    def previous():
+        return load_previous_report(ctx)
+
+    def performance(scan):
+        # 💡 戦術別バックテストは前回から増えた日足の分だけ計算し直す（株価はスキャンで取得済みのキャッシュを使う）
+        print("\n📈 戦術別バックテストの更新を開始...")
+        try:
+            return analyze(incremental=True)
+        except Exception as e:
+            print(f"⚠️ バックテストの更新に失敗（前回の成績のままダッシュボードを生成します）: {e}")
+            return None
+
+    def report(watch, scan, previous, performance):
+        print("\n📊 ダッシュボードの生成を開始...")
+        os.makedirs("public", exist_ok=True)
+        generate_files(watch, scan, prev_report=previous, ctx=ctx)
+        print("✅ ダッシュボード生成完了: public/index.html")
+
+        stats = cache_stats()
+        print(f"🧠 AIコメントキャッシュ: ヒット {stats['hits']}件 / ミス {stats['misses']}件 / 破棄 {stats['evictions']}件")
+
+        # 旧形式（history_data 埋め込み）の履歴が残っていればコンパクト形式へ変換する（変換済みなら先頭を読むだけ）
+        migrated = migrate_history()
+        if migrated:
+            print(f"🗜️ 旧形式の履歴JSONを変換: {migrated}件")
+        return True
+
+    def email(watch, scan, report):
+        print("\n📧 メール配信準備中...")
+        send_email(build_email_body(watch, scan))
+        return True
+
+    print("🚀 [START] 株価分析システム 本番バッチ処理を開始します...")
+
+    # 💡 株価をまとめて用意したあと、監視銘柄の分析と市場スキャンは互いに独立なので並列に実行する（失敗時は完了済みステージから再開）
+    pipeline = Pipeline(today_str)
+    # 日足はチェックポイントに残さない（再開時もキャッシュから読むだけなので速い）
+    pipeline.add("prices", prices, checkpoint=False)
+    pipeline.add("market_check", market_check, inputs=("prices",))
+    pipeline.add("watch", watch, inputs=("prices",))
+    pipeline.add("scan", scan, inputs=("prices",))
+    pipeline.add("previous", previous)
+    pipeline.add("performance", performance, inputs=("scan",))
+    pipeline.add("report", report, inputs=("watch", "scan", "previous", "performance"))
+    pipeline.add("email", email, inputs=("watch", "scan", "report"), checkpoint=False)
+    try:
+        pipeline.run(resume=resume)
+    except Exception:
+        # 💡 失敗（レート制限の連続など）した実行も、どこで時間と再試行を使ったかを残しておく
+        metrics.write_run_metrics(run_id=today_str, extra={"status": "failed"})
+        raise
+
+    print("⏱️ ステージ別の処理時間: " + " / ".join(f"{name} {sec}秒" for name, sec in pipeline.timings.items()))
+    ctx.print_report()
+    run = metrics.write_run_metrics(run_id=today_str, extra={"status": "ok"})["latest"]
+    metrics.print_summary(run)
     
     print("\n🎉 [SUCCESS] すべての処理が正常に完了し、メール送信を予約しました！")
 
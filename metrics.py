@@ -0,0 +1,89 @@
+import contextlib
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+JST = timezone(timedelta(hours=9))
+
+# 💡 1回の実行の処理時間と I/O 回数をここに集計し、public/run_metrics.json に直近の履歴ごと書き出す
+RUN_METRICS_PATH = os.path.join("public", "run_metrics.json")
+RUN_METRICS_HISTORY = 60
+
+_lock = threading.Lock()
+_timings = {}
+_counters = {}
+_started = time.perf_counter()
+
+class timer(contextlib.ContextDecorator):
+    """
+    with timer("fetch.prices"): ... または @timer("render.dashboard") で、名前ごとの累計秒数と回数を記録する。
+    並列スレッドの時間はそれぞれ加算されるので、合計が実行時間を超えることがある。
+    """
+    def __init__(self, name):
+        self.name = name
+        self._local = threading.local()
+
+    def __enter__(self):
+        # デコレータとして複数スレッドから同時に使われても開始時刻が混ざらないよう、スレッドごとに積む
+        starts = self._local.__dict__.setdefault("starts", [])
+        starts.append(time.perf_counter())
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self._local.starts.pop()
+        with _lock:
+            stat = _timings.setdefault(self.name, {"sec": 0.0, "calls": 0})
+            stat["sec"] += elapsed
+            stat["calls"] += 1
+        return False
+
+def count(name, value=1):
+    """カウンタ（HTTPリクエスト数・ダウンロードしたバイト数・再試行・キャッシュヒット・書き込んだJSONのバイト数など）を加算する"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+def reset():
+    global _started
+    with _lock:
+        _timings.clear()
+        _counters.clear()
+        _started = time.perf_counter()
+
+def snapshot():
+    """ここまでの集計（経過時間・名前ごとの秒数と回数・カウンタ）"""
+    with _lock:
+        return {
+            "duration_sec": round(time.perf_counter() - _started, 2),
+            "timings": {name: {"sec": round(s["sec"], 3), "calls": s["calls"]} for name, s in sorted(_timings.items())},
+            "counters": dict(sorted(_counters.items())),
+        }
+
+def load_run_metrics(path=RUN_METRICS_PATH):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"latest": None, "history": []}
+
+def write_run_metrics(path=RUN_METRICS_PATH, history=RUN_METRICS_HISTORY, run_id=None, extra=None):
+    """今回の集計を latest に、直近 history 回分を history に残して書き出す。書き出した内容を返す"""
+    run = {"run_id": run_id, "finished_at": datetime.now(JST).strftime('%Y-%m-%d %H:%M:%S'), **snapshot(), **(extra or {})}
+    data = load_run_metrics(path)
+    runs = (data.get("history") or []) + [run]
+    data = {"latest": run, "history": runs[-history:]}
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+    return data
+
+def print_summary(run):
+    print(f"📏 実行メトリクス（合計 {run['duration_sec']}秒）:")
+    for name, stat in run["timings"].items():
+        print(f"  {name}: {stat['sec']}秒 / {stat['calls']}回")
+    if run["counters"]:
+        print("  " + " / ".join(f"{name} {value:,}" for name, value in run["counters"].items()))
@@ -1,59 +1,164 @@
-import urllib.request
-import urllib.parse
-import xml.etree.ElementTree as ET
-from datetime import datetime
-
-def fetch_recent_news(ticker_code, source="google_rss", limit=5):
-    """
-    指定された情報源から最新ニュースを取得し、日付が新しい順（降順）に並び替えて返す。
-    """
-    news_items = []
-    
-    if source == "google_rss":
-        # Google News RSS (キーワード検索)
-        # 【修正箇所】検索クエリに「when:7d」を追加し、過去7日以内のニュースに限定することで速報性を高める
-        query = urllib.parse.quote(f"{ticker_code} 株 when:7d")
-        url = f"https://news.google.com/rss/search?q={query}&hl=ja&gl=JP&ceid=JP:ja"
-        
-        try:
-            req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
-            with urllib.request.urlopen(req) as response:
-                xml_data = response.read()
-            
-            root = ET.fromstring(xml_data)
-            channel = root.find("channel")
-            
-            if channel is not None:
-                for item in channel.findall("item"):
-                    title = item.find("title").text if item.find("title") is not None else "No Title"
-                    link = item.find("link").text if item.find("link") is not None else ""
-                    pubDate = item.find("pubDate").text if item.find("pubDate") is not None else ""
-                    
-                    # 日付の変換 (例: "Tue, 27 Feb 2024 ...")
-                    try:
-                        dt = datetime.strptime(pubDate, "%a, %d %b %Y %H:%M:%S %Z")
-                        formatted_date = dt.strftime('%Y-%m-%d %H:%M')
-                    except:
-                        formatted_date = pubDate
-                        
-                    news_items.append({
-                        "title": title,
-                        "publisher": "Google News",
-                        "link": link,
-                        "date": formatted_date
-                    })
-        except Exception as e:
-            print(f"ニュース取得エラー: {e}")
-            
-    # 日付(date)を基準に、新しいものが上(降順)になるようソート
-    news_items.sort(key=lambda x: x['date'], reverse=True)
-    
-    # ソートした後に指定件数(limit)だけ返す
-    return news_items[:limit]
-
-# --- テスト用 ---
-if __name__ == "__main__":
-    print("【テスト】最新ニュースを取得します...")
-    news = fetch_recent_news("7203", limit=5)
-    for n in news:
-        print(f"[{n['date']}] {n['title']}")
\ No newline at end of file
+import concurrent.futures
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+import xml.etree.ElementTree as ET
+from datetime import datetime
+import requests
+from metrics import count, timer
+
+# 💡 ニュース取得はすべてこのモジュールを通す（条件付きGET・途中までの逐次パース・既読管理）
+NEWS_DB_PATH = os.path.join("data_cache", "news.db")
+MACRO_NEWS_URL = "https://news.yahoo.co.jp/rss/topics/business.xml"
+NEWS_TIMEOUT = 10
+NEWS_MAX_WORKERS = 4
+# 日付順に並べ替えるため、件数上限より少し多めに読む（それ以降の記事はダウンロードもしない）
+NEWS_PARSE_LIMIT = 20
+# この時間内に初めて見た見出しを「新着」としてプロンプトに渡す（日次実行の間隔＋余裕）
+NEWS_FRESH_HOURS = 36
+
+_session = requests.Session()
+_session.headers.update({'User-Agent': 'Mozilla/5.0'})
+_db_lock = threading.Lock()
+
+def _connect(path=NEWS_DB_PATH):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("CREATE TABLE IF NOT EXISTS feeds (url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, fetched_at REAL)")
+    # 見出しは正規化したタイトルのハッシュで重複排除する（同じ記事が別URLで配信されることがあるため）
+    conn.execute("""CREATE TABLE IF NOT EXISTS items (
+        key TEXT PRIMARY KEY, title TEXT, publisher TEXT, link TEXT, date TEXT, first_seen REAL)""")
+    conn.execute("CREATE TABLE IF NOT EXISTS feed_items (url TEXT, key TEXT, PRIMARY KEY (url, key))")
+    return conn
+
+def google_news_url(ticker_code):
+    # 検索クエリに「when:7d」を追加し、過去7日以内のニュースに限定することで速報性を高める
+    query = urllib.parse.quote(f"{ticker_code} 株 when:7d")
+    return f"https://news.google.com/rss/search?q={query}&hl=ja&gl=JP&ceid=JP:ja"
+
+def _item_key(title):
+    return hashlib.sha1(" ".join(title.split()).encode("utf-8")).hexdigest()
+
+def _format_date(pub_date):
+    # 日付の変換 (例: "Tue, 27 Feb 2024 ...")
+    try:
+        return datetime.strptime(pub_date, "%a, %d %b %Y %H:%M:%S %Z").strftime('%Y-%m-%d %H:%M')
+    except ValueError:
+        return pub_date
+
+def parse_items(stream, publisher, limit=NEWS_PARSE_LIMIT):
+    """RSS を逐次パースし、<item> を limit 件読んだ時点で打ち切る"""
+    items = []
+    for _, elem in ET.iterparse(stream, events=("end",)):
+        if elem.tag != "item":
+            continue
+        title = elem.findtext("title") or "No Title"
+        items.append({
+            "title": title,
+            "publisher": elem.findtext("source") or publisher,
+            "link": elem.findtext("link") or "",
+            "date": _format_date(elem.findtext("pubDate") or ""),
+        })
+        elem.clear()
+        if len(items) >= limit:
+            break
+    return items
+
+@timer("fetch.news")
+def fetch_feed(url, publisher, limit=NEWS_PARSE_LIMIT, timeout=NEWS_TIMEOUT, path=NEWS_DB_PATH):
+    """
+    ETag / Last-Modified を使った条件付きGETでフィードを取得する。
+    304（更新なし）の場合は前回保存した記事を返す。各記事には初めて見た時刻 first_seen が付く。
+    """
+    with _db_lock:
+        conn = _connect(path)
+        try:
+            row = conn.execute("SELECT etag, last_modified FROM feeds WHERE url = ?", (url,)).fetchone()
+        finally:
+            conn.close()
+
+    headers = {}
+    if row and row[0]:
+        headers["If-None-Match"] = row[0]
+    if row and row[1]:
+        headers["If-Modified-Since"] = row[1]
+
+    now = time.time()
+    count("news.requests")
+    with _session.get(url, headers=headers, timeout=timeout, stream=True) as response:
+        if response.status_code == 304:
+            count("news.not_modified")
+            fresh = None
+        else:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            fresh = parse_items(response.raw, publisher, limit)
+            # 途中で打ち切った場合は、実際に受信した分（圧縮後）だけが数えられる
+            count("news.bytes_downloaded", response.raw.tell())
+        etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+
+    with _db_lock:
+        conn = _connect(path)
+        try:
+            with conn:
+                if fresh is not None:
+                    conn.execute("DELETE FROM feed_items WHERE url = ?", (url,))
+                    for item in fresh:
+                        key = _item_key(item["title"])
+                        conn.execute("INSERT OR IGNORE INTO items VALUES (?, ?, ?, ?, ?, ?)",
+                                     (key, item["title"], item["publisher"], item["link"], item["date"], now))
+                        conn.execute("INSERT OR IGNORE INTO feed_items VALUES (?, ?)", (url, key))
+                    conn.execute("INSERT OR REPLACE INTO feeds VALUES (?, ?, ?, ?)", (url, etag, last_modified, now))
+                else:
+                    conn.execute("UPDATE feeds SET fetched_at = ? WHERE url = ?", (now, url))
+            rows = conn.execute("""SELECT i.title, i.publisher, i.link, i.date, i.first_seen FROM feed_items f
+                JOIN items i ON i.key = f.key WHERE f.url = ?""", (url,)).fetchall()
+        finally:
+            conn.close()
+    return [dict(zip(("title", "publisher", "link", "date", "first_seen"), r)) for r in rows]
+
+def _select(items, limit, fresh_hours):
+    if fresh_hours is not None:
+        since = time.time() - fresh_hours * 3600
+        items = [item for item in items if item["first_seen"] >= since]
+    # 日付(date)を基準に、新しいものが上(降順)になるようソート
+    items.sort(key=lambda x: x['date'], reverse=True)
+    return [{k: v for k, v in item.items() if k != "first_seen"} for item in items[:limit]]
+
+def fetch_recent_news(ticker_code, source="google_rss", limit=5, fresh_hours=NEWS_FRESH_HOURS):
+    """
+    指定された情報源から最新ニュースを取得し、日付が新しい順（降順）に並び替えて返す。
+    fresh_hours を指定すると、その時間内に初めて見た見出し（前回実行以降の新着）だけを返す（None なら全件）。
+    """
+    if source != "google_rss":
+        return []
+    try:
+        return _select(fetch_feed(google_news_url(ticker_code), "Google News"), limit, fresh_hours)
+    except Exception as e:
+        print(f"ニュース取得エラー: {e}")
+        return []
+
+def fetch_news_batch(ticker_codes, limit=5, fresh_hours=NEWS_FRESH_HOURS, max_workers=NEWS_MAX_WORKERS):
+    """複数銘柄のニュースを並列数を絞って同時に取得する。戻り値は {銘柄コード: ニュースのリスト}"""
+    codes = list(dict.fromkeys(ticker_codes))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(lambda code: fetch_recent_news(code, limit=limit, fresh_hours=fresh_hours), codes)
+        return dict(zip(codes, results))
+
+def fetch_top_macro_news(limit=3, fresh_hours=NEWS_FRESH_HOURS):
+    """国内ビジネスのトップニュース（Yahoo!ニュース）"""
+    try:
+        return _select(fetch_feed(MACRO_NEWS_URL, "Yahoo!ニュース"), limit, fresh_hours)
+    except Exception as e:
+        print(f"マクロニュース取得エラー: {e}")
+        return []
+
+# --- テスト用 ---
+if __name__ == "__main__":
+    print("【テスト】最新ニュースを取得します...")
+    news = fetch_recent_news("7203", limit=5, fresh_hours=None)
+    for n in news:
+        print(f"[{n['date']}] {n['title']}")
@@ -0,0 +1,103 @@
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+import concurrent.futures
+import numpy as np
+from analyze_performance import (STRATEGIES, SUMMARY_HOLDING, SIGNAL_COLUMNS, DEFAULT_PARAMS, MIN_BACKTEST_ROWS,
+                                 signal_masks, stack_backtest_frames, forward_returns, load_backtest_data, summarize)
+
+# 💡 戦術しきい値のグリッド探索（株価・指標は1回だけ用意し、全組み合わせで使い回す）
+DEFAULT_GRID = {
+    "breakout_vol_ratio": [2.0, 2.5, 3.0, 3.5],
+    "pullback_ma_band": [1.01, 1.02, 1.03, 1.05],
+    "reversal_rsi": [25, 30, 35],
+    "reversal_ma25_gap": [0.90, 0.95, 0.97],
+}
+# 回数が少なすぎる組み合わせは順位付けから外す
+MIN_TRADES = 30
+RESULTS_JSON = "public/sweep_results.json"
+RESULTS_CSV = "public/sweep_results.csv"
+
+_shared = {}
+
+def build_arrays(frames, nk_data):
+    """全銘柄の signal_masks 用の列と5日後リターンを (銘柄 × 日) の2次元配列に積む（analyze_performance と同じ積み方・右詰め・左はNaN）"""
+    frames = {code: df for code, df in frames.items() if df is not None and len(df) >= MIN_BACKTEST_ROWS}
+    _, dates, stacked = stack_backtest_frames(frames, nk_data)
+    _, fwd = forward_returns(stacked["Open"], stacked["Close"], (SUMMARY_HOLDING,))
+    # 左の空き（日付なし）の最後の日は、翌日＝銘柄の初日の始値で買えてしまうので除く
+    returns = np.where(np.isnat(dates), np.nan, fwd[SUMMARY_HOLDING])
+    return {col: stacked[col] for col in SIGNAL_COLUMNS}, returns
+
+def _init_worker(cols, returns):
+    _shared["cols"] = cols
+    _shared["returns"] = returns
+
+def evaluate(params):
+    """1組のしきい値について、全銘柄・全期間のシグナルを一括判定して戦術別成績を返す"""
+    masks = signal_masks(_shared["cols"], params)
+    returns = _shared["returns"]
+    result = {"params": params, "strategies": {}}
+    picked = []
+    for strategy in STRATEGIES:
+        r = returns[masks[strategy]]
+        result["strategies"][strategy] = summarize(r)
+        picked.append(r)
+    result["overall"] = summarize(np.concatenate(picked))
+    return result
+
+def _evaluate_chunk(chunk):
+    return [evaluate(params) for params in chunk]
+
+def sweep(grid=None, frames=None, nk_data=None, max_workers=2, chunk_size=8):
+    """
+    grid の全組み合わせを評価し、全体の平均リターン（期待値）順に並べて JSON/CSV に保存する。
+    """
+    grid = {**{k: [v] for k, v in DEFAULT_PARAMS.items()}, **(grid or DEFAULT_GRID)}
+    if frames is None or nk_data is None:
+        frames, nk_data = load_backtest_data()
+
+    started = time.perf_counter()
+    cols, returns = build_arrays(frames, nk_data)
+    keys = list(grid)
+    combos = [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+    chunks = [combos[i:i + chunk_size] for i in range(0, len(combos), chunk_size)]
+    print(f"🔍 パラメータ探索: {len(combos)}通り / {returns.shape[0]}銘柄 × {returns.shape[1]}日")
+
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(cols, returns)) as executor:
+        for chunk_result in executor.map(_evaluate_chunk, chunks):
+            results.extend(chunk_result)
+
+    ranked = sorted(results, key=lambda r: (r["overall"]["total_signals"] >= MIN_TRADES, r["overall"]["avg_return"], r["overall"]["win_rate"]), reverse=True)
+    for rank, r in enumerate(ranked, 1):
+        r["rank"] = rank
+    elapsed = time.perf_counter() - started
+
+    os.makedirs(os.path.dirname(RESULTS_JSON), exist_ok=True)
+    with open(RESULTS_JSON, "w", encoding="utf-8") as f:
+        json.dump({"holding_days": SUMMARY_HOLDING, "min_trades": MIN_TRADES, "elapsed_sec": round(elapsed, 2), "results": ranked}, f, ensure_ascii=False, indent=2)
+    with open(RESULTS_CSV, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        header = ["rank"] + keys + ["trades", "win_rate", "avg_return"]
+        for strategy in STRATEGIES:
+            header += [f"{strategy}_trades", f"{strategy}_win_rate", f"{strategy}_avg_return"]
+        writer.writerow(header)
+        for r in ranked:
+            row = [r["rank"]] + [r["params"][k] for k in keys] + [r["overall"]["total_signals"], r["overall"]["win_rate"], r["overall"]["avg_return"]]
+            for strategy in STRATEGIES:
+                st = r["strategies"][strategy]
+                row += [st["total_signals"], st["win_rate"], st["avg_return"]]
+            writer.writerow(row)
+
+    print(f"✅ 探索完了: {elapsed:.1f}秒")
+    for r in ranked[:5]:
+        print(f"  #{r['rank']} {r['params']} → 回数 {r['overall']['total_signals']} / 勝率 {r['overall']['win_rate']}% / 平均 {r['overall']['avg_return']}%")
+    return ranked
+
+if __name__ == "__main__":
+    # 例: python parameter_sweep.py '{"reversal_rsi": [20, 25, 30]}'
+    sweep(json.loads(sys.argv[1]) if len(sys.argv) > 1 else None)
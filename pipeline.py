@@ -0,0 +1,97 @@
+import concurrent.futures
+import os
+import pickle
+import shutil
+import time
+from metrics import timer
+
+# 💡 各ステージの出力はここに保存し、途中で失敗した実行は完了済みステージを飛ばして再開する
+CHECKPOINT_DIR = os.path.join("data_cache", "checkpoints")
+
+class Stage:
+    def __init__(self, name, func, inputs=(), checkpoint=True):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.checkpoint = checkpoint
+
+class Pipeline:
+    """
+    入力（依存する他ステージの名前）を宣言したステージの小さなスケジューラ。
+    依存が揃ったステージから並列に実行し、各ステージの出力を run_id ごとにチェックポイントとして保存する。
+    全ステージが成功したらチェックポイントは消す（同じ日の再実行は最初からやり直す）。
+    """
+    def __init__(self, run_id, checkpoint_dir=CHECKPOINT_DIR, max_workers=4):
+        self.run_id = run_id
+        self.dir = os.path.join(checkpoint_dir, run_id)
+        self.max_workers = max_workers
+        self.stages = {}
+        self.timings = {}
+
+    def add(self, name, func, inputs=(), checkpoint=True):
+        """func は inputs に挙げたステージの出力をキーワード引数で受け取る"""
+        missing = [i for i in inputs if i not in self.stages]
+        if missing:
+            raise ValueError(f"未定義のステージに依存しています: {name} → {missing}")
+        self.stages[name] = Stage(name, func, inputs, checkpoint)
+        return self
+
+    def _path(self, name):
+        return os.path.join(self.dir, f"{name}.pkl")
+
+    def _load(self, name):
+        with open(self._path(name), "rb") as f:
+            return pickle.load(f)
+
+    def _save(self, name, value):
+        os.makedirs(self.dir, exist_ok=True)
+        tmp = f"{self._path(name)}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(value, f)
+        os.replace(tmp, self._path(name))
+
+    def _run_stage(self, stage, outputs):
+        started = time.perf_counter()
+        with timer(f"stage.{stage.name}"):
+            value = stage.func(**{i: outputs[i] for i in stage.inputs})
+        self.timings[stage.name] = round(time.perf_counter() - started, 2)
+        if stage.checkpoint:
+            self._save(stage.name, value)
+        return value
+
+    def run(self, resume=True):
+        """全ステージを実行して {ステージ名: 出力} を返す。失敗したら実行中のステージを待ってから例外を送出する"""
+        outputs = {}
+        if resume:
+            for name, stage in self.stages.items():
+                if stage.checkpoint and os.path.exists(self._path(name)):
+                    try:
+                        outputs[name] = self._load(name)
+                        print(f"⏩ 再開: {name}（チェックポイントを使用）")
+                    except Exception as e:
+                        print(f"チェックポイントの読み込みに失敗: {name} ({e})")
+
+        pending = {name: stage for name, stage in self.stages.items() if name not in outputs}
+        running = {}
+        error = None
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                if error is None:
+                    for name, stage in list(pending.items()):
+                        if all(i in outputs for i in stage.inputs):
+                            running[executor.submit(self._run_stage, stage, dict(outputs))] = name
+                            del pending[name]
+                if not running:
+                    break
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        outputs[name] = future.result()
+                    except Exception as e:
+                        print(f"❌ ステージ失敗: {name} ({e})")
+                        error = error or e
+        if error is not None:
+            raise error
+        shutil.rmtree(self.dir, ignore_errors=True)
+        return outputs
@@ -0,0 +1,187 @@
+import itertools
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+
+# 💡 シグナルごとの成績ではなく「実際に1つの口座で回したら」の成績を出す（資金・同時保有数・100株単位・手数料を考慮）
+# バックテストのトレード記録（exit_* 列付き）と全銘柄の終値表だけを使い、営業日を1日ずつ進めて売買する
+PORTFOLIO_PATH = "public/portfolio_summary.json"
+
+DEFAULT_SETTINGS = {
+    "initial_capital": 3_000_000,   # 元手（円）
+    "max_positions": 5,             # 同時に持つ銘柄数の上限
+    "position_size": 0.2,           # 1銘柄に使う金額（前日の評価額に対する比率）
+    "lot_size": 100,                # 売買単位（株）
+    "commission_rate": 0.00055,     # 手数料（約定代金に対する比率、売り買いそれぞれ）
+    "exit": "rules",                # "rules" = 手仕舞いルール（exit_*）、数値 h = h日後の終値で決済（return_{h}d）
+    "strategies": None,             # 対象の戦術（None はすべて。同じ日に枠が足りなければこの順で優先）
+}
+
+# 探索の既定（同時保有数 × 1銘柄の比率）
+DEFAULT_GRID = {"max_positions": [3, 5, 8, 10], "position_size": [0.1, 0.2, 0.3]}
+
+TRADING_DAYS_PER_YEAR = 245
+
+def close_matrix(frames):
+    """全銘柄の終値を日付で揃えた表（行 = 営業日、列 = 銘柄コード）。休場・欠損の日は前日の終値で埋める"""
+    closes = pd.concat({code: df['Close'] for code, df in frames.items() if df is not None and not df.empty}, axis=1)
+    return closes.sort_index().ffill()
+
+def prepare_trades(trades, closes, exit="rules", strategies=None):
+    """
+    トレード記録を、営業日の番号で表した買い・売りの配列にする（買う日の順、同じ日は戦術の優先順 → 銘柄コード順）。
+    買いはシグナル翌日の始値、売りは手仕舞いルールの決済日（または h日後の終値）。未決済のものは最後まで持ち続ける。
+    """
+    strategies = list(strategies or pd.unique(trades["strategy"]))
+    trades = trades[trades["strategy"].isin(strategies)]
+    if exit == "rules":
+        returns, hold = trades["exit_return"].to_numpy(dtype=float), trades["exit_days"].to_numpy(dtype=float)
+    else:
+        returns, hold = trades[f"return_{int(exit)}d"].to_numpy(dtype=float), np.full(len(trades), float(exit))
+
+    day = closes.index.get_indexer(pd.to_datetime(trades["date"]))
+    col = closes.columns.get_indexer(trades["code"])
+    entry = trades["entry"].to_numpy(dtype=float)
+    settled = ~np.isnan(returns)
+    exit_day = np.where(settled, np.minimum(day + np.nan_to_num(hold), len(closes) - 1), len(closes)).astype(int)
+    exit_price = np.where(settled, entry * (1 + returns / 100), np.nan)
+    priority = trades["strategy"].map({s: i for i, s in enumerate(strategies)}).to_numpy()
+
+    ok = (day >= 0) & (col >= 0) & (day + 1 < len(closes)) & (entry > 0)
+    order = np.lexsort((col[ok], priority[ok], day[ok]))
+    prepared = {
+        "entry_day": (day + 1)[ok][order], "exit_day": exit_day[ok][order], "col": col[ok][order],
+        "entry": entry[ok][order], "exit_price": exit_price[ok][order],
+    }
+    # 営業日ごとの買い候補の範囲（entry_day で二分探索しておく）
+    prepared["starts"] = np.searchsorted(prepared["entry_day"], np.arange(len(closes) + 1))
+    return prepared
+
+def simulate(prepared, closes, settings=None, curve=True):
+    """
+    営業日を1日ずつ進め、寄り付きで買い候補を枠と資金の範囲で買い、決済日の手仕舞い価格で売る。
+    評価額は毎日の終値で計算する。成績（総リターン・最大ドローダウン・回転率など）と、curve=True なら資産曲線を返す。
+    """
+    s = {**DEFAULT_SETTINGS, **(settings or {})}
+    values = closes.to_numpy(dtype=float)
+    n_days = len(values)
+    lot, rate = s["lot_size"], s["commission_rate"]
+
+    cash = float(s["initial_capital"])
+    equity = np.empty(n_days)
+    invested = np.empty(n_days)
+    holdings = {}   # 銘柄の列番号 → [株数, 決済日, 決済価格, 取得額（手数料込み）]
+    prev_equity = cash
+    bought = sold = commission = 0.0
+    taken = skipped_full = skipped_cash = wins = closed = 0
+    starts = prepared["starts"]
+
+    for t in range(n_days):
+        for i in range(starts[t], starts[t + 1]):
+            if len(holdings) >= s["max_positions"]:
+                skipped_full += starts[t + 1] - i
+                break
+            col = prepared["col"][i]
+            if col in holdings:
+                continue
+            price = prepared["entry"][i]
+            budget = min(cash, prev_equity * s["position_size"])
+            shares = int(budget / (price * lot * (1 + rate))) * lot
+            if shares <= 0:
+                skipped_cash += 1
+                continue
+            cost = shares * price
+            fee = cost * rate
+            cash -= cost + fee
+            bought += cost
+            commission += fee
+            holdings[col] = [shares, prepared["exit_day"][i], prepared["exit_price"][i], cost + fee]
+            taken += 1
+
+        for col in [c for c, h in holdings.items() if h[1] == t]:
+            shares, _, price, basis = holdings.pop(col)
+            proceeds = shares * price
+            fee = proceeds * rate
+            cash += proceeds - fee
+            sold += proceeds
+            commission += fee
+            closed += 1
+            wins += proceeds - fee > basis
+
+        if holdings:
+            cols = np.fromiter(holdings, dtype=int)
+            shares = np.array([h[0] for h in holdings.values()], dtype=float)
+            marks = values[t, cols]
+            # 終値がまだ無い（上場直後など）銘柄は取得単価で評価する
+            marks = np.where(np.isnan(marks), [h[3] / h[0] for h in holdings.values()], marks)
+            invested[t] = float(shares @ marks)
+        else:
+            invested[t] = 0.0
+        equity[t] = prev_equity = cash + invested[t]
+
+    peak = np.maximum.accumulate(equity)
+    drawdown = (equity / peak - 1) * 100
+    years = n_days / TRADING_DAYS_PER_YEAR
+    final = equity[-1] if n_days else cash
+    result = {
+        "settings": s,
+        "start_date": closes.index[0].strftime('%Y-%m-%d') if n_days else None,
+        "end_date": closes.index[-1].strftime('%Y-%m-%d') if n_days else None,
+        "final_equity": round(float(final)),
+        "total_return": round(float((final / s["initial_capital"] - 1) * 100), 2),
+        "cagr": round(float(((final / s["initial_capital"]) ** (1 / years) - 1) * 100), 2) if years > 0 and final > 0 else 0.0,
+        "max_drawdown": round(float(drawdown.min()), 2) if n_days else 0.0,
+        # 回転率: 年間の売買代金（買いと売りの平均）が平均評価額の何倍か
+        "turnover": round(float((bought + sold) / 2 / equity.mean() / years), 2) if n_days and years > 0 else 0.0,
+        "exposure": round(float(np.mean(invested / equity) * 100), 1) if n_days else 0.0,
+        "commission": round(commission),
+        "trades": taken,
+        "closed_trades": closed,
+        "win_rate": round(wins / closed * 100, 2) if closed else 0.0,
+        "skipped_full": int(skipped_full),
+        "skipped_cash": skipped_cash,
+    }
+    if curve:
+        result["curve"] = {
+            "dates": closes.index.strftime('%Y-%m-%d').tolist(),
+            "equity": np.round(equity).astype(int).tolist(),
+            "drawdown": np.round(drawdown, 2).tolist(),
+        }
+    return result
+
+def run_portfolio(trades, closes, settings=None):
+    """トレード記録と終値表から1通りの設定でポートフォリオを回す"""
+    s = {**DEFAULT_SETTINGS, **(settings or {})}
+    return simulate(prepare_trades(trades, closes, s["exit"], s["strategies"]), closes, s)
+
+def sweep_settings(trades, closes, grid=None, settings=None):
+    """
+    grid の全組み合わせでポートフォリオを回し、総リターン順に並べて返す（資産曲線は省く）。
+    exit と strategies が同じ組み合わせでは、トレード記録の変換を使い回す。
+    """
+    base = {**DEFAULT_SETTINGS, **(settings or {})}
+    grid = grid or DEFAULT_GRID
+    keys = list(grid)
+    started = time.perf_counter()
+    prepared = {}
+    results = []
+    for values in itertools.product(*(grid[k] for k in keys)):
+        s = {**base, **dict(zip(keys, values))}
+        key = (str(s["exit"]), tuple(s["strategies"] or ()))
+        if key not in prepared:
+            prepared[key] = prepare_trades(trades, closes, s["exit"], s["strategies"])
+        results.append(simulate(prepared[key], closes, s, curve=False))
+    results.sort(key=lambda r: r["total_return"], reverse=True)
+    print(f"🔍 ポートフォリオ設定の探索: {len(results)}通り / {time.perf_counter() - started:.2f}秒")
+    return results
+
+def write_portfolio(result, path=PORTFOLIO_PATH, sweep=None):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    data = {**result, "sweep": sweep or []}
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+    return data
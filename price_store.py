@@ -0,0 +1,229 @@
+import os
+import sqlite3
+import threading
+import time
+import pandas as pd
+import yfinance as yf
+from datetime import datetime, timedelta, timezone
+from metrics import count, timer
+
+JST = timezone(timedelta(hours=9))
+
+# 💡 全モジュール共通の株価キャッシュ（GitHub Actions では actions/cache で永続化）
+CACHE_DIR = "data_cache"
+DB_PATH = os.path.join(CACHE_DIR, "prices.db")
+OHLCV_COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+
+# 配当・分割で調整後株価が書き換わったかを判定する許容誤差
+ADJUST_TOLERANCE = 1e-4
+
+# 末尾（当日分）を確認してからこの秒数のあいだは、翌日までの区間を要求されても取り直さない
+# （1回の実行で market_check・watch・scan・performance が同じ銘柄を何度読んでもダウンロードは1回）
+TAIL_CHECK_TTL = 3600
+
+_write_lock = threading.Lock()
+
+def _connect():
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    conn.execute("""CREATE TABLE IF NOT EXISTS bars (
+        symbol TEXT, date TEXT, open REAL, high REAL, low REAL, close REAL, volume REAL,
+        PRIMARY KEY (symbol, date))""")
+    # start〜end(排他)の区間は取得済み（当日分は未確定なので end に含めない）。checked は末尾を最後に確認した時刻（UNIX秒）
+    conn.execute("CREATE TABLE IF NOT EXISTS coverage (symbol TEXT PRIMARY KEY, start TEXT, end TEXT, checked REAL)")
+    if "checked" not in [row[1] for row in conn.execute("PRAGMA table_info(coverage)")]:
+        conn.execute("ALTER TABLE coverage ADD COLUMN checked REAL")
+    # 配当・分割で過去分を取り直した時刻（履歴の共有株価系列を書き直す合図）
+    conn.execute("CREATE TABLE IF NOT EXISTS adjustments (symbol TEXT PRIMARY KEY, adjusted_at REAL)")
+    return conn
+
+def _download(symbol, start_str, end_str):
+    count("price.requests")
+    df = yf.Ticker(symbol).history(start=start_str, end=end_str)
+    if df.empty:
+        return df
+    df.index = df.index.tz_localize(None)
+    return df[OHLCV_COLUMNS]
+
+def _download_with_retry(symbol, start_str, end_str, max_retries=3, base_wait=2):
+    for attempt in range(max_retries):
+        try:
+            return _download(symbol, start_str, end_str)
+        except Exception:
+            if attempt < max_retries - 1:
+                count("price.retries")
+                time.sleep(base_wait * (2 ** attempt))
+    return pd.DataFrame(columns=OHLCV_COLUMNS)
+
+def _read(conn, symbol, start_str, end_str):
+    rows = conn.execute(
+        "SELECT date, open, high, low, close, volume FROM bars WHERE symbol = ? AND date >= ? AND date < ? ORDER BY date",
+        (symbol, start_str, end_str)).fetchall()
+    df = pd.DataFrame(rows, columns=["Date"] + OHLCV_COLUMNS)
+    df.index = pd.to_datetime(df.pop("Date"))
+    return df
+
+def _write(conn, symbol, df, start_str, end_str, replace=False):
+    with _write_lock, conn:
+        if replace:
+            conn.execute("DELETE FROM bars WHERE symbol = ?", (symbol,))
+        conn.executemany(
+            "INSERT OR REPLACE INTO bars VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(symbol, d.strftime('%Y-%m-%d'), float(r.Open), float(r.High), float(r.Low), float(r.Close), float(r.Volume))
+             for d, r in zip(df.index, df.itertuples())])
+        conn.execute("INSERT OR REPLACE INTO coverage VALUES (?, ?, ?, ?)", (symbol, start_str, end_str, time.time()))
+
+def _mark_checked(conn, symbol):
+    """新しい日足が無かった（休場日など）場合も、末尾を確認した時刻だけは残す"""
+    with _write_lock, conn:
+        conn.execute("UPDATE coverage SET checked = ? WHERE symbol = ?", (time.time(), symbol))
+
+def _is_adjusted(conn, symbol, fresh):
+    """取得し直した重複区間の終値が保存値とずれていれば、過去分が再調整されたとみなす"""
+    if fresh.empty:
+        return False
+    stored = _read(conn, symbol, fresh.index[0].strftime('%Y-%m-%d'), (fresh.index[0] + timedelta(days=1)).strftime('%Y-%m-%d'))
+    if stored.empty:
+        return False
+    old, new = stored['Close'].iloc[0], fresh['Close'].iloc[0]
+    return abs(new - old) > abs(old) * ADJUST_TOLERANCE
+
+def _normalize(df):
+    if df.index.tz is not None:
+        df.index = df.index.tz_localize(None)
+    # 複数銘柄をまとめて取得すると、他銘柄だけが取引された日が全NaN行として混ざる
+    return df[OHLCV_COLUMNS].dropna(subset=["Open", "High", "Low", "Close"], how="all")
+
+def fetch_batch(symbols, start_str, end_str, downloader=None):
+    """
+    複数銘柄を1回のリクエストでまとめて取得し、銘柄ごとの DataFrame に分割して返す。
+    空で返ってきた銘柄だけを個別に取り直す。downloader には yf.download 互換の関数（録画データの再生用など）を渡せる。
+    """
+    symbols = list(dict.fromkeys(symbols))
+    if not symbols:
+        return {}
+    downloader = downloader or yf.download
+
+    frames = {}
+    count("price.requests")
+    try:
+        data = downloader(symbols, start=start_str, end=end_str, group_by="ticker", auto_adjust=True, progress=False, threads=True)
+    except Exception as e:
+        print(f"一括取得エラー: {e}")
+        data = pd.DataFrame()
+
+    if not data.empty:
+        if isinstance(data.columns, pd.MultiIndex):
+            available = data.columns.get_level_values(0)
+            for symbol in symbols:
+                if symbol in available:
+                    frames[symbol] = _normalize(data[symbol].copy())
+        elif len(symbols) == 1:
+            frames[symbols[0]] = _normalize(data.copy())
+
+    for symbol in symbols:
+        if symbol not in frames or frames[symbol].empty:
+            frames[symbol] = _download_with_retry(symbol, start_str, end_str)
+    return frames
+
+def _plan(conn, symbol, start_str, end_str, today_str):
+    """保存済み区間と比較して、ダウンロードが必要な範囲を決める（不要なら None）"""
+    cov = conn.execute("SELECT start, end, checked FROM coverage WHERE symbol = ?", (symbol,)).fetchone()
+    if cov is None or start_str < cov[0]:
+        # 未取得、または保存済みより古い期間が必要 → 区間全体を取り直す
+        fetch_end = max(end_str, cov[1]) if cov else end_str
+        return {"kind": "full", "start": start_str, "end": fetch_end, "cov": cov}
+    if end_str > cov[1]:
+        # 保存済みが今日の手前まで（＝今日の分は確認済み）で、確認して間もなければ、明日までの要求も満たしているとみなす
+        tomorrow_str = (datetime.strptime(today_str, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+        if cov[1] >= today_str and end_str <= tomorrow_str and cov[2] and time.time() - cov[2] < TAIL_CHECK_TTL:
+            return None
+        last = conn.execute("SELECT MAX(date) FROM bars WHERE symbol = ?", (symbol,)).fetchone()[0]
+        # 最終バーを1本重ねて取得し、調整後株価の書き換えを検知する
+        return {"kind": "tail", "start": last or cov[0], "end": end_str, "cov": cov}
+    return None
+
+def _apply(conn, symbol, plan, df, final_end):
+    cov = plan["cov"]
+    if plan["kind"] == "full":
+        _write(conn, symbol, df, plan["start"], max(final_end, cov[1]) if cov else final_end, replace=True)
+    elif _is_adjusted(conn, symbol, df):
+        df = _download_with_retry(symbol, cov[0], plan["end"])
+        if not df.empty:
+            _write(conn, symbol, df, cov[0], max(final_end, cov[1]), replace=True)
+            with _write_lock, conn:
+                conn.execute("INSERT OR REPLACE INTO adjustments VALUES (?, ?)", (symbol, time.time()))
+    else:
+        _write(conn, symbol, df, cov[0], max(final_end, cov[1]))
+
+def adjusted_at(symbol):
+    """symbol の過去の株価を配当・分割の再調整で取り直した最後の時刻（UNIX秒）。無ければ None"""
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT adjusted_at FROM adjustments WHERE symbol = ?", (symbol,)).fetchone()
+        return row[0] if row else None
+    finally:
+        conn.close()
+
+def stored_history(symbol):
+    """保存済みの全期間の日足（ダウンロードはしない）"""
+    conn = _connect()
+    try:
+        return _read(conn, symbol, "0000-00-00", "9999-99-99")
+    finally:
+        conn.close()
+
+def slice_frames(frames, start_str, end_str):
+    """取得済みの全期間データから、start〜end(排他)の区間を切り出す（バックフィルの時点再現用）"""
+    start, end = pd.Timestamp(start_str), pd.Timestamp(end_str)
+    return {symbol: df[(df.index >= start) & (df.index < end)] for symbol, df in frames.items()}
+
+def get_history(symbol, start_str, end_str):
+    """
+    yf.Ticker(symbol).history(start, end) の読み取りキャッシュ版。
+    保存済み区間の外側（主に最終バー以降の末尾）だけをダウンロードして追記し、tz無しの OHLCV を返す。
+    """
+    return get_histories([symbol], start_str, end_str)[symbol]
+
+@timer("fetch.prices")
+def get_histories(symbols, start_str, end_str, downloader=None):
+    """
+    get_history の複数銘柄版。不足分は「全期間」「末尾のみ」の種類ごとに fetch_batch で一括取得する。
+    """
+    today_str = datetime.now(JST).strftime('%Y-%m-%d')
+    final_end = min(end_str, today_str)
+
+    conn = _connect()
+    try:
+        plans = {}
+        for symbol in dict.fromkeys(symbols):
+            plan = _plan(conn, symbol, start_str, end_str, today_str)
+            if plan:
+                plans[symbol] = plan
+        count("price.cache_hits", len(set(symbols)) - len(plans))
+
+        for kind in ("full", "tail"):
+            group = {sym: p for sym, p in plans.items() if p["kind"] == kind}
+            if not group:
+                continue
+            # 1リクエストにまとめるため、取得範囲はグループ内で最も広い区間に揃える
+            fetch_start = min(p["start"] for p in group.values())
+            fetch_end = max(p["end"] for p in group.values())
+            if len(group) == 1:
+                sym = next(iter(group))
+                frames = {sym: _download_with_retry(sym, fetch_start, fetch_end)}
+            else:
+                frames = fetch_batch(list(group), fetch_start, fetch_end, downloader=downloader)
+            for sym, plan in group.items():
+                df = frames.get(sym)
+                if df is None or df.empty:
+                    if plan["cov"]:
+                        _mark_checked(conn, sym)
+                    continue
+                # yfinance は応答サイズを返さないので、受け取った日足の本数で通信量を見る
+                count("price.rows_downloaded", len(df))
+                _apply(conn, sym, plan, df[df.index >= plan["start"]], final_end)
+
+        return {symbol: _read(conn, symbol, start_str, end_str) for symbol in symbols}
+    finally:
+        conn.close()
@@ -0,0 +1,147 @@
+import contextlib
+import hashlib
+import json
+import os
+import pickle
+import time
+import pandas as pd
+import price_store
+import news_fetcher
+import ai_analyzer
+
+# 💡 外部サービス（yfinance・ニュースRSS・Gemini）の応答を録画し、オフラインで同じ実行を再現する
+FIXTURE_DIR = "fixtures"
+
+class Fixture:
+    """録画データ一式。prices はシンボル → 日足（録画した全区間）、news は URL → 記事、gemini はプロンプトのハッシュ → 応答"""
+    def __init__(self, name, fixture_dir=FIXTURE_DIR):
+        self.name = name
+        self.dir = os.path.abspath(os.path.join(fixture_dir, name))
+        self.prices = {}
+        self.news = {}
+        self.gemini = {}
+
+    def exists(self):
+        return os.path.exists(os.path.join(self.dir, "prices.pkl"))
+
+    def load(self):
+        with open(os.path.join(self.dir, "prices.pkl"), "rb") as f:
+            self.prices = pickle.load(f)
+        for attr in ("news", "gemini"):
+            path = os.path.join(self.dir, f"{attr}.json")
+            if os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    setattr(self, attr, json.load(f))
+        return self
+
+    def save(self):
+        os.makedirs(self.dir, exist_ok=True)
+        with open(os.path.join(self.dir, "prices.pkl"), "wb") as f:
+            pickle.dump(self.prices, f)
+        for attr in ("news", "gemini"):
+            with open(os.path.join(self.dir, f"{attr}.json"), "w", encoding="utf-8") as f:
+                json.dump(getattr(self, attr), f, ensure_ascii=False, indent=2)
+
+    def add_prices(self, symbol, df):
+        if df is None or df.empty:
+            return
+        df = df[price_store.OHLCV_COLUMNS]
+        old = self.prices.get(symbol)
+        merged = df if old is None else pd.concat([old, df])
+        self.prices[symbol] = merged[~merged.index.duplicated(keep="last")].sort_index()
+
+    def prices_between(self, symbol, start_str, end_str):
+        df = self.prices.get(symbol)
+        if df is None:
+            return pd.DataFrame(columns=price_store.OHLCV_COLUMNS)
+        return df[(df.index >= pd.Timestamp(start_str)) & (df.index < pd.Timestamp(end_str))]
+
+def _gemini_key(prompt, generation_config=None):
+    body = json.dumps([prompt, generation_config], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+def _split_batch(data, symbols):
+    if data is None or data.empty:
+        return {}
+    if isinstance(data.columns, pd.MultiIndex):
+        available = set(data.columns.get_level_values(0))
+        return {s: price_store._normalize(data[s].copy()) for s in symbols if s in available}
+    return {symbols[0]: price_store._normalize(data.copy())} if len(symbols) == 1 else {}
+
+@contextlib.contextmanager
+def _patched(download, batch, fetch_feed, post):
+    originals = (price_store._download, price_store.yf.download, news_fetcher.fetch_feed, ai_analyzer.GeminiClient._post)
+    price_store._download = download
+    price_store.yf.download = batch
+    news_fetcher.fetch_feed = fetch_feed
+    ai_analyzer.GeminiClient._post = post
+    try:
+        yield
+    finally:
+        price_store._download, price_store.yf.download, news_fetcher.fetch_feed, ai_analyzer.GeminiClient._post = originals
+
+@contextlib.contextmanager
+def recording(name, fixture_dir=FIXTURE_DIR):
+    """実際の外部サービスを呼びつつ、応答を fixtures/<name>/ に録画する（既存の録画には追記）"""
+    fixture = Fixture(name, fixture_dir)
+    if fixture.exists():
+        fixture.load()
+    download, batch = price_store._download, price_store.yf.download
+    fetch_feed, post = news_fetcher.fetch_feed, ai_analyzer.GeminiClient._post
+
+    def rec_download(symbol, start_str, end_str):
+        df = download(symbol, start_str, end_str)
+        fixture.add_prices(symbol, df)
+        return df
+
+    def rec_batch(symbols, *args, **kwargs):
+        data = batch(symbols, *args, **kwargs)
+        for symbol, df in _split_batch(data, list(symbols)).items():
+            fixture.add_prices(symbol, df)
+        return data
+
+    def rec_feed(url, publisher, *args, **kwargs):
+        items = fetch_feed(url, publisher, *args, **kwargs)
+        fixture.news[url] = [{k: v for k, v in item.items() if k != "first_seen"} for item in items]
+        return items
+
+    def rec_post(self, prompt, generation_config=None):
+        text = post(self, prompt, generation_config)
+        fixture.gemini[_gemini_key(prompt, generation_config)] = text
+        return text
+
+    with _patched(rec_download, rec_batch, rec_feed, rec_post):
+        try:
+            yield fixture
+        finally:
+            fixture.save()
+
+@contextlib.contextmanager
+def replaying(fixture):
+    """
+    録画データ（Fixture またはその名前）だけで外部サービスを置き換える。ネットワークには一切出ない。
+    録画に無い株価は空、ニュースは0件、Gemini は GeminiError になる。
+    """
+    if isinstance(fixture, str):
+        fixture = Fixture(fixture).load()
+
+    def rep_download(symbol, start_str, end_str):
+        return fixture.prices_between(symbol, start_str, end_str).copy()
+
+    def rep_batch(symbols, start=None, end=None, **kwargs):
+        parts = {s: fixture.prices_between(s, start, end) for s in symbols}
+        parts = {s: df for s, df in parts.items() if not df.empty}
+        return pd.concat(parts, axis=1) if parts else pd.DataFrame()
+
+    def rep_feed(url, publisher, *args, **kwargs):
+        now = time.time()
+        return [{**item, "first_seen": now} for item in fixture.news.get(url, [])]
+
+    def rep_post(self, prompt, generation_config=None):
+        key = _gemini_key(prompt, generation_config)
+        if key not in fixture.gemini:
+            raise ai_analyzer.GeminiError("録画にない Gemini 応答です")
+        return fixture.gemini[key]
+
+    with _patched(rep_download, rep_batch, rep_feed, rep_post):
+        yield fixture
@@ -1,143 +1,58 @@
+import hashlib
 import json
 import os
+from history_store import HISTORY_DIR, PRICES_DIR, previous_day, save_report
+from html_template import Template
+from signal_rules import marker_styles_json
+from exit_rules import exit_rule_text
+from portfolio import PORTFOLIO_PATH
+from strategy_stats import SUMMARY_PATH
+from run_context import RunContext
+from metrics import RUN_METRICS_PATH, load_run_metrics, count, timer
 from datetime import datetime, timedelta, timezone
 
 JST = timezone(timedelta(hours=9))
 
-def load_previous_report():
-    history_dir = "public/history"
-    if os.path.exists(history_dir):
-        files = sorted([f for f in os.listdir(history_dir) if f.endswith(".json")], reverse=True)
-        now_date = datetime.now(JST).strftime('%Y-%m-%d')
-        for f_name in files:
-            if f_name != f"{now_date}.json":
-                try:
-                    with open(os.path.join(history_dir, f_name), "r", encoding="utf-8") as f:
-                        return json.load(f)
-                except Exception: pass
-    return None
-
-def generate_files(watch_data, scan_data_dict, prev_report=None):
-    os.makedirs("public", exist_ok=True)
-    os.makedirs("public/history", exist_ok=True)
-    
-    now = datetime.now(JST)
-    now_str = now.strftime('%Y/%m/%d %H:%M')
-    date_str = now.strftime('%Y-%m-%d')
-    
-    try:
-        with open("watchlist.json", "r", encoding="utf-8") as f:
-            order = list(json.load(f).keys())
-        watch_data = sorted(watch_data, key=lambda x: order.index(x['code']) if x['code'] in order else 999)
-    except Exception: pass
-        
-    report_dict = {"updated_at": now_str, "date": date_str, "watch_data": watch_data, "scan_data": scan_data_dict}
-    with open("public/report.json", "w", encoding="utf-8") as f: json.dump(report_dict, f, ensure_ascii=False, indent=2)
-    with open(f"public/history/{date_str}.json", "w", encoding="utf-8") as f: json.dump(report_dict, f, ensure_ascii=False, indent=2)
+INDEX_PATH = "public/index.html"
+# 💡 チャート用の株価はページに埋め込まず銘柄ごとの列形式JSONにし、カードが画面に入った時だけ読み込む
+CHART_DIR = "public/charts"
 
-    summary = {"total_signals": 0, "win_rate": 0.0, "avg_return": 0.0, "expectancy": 0.0}
-    if os.path.exists("public/performance_summary.json"):
-        with open("public/performance_summary.json", "r", encoding="utf-8") as f: summary = json.load(f)
-            
-    market_info = scan_data_dict.get("market_info", {"text": "判定不能", "is_good": False, "nikkei_data": {}})
-    nikkei = market_info.get("nikkei_data", {})
-    scan_a = scan_data_dict.get("scan_a", [])
-    scan_b = scan_data_dict.get("scan_b", [])
+# --- ページ部品のテンプレート（import 時にコンパイル済み） ---
 
-    nikkei_html = ""
-    if nikkei:
-        diff = nikkei.get('diff', 0)
-        diff_str = f"+{diff:,}" if diff > 0 else f"{diff:,}"
-        diff_color = "#69f0ae" if diff > 0 else ("#ff5252" if diff < 0 else "#9e9e9e")
-
-        nikkei_html = f"""
-        <div style="margin-top: 15px; padding: 12px 18px; background-color: rgba(0,0,0,0.3); border-radius: 8px; border: 1px solid #333;">
-            <div style="font-size: 1.3rem; font-weight: bold; margin-bottom: 8px; color: #fff;">
-                日経平均株価: <span style="font-size: 1.5rem;">{nikkei.get('close', 0):,}円</span>
-                <span style="color: {diff_color}; font-size: 1.1rem; margin-left: 10px;">({diff_str}円)</span>
-            </div>
-            <div style="font-size: 0.9rem; color: #bbb; display: flex; gap: 20px;">
-                <span>始値: {nikkei.get('open', 0):,}円</span>
-                <span>高値: {nikkei.get('high', 0):,}円</span>
-                <span>安値: {nikkei.get('low', 0):,}円</span>
-            </div>
-        </div>
-        """
-        
-    reflection_html = ""
-    if prev_report and prev_report.get("scan_a"):
-        prev_date = prev_report.get("date", "前回")
-        reflection_html += f'<h2 style="color: #b388ff; border-left: 4px solid #b388ff; margin-top: 25px; margin-bottom: 10px;">🔄 昨日のA群（本命）の答え合わせ [{prev_date}]</h2>'
-        all_today_items = watch_data + scan_a + scan_b
-        today_price_dict = {item["code"]: item.get("price") for item in all_today_items if "code" in item}
-
-        for prev_item in prev_report["scan_a"]:
-            code = prev_item.get("code")
-            name = prev_item.get("name", "")
-            prev_price = prev_item.get("price", 0)
-            today_price = today_price_dict.get(code)
-
-            if today_price and prev_price > 0:
-                diff = today_price - prev_price
-                pct = (diff / prev_price) * 100
-                diff_str = f"+{diff:,}円" if diff > 0 else (f"{diff:,}円" if diff < 0 else "±0円")
-                pct_str = f"+{pct:.2f}%" if pct > 0 else f"{pct:.2f}%"
-                color_class = "diff-up" if diff > 0 else ("diff-down" if diff < 0 else "diff-even")
-                color_hex = "#69f0ae" if diff > 0 else ("#ff5252" if diff < 0 else "#9e9e9e")
-
-                reflection_html += f'''
-                <div class="card" style="border-left: 4px solid {color_hex}; margin-bottom: 8px;">
-                    <div style="display: flex; justify-content: space-between; align-items: center;">
-                        <div>
-                            <span style="font-weight: bold; color: #fff; font-size: 1.1rem;">{code} {name}</span>
-                            <div style="font-size: 0.85rem; color: #aaa; margin-top: 4px;">昨日の推奨値: {prev_price:,}円</div>
-                        </div>
-                        <div style="text-align: right;">
-                            <div style="font-size: 0.85rem; color: #aaa;">本日の終値</div>
-                            <strong style="font-size: 1.2rem; color: #fff;">{today_price:,}円</strong>
-                            <span class="{color_class}" style="margin-left: 8px;">{diff_str} ({pct_str})</span>
-                        </div>
-                    </div>
-                </div>
-                '''
-            else:
-                reflection_html += f'''
-                <div class="card" style="border-left: 4px solid #757575; margin-bottom: 8px;">
-                    <span style="font-weight: bold; color: #fff;">{code} {name}</span>
-                    <span style="font-size: 0.85rem; color: #aaa; margin-left: 10px;">(本日の価格データ取得できず)</span>
-                </div>
-                '''
-
-    top_pick_html = ""
-    if scan_a and scan_a[0].get("is_top_pick"):
-        top_item = scan_a[0]
-        bold_pred = top_item.get("bold_prediction", "")
-        if bold_pred:
-            top_pick_html = f"""
-            <div class="card" style="border: 2px solid #ffd700; background: linear-gradient(145deg, #2a2000, #1a1a1a); margin-top: 15px; margin-bottom: 25px; box-shadow: 0 4px 15px rgba(255, 215, 0, 0.15);">
-                <h2 style="color: #ffd700; margin-top: 0; border-bottom: 1px solid #554400; padding-bottom: 8px;">🌟 IPPOの渾身の一推し銘柄</h2>
-                <div style="font-size: 1.3rem; font-weight: bold; color: #fff; margin-bottom: 10px;">
-                    {top_item['code']} {top_item.get('name', '')} 
-                    <span style="font-size: 0.95rem; font-weight: normal; margin-left: 12px; color: #ccc;">現在値: {top_item.get('price', 0):,}円</span>
-                </div>
-                <div class="ai-report" style="color: #e0e0e0; line-height: 1.8; font-size: 0.95rem;">
-                    {bold_pred}
-                </div>
-            </div>
-            """
-
-    html = f"""<!DOCTYPE html>
+PAGE_HEAD = Template("""<!DOCTYPE html>
 <html lang="ja">
 <head>
     <meta charset="UTF-8"><meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>投資戦略ダッシュボード</title>
-    <script src="https://unpkg.com/lightweight-charts@4.1.1/dist/lightweight-charts.standalone.production.js"></script>
+    <script defer src="https://unpkg.com/lightweight-charts@4.1.1/dist/lightweight-charts.standalone.production.js"></script>
     <style>
         body {{ font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, sans-serif; background-color: #121212; color: #e0e0e0; margin: 0; padding: 15px; line-height: 1.6; }}
-        h1 {{ font-size: 1.4rem; border-bottom: 2px solid #333; padding-bottom: 10px; margin-bottom: 20px; }}
+        h1 {{ font-size: 1.4rem; margin: 0; border: none; padding: 0; }}
         h2 {{ font-size: 1.1rem; margin-top: 25px; color: #4db8ff; border-left: 4px solid #4db8ff; padding-left: 8px; }}
+        .page-header {{ display: flex; justify-content: space-between; align-items: center; margin-bottom: 20px; border-bottom: 2px solid #333; padding-bottom: 10px; }}
+        .header-link {{ background-color: #1a237e; color: #4db8ff; text-decoration: none; padding: 8px 15px; border-radius: 4px; font-size: 0.9rem; font-weight: bold; border: 1px solid #3949ab; }}
+        .update-time {{ font-size: 0.85rem; color: #888; text-align: right; margin-top: -15px; margin-bottom: 15px; }}
+        .market-box {{ background-color: #1e1e1e; padding: 15px; border-radius: 6px; margin-bottom: 15px; border-left: 4px solid; }}
+        .market-label {{ font-size: 0.9rem; color: #aaa; }} .market-text {{ font-size: 1.2rem; color: #fff; }}
+        .nikkei-box {{ margin-top: 15px; padding: 12px 18px; background-color: rgba(0,0,0,0.3); border-radius: 8px; border: 1px solid #333; }}
+        .nikkei-main {{ font-size: 1.3rem; font-weight: bold; margin-bottom: 8px; color: #fff; }} .nikkei-price {{ font-size: 1.5rem; }}
+        .nikkei-diff {{ font-size: 1.1rem; margin-left: 10px; }} .nikkei-ohlc {{ font-size: 0.9rem; color: #bbb; display: flex; gap: 20px; }}
+        .h2-reflection {{ color: #b388ff; border-left-color: #b388ff; margin-bottom: 10px; }}
+        .h2-scan {{ color: #ffab00; border-left-color: #ffab00; margin-top: 5px; }}
         .card {{ background-color: #1e1e1e; border-radius: 8px; padding: 15px; margin-bottom: 12px; box-shadow: 0 4px 6px rgba(0,0,0,0.3); }}
         .card-title {{ font-weight: bold; font-size: 1.1rem; margin-bottom: 8px; color: #fff; }}
+        .reflection-card {{ border-left: 4px solid; margin-bottom: 8px; }}
+        .reflection-row {{ display: flex; justify-content: space-between; align-items: center; }}
+        .reflection-name {{ font-weight: bold; color: #fff; font-size: 1.1rem; }} .reflection-sub {{ font-size: 0.85rem; color: #aaa; }}
+        .top-pick {{ border: 2px solid #ffd700; background: linear-gradient(145deg, #2a2000, #1a1a1a); margin-top: 15px; margin-bottom: 25px; box-shadow: 0 4px 15px rgba(255, 215, 0, 0.15); }}
+        .top-pick h2 {{ color: #ffd700; margin-top: 0; border-left: none; padding-left: 0; border-bottom: 1px solid #554400; padding-bottom: 8px; }}
+        .top-pick-title {{ font-size: 1.3rem; font-weight: bold; color: #fff; margin-bottom: 10px; }}
+        .top-pick-price {{ font-size: 0.95rem; font-weight: normal; margin-left: 12px; color: #ccc; }}
+        .ai-report {{ color: #e0e0e0; line-height: 1.8; font-size: 0.95rem; }}
+        .price-line {{ margin-bottom: 4px; }} .price-value {{ font-size: 1.1rem; }}
+        .metric-row {{ margin-top: 8px; margin-bottom: 4px; display: flex; flex-wrap: wrap; gap: 6px; align-items: center; }}
+        .metric {{ font-size: 0.9rem; }} .metric-sub {{ color: #aaa; font-size: 0.8rem; }} .metric-gap {{ margin-left: 8px; }}
+        .badge-row {{ margin-top: 6px; margin-bottom: 6px; display: flex; flex-wrap: wrap; gap: 4px; }}
         .badge {{ padding: 3px 8px; border-radius: 4px; font-size: 0.8rem; font-weight: bold; margin-right: 5px; display: inline-block; margin-bottom: 4px; }}
         .badge-up {{ background-color: #2e7d32; color: white; }} .badge-down {{ background-color: #c62828; color: white; }}
         .badge-signal {{ background-color: rgba(103,58,183,0.15); color: #d1c4e9; border: 1px solid #673ab7; }}
@@ -154,292 +69,587 @@ def generate_files(watch_data, scan_data_dict, prev_report=None):
         .stats-grid {{ display: grid; grid-template-columns: repeat(2, 1fr); gap: 10px; margin-top: 15px; }}
         .stat-item {{ text-align: center; background-color: rgba(0,0,0,0.2); padding: 10px; border-radius: 6px; }}
         .stat-value {{ font-size: 1.3rem; font-weight: bold; color: #fff; }} .stat-label {{ font-size: 0.75rem; color: #9fa8da; }}
+        .strategy-box {{ margin-top: 15px; border-top: 1px solid #3949ab; padding-top: 15px; }}
+        .strategy-title {{ font-size: 0.85rem; font-weight: bold; color: #c5cae9; margin-bottom: 8px; }}
+        .strategy-table {{ width: 100%; border-collapse: collapse; font-size: 0.85rem; color: #e0e0e0; }}
+        .strategy-table th {{ padding: 6px 4px; text-align: right; color: #9fa8da; border-bottom: 1px solid rgba(255,255,255,0.1); }}
+        .strategy-table td {{ padding: 6px 4px; text-align: right; border-bottom: 1px solid rgba(255,255,255,0.05); }}
+        .strategy-table th:first-child, .strategy-table td:first-child {{ text-align: left; }} .strategy-table td:first-child {{ font-weight: bold; }}
+        .stats-note {{ font-size: 0.8rem; color: #9fa8da; margin-top: 15px; background-color: rgba(0,0,0,0.2); padding: 10px; border-radius: 6px; line-height: 1.5; }}
+        .metrics-box {{ background-color: #1a1a1a; border: 1px solid #333; border-radius: 8px; padding: 12px 15px; margin-top: 20px; font-size: 0.85rem; }}
+        .metrics-box summary {{ cursor: pointer; font-weight: bold; color: #bbb; outline: none; }}
+        .metrics-row {{ display: flex; align-items: center; gap: 8px; margin-top: 6px; }}
+        .metrics-date {{ color: #888; width: 8.5em; flex-shrink: 0; }} .metrics-sec {{ color: #ddd; width: 4em; text-align: right; }}
+        .metrics-track {{ flex: 1; background-color: #2b2b2b; height: 8px; border-radius: 4px; overflow: hidden; }}
+        .metrics-bar {{ display: block; height: 100%; background-color: #5c6bc0; }}
+        .metrics-detail {{ color: #777; font-size: 0.75rem; margin-left: calc(8.5em + 8px); }}
         .glossary {{ background-color: #1a1a1a; padding: 15px; border-radius: 8px; font-size: 0.85rem; margin-top: 30px; border-top: 1px solid #333; }}
+        .glossary-title {{ font-weight: bold; font-size: 1rem; margin-bottom: 8px; border-bottom: 1px solid #333; padding-bottom: 5px; }}
         .error-text {{ color: #757575; font-style: italic; font-size: 0.9rem; }}
-        .update-time {{ font-size: 0.85rem; color: #888; text-align: right; margin-top: -15px; margin-bottom: 15px; }}
-        .chart-container {{ width: 100%; height: 250px; margin-top: 15px; border: 1px solid #333; border-radius: 4px; overflow: hidden; }}
+        .chart-wrapper {{ position: relative; margin-top: 15px; }}
+        .chart-legend {{ position: absolute; top: 8px; left: 12px; z-index: 10; font-size: 0.85rem; padding: 4px 8px; background: rgba(30,30,30,0.8); border-radius: 4px; border: 1px solid #444; color: #fff; display: flex; gap: 12px; }}
+        .chart-legend:empty {{ display: none; }}
+        .chart-box {{ width: 100%; height: 250px; border: 1px solid #333; border-radius: 4px; overflow: hidden; }}
         .diff-up {{ color: #69f0ae; font-weight: bold; font-size: 0.95rem; margin-left: 5px; }}
         .diff-down {{ color: #ff5252; font-weight: bold; font-size: 0.95rem; margin-left: 5px; }}
         .diff-even {{ color: #9e9e9e; font-weight: bold; font-size: 0.95rem; margin-left: 5px; }}
         .action-link {{ display: inline-block; padding: 6px 12px; margin-top: 12px; margin-right: 8px; background-color: #1a237e; color: #e8eaf6; text-decoration: none; border-radius: 4px; font-size: 0.85rem; font-weight: bold; border: 1px solid #3949ab; }}
         .b-group-box {{ background-color: #1a1a1a; border: 1px solid #333; border-radius: 8px; padding: 15px; margin-bottom: 20px; }}
+        .b-group-box summary {{ font-weight: bold; color: #888; outline: none; cursor: pointer; }}
         .b-group-item {{ border-bottom: 1px solid #333; padding-bottom: 8px; margin-bottom: 8px; }}
         .b-group-item:last-child {{ border-bottom: none; margin-bottom: 0; padding-bottom: 0; }}
+        .b-group-name {{ font-weight: bold; color: #bbb; }} .b-group-price {{ font-weight: normal; font-size: 0.9rem; color: #888; }}
+        .b-group-signals {{ font-size: 0.85rem; color: #777; margin-top: 3px; }}
         .ai-comment-box {{ background: linear-gradient(145deg, #1e253c, #151a2a); border-left: 4px solid #b388ff; border-radius: 6px; padding: 12px 15px; margin-top: 15px; font-size: 0.9rem; color: #e8eaf6; box-shadow: 0 4px 6px rgba(0,0,0,0.2); }}
         .ai-comment-header {{ font-weight: bold; color: #b388ff; margin-bottom: 6px; display: flex; align-items: center; gap: 6px; }}
     </style>
 </head>
 <body>
-    <div style="display: flex; justify-content: space-between; align-items: center; margin-bottom: 20px; border-bottom: 2px solid #333; padding-bottom: 10px;">
-        <h1 style="margin: 0; border: none; padding: 0;">📊 投資戦略ダッシュボード</h1>
-        <a href="analyzer.html" style="background-color: #1a237e; color: #4db8ff; text-decoration: none; padding: 8px 15px; border-radius: 4px; font-size: 0.9rem; font-weight: bold; border: 1px solid #3949ab;">🔍 個別銘柄分析を開く</a>
+    <div class="page-header">
+        <h1>📊 投資戦略ダッシュボード</h1>
+        <a href="analyzer.html" class="header-link">🔍 個別銘柄分析を開く</a>
     </div>
     <div class="update-time">最終更新: {now_str}</div>
 
-    <div style="background-color: #1e1e1e; padding: 15px; border-radius: 6px; margin-bottom: 15px; border-left: 4px solid {'#2e7d32' if market_info['is_good'] else ('#fbc02d' if '調整' in market_info['text'] else '#c62828')};">
+    <div class="market-box" style="border-left-color: {market_color};">
         <div style="margin-bottom: 5px;">
-            <span style="font-size: 0.9rem; color: #aaa;">本日の相場環境：</span> 
-            <strong style="font-size: 1.2rem; color: #fff;">{market_info['text']}</strong>
+            <span class="market-label">本日の相場環境：</span>
+            <strong class="market-text">{market_text}</strong>
+        </div>
+""")
+
+NIKKEI = Template("""
+        <div class="nikkei-box">
+            <div class="nikkei-main">
+                日経平均株価: <span class="nikkei-price">{close:,}円</span>
+                <span class="nikkei-diff" style="color: {diff_color};">({diff_str}円)</span>
+            </div>
+            <div class="nikkei-ohlc">
+                <span>始値: {open:,}円</span>
+                <span>高値: {high:,}円</span>
+                <span>安値: {low:,}円</span>
+            </div>
+        </div>
+""")
+
+MARKET_CLOSE = "    </div>\n"
+
+REFLECTION_HEADER = Template('<h2 class="h2-reflection">🔄 昨日のA群（本命）の答え合わせ [{prev_date}]</h2>\n')
+
+REFLECTION_ROW = Template("""
+    <div class="card reflection-card" style="border-left-color: {color};">
+        <div class="reflection-row">
+            <div>
+                <span class="reflection-name">{code} {name!e}</span>
+                <div class="reflection-sub" style="margin-top: 4px;">昨日の推奨値: {prev_price:,}円</div>
+            </div>
+            <div style="text-align: right;">
+                <div class="reflection-sub">本日の終値</div>
+                <strong style="font-size: 1.2rem; color: #fff;">{today_price:,}円</strong>
+                <span class="{color_class}" style="margin-left: 8px;">{diff_str} ({pct_str})</span>
+            </div>
         </div>
-        {nikkei_html}
     </div>
+""")
 
-    {reflection_html}
-    {top_pick_html}
+REFLECTION_MISSING = Template("""
+    <div class="card reflection-card" style="border-left-color: #757575;">
+        <span class="reflection-name">{code} {name!e}</span>
+        <span class="reflection-sub" style="margin-left: 10px;">(本日の価格データ取得できず)</span>
+    </div>
+""")
 
-    <h2 style="color: #ffab00; border-left: 4px solid #ffab00; margin-top: 5px;">👑 本日の条件達成銘柄</h2>
-"""
-    if not scan_a:
-        html += '<div class="card"><div class="error-text">本日の鉄板条件クリア銘柄なし（休むも相場です）</div></div>'
-    else:
-        for item in scan_a:
-            company_name = item.get("name", "")
-            diff = item.get("price_diff", 0)
-            diff_html = f'<span class="diff-up">(+{diff:,}円)</span>' if diff > 0 else (f'<span class="diff-down">({diff:,}円)</span>' if diff < 0 else f'<span class="diff-even">(±0円)</span>')
-
-            html += f'<div class="card highlight"><div class="card-title">{item["code"]} {company_name}</div>'
-            html += f'<div style="margin-bottom: 8px;">現在値: <strong style="font-size:1.1rem;">{item["price"]:,}円</strong> {diff_html}</div>'
-
-            rsi = item.get("rsi", "-")
-            rsi_trend = item.get("rsi_trend", "")
-            vol_text = item.get("vol_text", "")
-            rsi_class = "rsi-high" if type(rsi) != str and rsi >= 70 else ("rsi-low" if type(rsi) != str and rsi <= 30 else "")
-            
-            html += f'<div style="margin-top:4px; margin-bottom:8px; display:flex; flex-wrap:wrap; gap:6px align-items:center;">'
-            html += f'<span style="font-size:0.9rem;">RSI: <span class="{rsi_class}">{rsi}</span> <span style="color:#aaa; font-size:0.8rem;">({rsi_trend})</span></span>'
-            html += f'<span style="font-size:0.9rem; margin-left:8px;">出来高: <span style="color:#aaa; font-size:0.8rem;">{vol_text}</span></span>'
-            html += f'</div>'
-            
-            if item.get("signals"):
-                html += '<div style="margin-top: 6px; margin-bottom: 6px; display:flex; flex-wrap:wrap; gap:4px;">'
-                for sig in item["signals"]:
-                    badge_cls = "badge-signal"
-                    if "[BREAKOUT]" in sig: badge_cls = "badge-breakout"
-                    elif "[ALERT]" in sig: badge_cls = "badge-alert"
-                    elif "[REVERSAL]" in sig: badge_cls = "badge-reversal"
-                    elif "[PULLBACK]" in sig: badge_cls = "badge-pullback"
-                    elif "出来高" in sig: badge_cls = "badge-volume"
-                    html += f'<span class="badge {badge_cls}">{sig}</span>'
-                html += '</div>'
-            
-            html += f'<div><a href="https://finance.yahoo.co.jp/quote/{item["code"]}.T" target="_blank" class="action-link">📊 株価詳細</a> <a href="https://finance.yahoo.co.jp/quote/{item["code"]}.T/news" target="_blank" class="action-link">📰 ニュース</a></div>'
-
-            ai_comment = item.get("ai_comment", "")
-            if ai_comment:
-                html += f'<div class="ai-comment-box"><div class="ai-comment-header"><span>🤖</span> AIテクニカル分析</div><div>{ai_comment}</div></div>'
-
-            if "history_data" in item:
-                html += f'<div style="position:relative; margin-top:15px;" id="chart-wrapper-{item["code"]}">'
-                html += f'<div id="legend-{item["code"]}" style="position:absolute; top:8px; left:12px; z-index:10; font-size:0.85rem; padding:4px 8px; background:rgba(30,30,30,0.8); border-radius:4px; border:1px solid #444; color:#fff; display:flex; gap:12px;"></div>'
-                html += f'<div id="chart-scan-{item["code"]}" style="width:100%; height:250px; border:1px solid #333; border-radius:4px; overflow:hidden;"></div>'
-                html += f'</div>'
-            html += '</div>'
-
-    if scan_b:
-        html += f"""
-        <details class="b-group-box">
-            <summary style="font-weight:bold; color:#888; outline: none; cursor:pointer;">📁 次点・監視用ログ（{len(scan_b)}件）</summary>
-            <div style="margin-top: 15px;">
-        """
-        for item in scan_b:
-            company_name = item.get("name", "")
-            diff = item.get("price_diff", 0)
-            diff_str = f"+{diff}" if diff > 0 else str(diff)
-            sigs = " ".join([f"[{s}]" for s in item.get("signals", [])])
-            html += f"""
-                <div class="b-group-item">
-                    <div style="font-weight: bold; color: #bbb;">{item["code"]} {company_name} <span style="font-weight:normal; font-size:0.9rem; color:#888;">({item["price"]:,}円 / {diff_str}円)</span></div>
-                    <div style="font-size: 0.85rem; color: #777; margin-top:3px;">{sigs}</div>
-                </div>
-            """
-        html += "</div></details>"
-            
-    html += f"""
+TOP_PICK = Template("""
+    <div class="card top-pick">
+        <h2>🌟 IPPOの渾身の一推し銘柄</h2>
+        <div class="top-pick-title">
+            {code} {name!e}
+            <span class="top-pick-price">現在値: {price:,}円</span>
+        </div>
+        <div class="ai-report">
+            {bold_prediction}
+        </div>
+    </div>
+""")
+
+SCAN_HEADER = '\n    <h2 class="h2-scan">👑 本日の条件達成銘柄</h2>\n'
+SCAN_EMPTY = '<div class="card"><div class="error-text">本日の鉄板条件クリア銘柄なし（休むも相場です）</div></div>\n'
+
+CARD_OPEN = Template('<div class="card{extra_class}"><div class="card-title">{code} {name!e}</div>')
+CARD_ERROR = Template('<div class="card"><div class="card-title">{code} {name!e}</div><div class="error-text">⚠️ {error_msg!e}</div></div>\n')
+PRICE_LINE = Template('<div class="price-line">現在値: <strong class="price-value">{price:,}円</strong> {diff_html}</div>')
+DIFF_UP = Template('<span class="diff-up">(+{diff:,}円)</span>')
+DIFF_DOWN = Template('<span class="diff-down">({diff:,}円)</span>')
+DIFF_EVEN = '<span class="diff-even">(±0円)</span>'
+METRIC_ROW_OPEN = '<div class="metric-row">'
+POSITION_BADGE = Template('<span class="badge {pos_class}">{position}</span>')
+METRICS = Template('<span class="metric">RSI: <span class="{rsi_class}">{rsi}</span> <span class="metric-sub">({rsi_trend})</span></span>'
+                   '<span class="metric metric-gap">出来高: <span class="metric-sub">{vol_text}</span></span></div>')
+BADGE = Template('<span class="badge {badge_class}">{signal!e}</span>')
+LINKS = Template('<div><a href="https://finance.yahoo.co.jp/quote/{code}.T" target="_blank" class="action-link">📊 株価詳細</a> '
+                 '<a href="https://finance.yahoo.co.jp/quote/{code}.T/news" target="_blank" class="action-link">📰 ニュース</a></div>')
+AI_COMMENT = Template('<div class="ai-comment-box"><div class="ai-comment-header"><span>🤖</span> AIテクニカル分析</div><div>{ai_comment}</div></div>')
+CHART = Template('<div class="chart-wrapper"><div class="chart-legend"></div><div class="chart-box" data-src="{src}"></div></div>')
+CARD_CLOSE = '</div>\n'
+
+B_GROUP_OPEN = Template("""
+    <details class="b-group-box">
+        <summary>📁 次点・監視用ログ（{count}件）</summary>
+        <div style="margin-top: 15px;">
+""")
+B_GROUP_ITEM = Template("""
+            <div class="b-group-item">
+                <div class="b-group-name">{code} {name!e} <span class="b-group-price">({price:,}円 / {diff_str}円)</span></div>
+                <div class="b-group-signals">{signals!e}</div>
+            </div>
+""")
+B_GROUP_CLOSE = "</div></details>\n"
+
+STATS_OPEN = Template("""
     <details class="stats-box">
         <summary>📈 条件達成銘柄の検証データ（5営業日スイング）</summary>
         <div class="stats-grid">
-            <div class="stat-item"><div class="stat-value">{summary["total_signals"]}</div><div class="stat-label">総シグナル数</div></div>
-            <div class="stat-item"><div class="stat-value">{summary["win_rate"]}%</div><div class="stat-label">全体勝率</div></div>
-            <div class="stat-item"><div class="stat-value">{summary["avg_return"]}%</div><div class="stat-label">平均リターン</div></div>
-            <div class="stat-item"><div class="stat-value">{summary.get("expectancy", "-")}%</div><div class="stat-label">期待値</div></div>
+            <div class="stat-item"><div class="stat-value">{total_signals}</div><div class="stat-label">総シグナル数</div></div>
+            <div class="stat-item"><div class="stat-value">{win_rate}%</div><div class="stat-label">全体勝率</div></div>
+            <div class="stat-item"><div class="stat-value">{avg_return}%</div><div class="stat-label">平均リターン</div></div>
+            <div class="stat-item"><div class="stat-value">{expectancy}%</div><div class="stat-label">期待値</div></div>
         </div>
-    """
-    
-    strategies = summary.get("strategies", {})
-    if strategies:
-        html += """
-        <div style="margin-top: 15px; border-top: 1px solid #3949ab; padding-top: 15px;">
-            <div style="font-size: 0.85rem; font-weight: bold; color: #c5cae9; margin-bottom: 8px;">戦術別パフォーマンス</div>
-            <table style="width: 100%; border-collapse: collapse; font-size: 0.85rem; color: #e0e0e0;">
-                <tr style="border-bottom: 1px solid rgba(255,255,255,0.1); color: #9fa8da;">
-                    <th style="padding: 6px 4px; text-align: left;">戦術</th>
-                    <th style="padding: 6px 4px; text-align: right;">回数</th>
-                    <th style="padding: 6px 4px; text-align: right;">勝率</th>
-                    <th style="padding: 6px 4px; text-align: right;">平均リターン</th>
-                </tr>
+""")
+STRATEGY_TABLE_OPEN = Template("""
+        <div class="strategy-box">
+            <div class="strategy-title">戦術別パフォーマンス</div>
+            <table class="strategy-table">
+                <tr><th>戦術</th><th>回数</th><th>勝率</th><th>平均リターン</th><th>勝率の{ci_label}区間</th></tr>
+""")
+STRATEGY_ROW = Template('                <tr><td>{display_name}</td><td>{total_signals}</td><td>{win_rate}%</td><td>{avg_return}%</td><td>{ci}</td></tr>\n')
+STRATEGY_TABLE_CLOSE = "            </table>\n        </div>\n"
+EXIT_TABLE_OPEN = """
+        <div class="strategy-box">
+            <div class="strategy-title">手仕舞いルール別パフォーマンス</div>
+            <table class="strategy-table">
+                <tr><th>戦術</th><th>ルール</th><th>勝率</th><th>平均リターン</th><th>平均保有</th></tr>
 """
-        strategy_names = {"BREAKOUT": "🚀 上昇加速型", "PULLBACK": "🟢 押し目拾い型", "REVERSAL": "🔄 底打ち確認型"}
-        for st_name in ["BREAKOUT", "PULLBACK", "REVERSAL"]:
-            if st_name in strategies:
-                st = strategies[st_name]
-                display_name = strategy_names.get(st_name, st_name)
-                html += f"""
-                <tr style="border-bottom: 1px solid rgba(255,255,255,0.05);">
-                    <td style="padding: 6px 4px; font-weight: bold;">{display_name}</td>
-                    <td style="padding: 6px 4px; text-align: right;">{st["total_signals"]}</td>
-                    <td style="padding: 6px 4px; text-align: right;">{st["win_rate"]}%</td>
-                    <td style="padding: 6px 4px; text-align: right;">{st["avg_return"]}%</td>
-                </tr>
-"""
-        html += "</table></div>"
-
-    html += """
-        <div style="font-size: 0.8rem; color: #9fa8da; margin-top: 15px; background-color: rgba(0,0,0,0.2); padding: 10px; border-radius: 6px; line-height: 1.5;">
+EXIT_ROW = Template('                <tr><td>{display_name}</td><td>{rule!e}</td><td>{win_rate}%</td><td>{avg_return}%</td><td>{avg_days}日</td></tr>\n')
+PORTFOLIO = Template("""
+        <div class="strategy-box">
+            <div class="strategy-title">口座シミュレーション（元手{initial_capital:,}円・最大{max_positions}銘柄・100株単位・手数料込み）</div>
+            <div class="stats-grid">
+                <div class="stat-item"><div class="stat-value">{total_return}%</div><div class="stat-label">総リターン</div></div>
+                <div class="stat-item"><div class="stat-value">{max_drawdown}%</div><div class="stat-label">最大ドローダウン</div></div>
+                <div class="stat-item"><div class="stat-value">{turnover}回</div><div class="stat-label">年間回転率</div></div>
+                <div class="stat-item"><div class="stat-value">{trades}</div><div class="stat-label">売買回数（見送り {skipped}）</div></div>
+            </div>
+        </div>
+""")
+STATS_CLOSE = Template("""
+        <div class="stats-note">
             ※シグナル発生日の翌日始値で買い、5営業日後の終値で売却したと仮定したシミュレーション結果です。
+            手仕舞いルール別は、日々の高値・安値で損切り・利確・トレーリングストップに先に届いた方で決済し、届かなければ期日の終値で売却した場合です。
+{ci_note}            口座シミュレーションは、同じ日に枠を超えるシグナルが出たら見送り、前日の評価額の一定割合で100株単位に買えるだけ買った場合です。
         </div>
     </details>
-    """
+""")
+CI_NOTE = Template("            勝率の{confidence}%区間は、過去のトレードを復元抽出で{resamples:,}回作り直したブートストラップ信頼区間です（50%をまたぐ戦術は優位性が確定的ではありません）。\n")
+
+def ci_settings(strategies):
+    """💡 信頼区間の水準・再標本化の回数は、サマリーの ci に記録された値を使う（本文に直書きしない）。無ければ None"""
+    for st in strategies.values():
+        ci = st.get("ci")
+        if ci and "confidence" in ci and "resamples" in ci:
+            return ci["confidence"], ci["resamples"]
+    return None
+
+WATCH_HEADER = '<h2>📋 監視銘柄の状況</h2>\n'
+
+METRICS_ROW = Template('<div class="metrics-row"><span class="metrics-date">{finished_at}</span>'
+                       '<span class="metrics-track"><span class="metrics-bar" style="width:{width}%;"></span></span>'
+                       '<span class="metrics-sec">{duration:.0f}秒</span></div><div class="metrics-detail">{detail}</div>')
+METRICS_PANEL = Template("""
+    <details class="metrics-box">
+        <summary>⏱️ バッチ処理時間の推移（直近{runs}回）</summary>
+        <div style="margin-top: 12px;">{rows}</div>
+        <div class="metrics-detail" style="margin-top: 10px;">前回のステージ別: {stage_text}</div>
+    </details>
+""")
 
-    html += '<h2>📋 監視銘柄の状況</h2>'
-    
-    for item in watch_data:
-        html += '<div class="card">'
-        if item.get("error"):
-            html += f'<div class="card-title">{item["code"]} {item["name"]}</div><div class="error-text">⚠️ {item.get("error_msg", "エラー")}</div>'
-        else:
-            pos_class = "badge-up" if "上" in item.get("position", "") else "badge-down"
-            rsi_class = "rsi-high" if item.get("rsi", 50) >= 70 else ("rsi-low" if item.get("rsi", 50) <= 30 else "")
-            diff = item.get("price_diff", 0)
-            diff_html = f'<span class="diff-up">(+{diff:,}円)</span>' if diff > 0 else (f'<span class="diff-down">({diff:,}円)</span>' if diff < 0 else f'<span class="diff-even">(±0円)</span>')
-
-            html += f'<div class="card-title">{item["code"]} {item.get("name", "")}</div>'
-            html += f'<div>現在値: <strong style="font-size:1.1rem;">{item.get("price", 0):,}円</strong> {diff_html}</div>'
-            
-            rsi_trend = item.get("rsi_trend", "")
-            vol_text = item.get("vol_text", "")
-            html += f'<div style="margin-top:8px; margin-bottom:4px; display:flex; flex-wrap:wrap; gap:6px align-items:center;">'
-            html += f'<span class="badge {pos_class}">{item.get("position", "")}</span>'
-            html += f'<span style="font-size:0.9rem;">RSI: <span class="{rsi_class}">{item.get("rsi", "-")}</span> <span style="color:#aaa; font-size:0.8rem;">({rsi_trend})</span></span>'
-            html += f'<span style="font-size:0.9rem; margin-left:8px;">出来高: <span style="color:#aaa; font-size:0.8rem;">{vol_text}</span></span>'
-            html += f'</div>'
-            
-            if item.get("signals"):
-                html += '<div style="margin-top: 6px; margin-bottom: 6px; display:flex; flex-wrap:wrap; gap:4px;">'
-                for sig in item["signals"]:
-                    badge_cls = "badge-signal"
-                    if "[BREAKOUT]" in sig: badge_cls = "badge-breakout"
-                    elif "[ALERT]" in sig: badge_cls = "badge-alert"
-                    elif "[REVERSAL]" in sig: badge_cls = "badge-reversal"
-                    elif "[PULLBACK]" in sig: badge_cls = "badge-pullback"
-                    elif "出来高" in sig: badge_cls = "badge-volume"
-                    html += f'<span class="badge {badge_cls}">{sig}</span>'
-                html += '</div>'
-            
-            html += f'<div><a href="https://finance.yahoo.co.jp/quote/{item["code"]}.T" target="_blank" class="action-link">📊 株価詳細</a> <a href="https://finance.yahoo.co.jp/quote/{item["code"]}.T/news" target="_blank" class="action-link">📰 ニュース</a></div>'
-
-            ai_comment = item.get("ai_comment", "")
-            if ai_comment:
-                html += f'<div class="ai-comment-box"><div class="ai-comment-header"><span>🤖</span> AIテクニカル分析</div><div>{ai_comment}</div></div>'
-
-            if "history_data" in item:
-                html += f'<div style="position:relative; margin-top:15px;" id="chart-wrapper-{item["code"]}">'
-                html += f'<div id="legend-{item["code"]}" style="position:absolute; top:8px; left:12px; z-index:10; font-size:0.85rem; padding:4px 8px; background:rgba(30,30,30,0.8); border-radius:4px; border:1px solid #444; color:#fff; display:flex; gap:12px;"></div>'
-                html += f'<div id="chart-watch-{item["code"]}" style="width:100%; height:250px; border:1px solid #333; border-radius:4px; overflow:hidden;"></div>'
-                html += f'</div>'
-
-        html += '</div>'
-
-    watch_data_json = json.dumps(watch_data, ensure_ascii=False)
-    scan_a_json = json.dumps(scan_a, ensure_ascii=False)
-    
-    # 🚨【修正ポイント】f文字列をやめて通常の文字列にし、エラーを完全に回避しました
-    html += """
+GLOSSARY = """
     <div class="glossary">
-        <div style="font-weight:bold; font-size:1rem; margin-bottom:8px; border-bottom:1px solid #333; padding-bottom:5px;">💡 投資用語メモ</div>
+        <div class="glossary-title">💡 投資用語メモ</div>
         <dl>
             <dt>RSI（相対力指数）</dt><dd>株価の過熱感を指数化したもの。70％以上買われすぎ、30％以下売られすぎ。</dd>
             <dt>200日線（移動平均線）</dt><dd>過去200営業日（約1年）の平均。長期トレンドの最重要ライン。</dd>
             <dt>出来高急増（動意）</dt><dd>大口資金が流入し、新たなテーマが始まる初動サイン。</dd>
         </dl>
     </div>
+"""
+
+# シグナルの印の見た目（signal_rules の定義をそのまま埋め込む）
+CHART_MARKERS = Template('\n    <script>const SIGNAL_MARKERS = {markers};</script>')
 
+# チャート描画（テンプレートではなく固定文字列）。カードが画面に近づいたら銘柄のJSONを読んでチャートを作り、離れたら破棄する
+CHART_SCRIPT = """
     <script>
-        const watchData = """ + watch_data_json + """;
-        const scanData = """ + scan_a_json + """;
-        
-        function renderChart(item, prefix) {
-            const containerId = 'chart-' + prefix + '-' + item.code;
-            if(item.history_data && document.getElementById(containerId)) {
-                const container = document.getElementById(containerId);
-                const chart = LightweightCharts.createChart(container, {
-                    autoSize: true,
-                    layout: { background: { type: 'solid', color: '#1e1e1e' }, textColor: '#d1d4dc', },
-                    grid: { vertLines: { color: '#2b2b43' }, horzLines: { color: '#2b2b43' } },
-                    rightPriceScale: { borderColor: '#2b2b43' },
-                    timeScale: { borderColor: '#2b2b43', timeVisible: true },
-                    handleScroll: false,
-                    handleScale: false
-                });
-                const candleSeries = chart.addCandlestickSeries({
-                    upColor: '#FF5252', downColor: '#26a69a', borderVisible: false,
-                    wickUpColor: '#FF5252', wickDownColor: '#26a69a'
-                });
-                const ma25Series = chart.addLineSeries({
-                    color: '#2962FF', lineWidth: 1, lastValueVisible: false, priceLineVisible: false, crosshairMarkerVisible: false,
-                });
-                const ma75Series = chart.addLineSeries({
-                    color: '#FF5252', lineWidth: 1, lastValueVisible: false, priceLineVisible: false, crosshairMarkerVisible: false,
-                });
-                const ma200Series = chart.addLineSeries({
-                    color: '#FF9800', lineWidth: 2, lastValueVisible: false, priceLineVisible: false, crosshairMarkerVisible: false,
-                });
-                const volumeSeries = chart.addHistogramSeries({
-                    color: '#26a69a', lastValueVisible: false, priceLineVisible: false,
-                    priceFormat: { 
-                        type: 'custom',
-                        formatter: (price) => {
-                            if (price >= 100000000) return (price / 100000000).toFixed(1) + '億';
-                            if (price >= 10000) return (price / 10000).toFixed(1) + '万';
-                            return price.toString();
-                        }
-                    },
-                    priceScaleId: 'volume_scale',
-                });
-                chart.priceScale('volume_scale').applyOptions({ scaleMargins: { top: 0.8, bottom: 0 }, });
-
-                let lastMa25 = null; let lastMa75 = null;
-                let lastMa200 = null;
-                const candleData = []; const volumeData = []; const ma25Data = []; const ma75Data = [];
-                const ma200Data = [];
-                let lastTime = "";
-
-                item.history_data.forEach(d => {
-                    if (d.open != null && d.close != null && d.time !== lastTime) {
-                        candleData.push({ time: d.time, open: d.open, high: d.high, low: d.low, close: d.close });
-                        volumeData.push({ time: d.time, value: d.volume || 0, color: d.close >= d.open ? 'rgba(255, 82, 82, 0.5)' : 'rgba(38, 166, 154, 0.5)' });
-                        if (d.ma25 !== undefined && d.ma25 !== null) { ma25Data.push({ time: d.time, value: d.ma25 }); lastMa25 = d.ma25.toFixed(1); }
-                        if (d.ma75 !== undefined && d.ma75 !== null) { ma75Data.push({ time: d.time, value: d.ma75 }); lastMa75 = d.ma75.toFixed(1); }
-                        if (d.ma200 !== undefined && d.ma200 !== null) { ma200Data.push({ time: d.time, value: d.ma200 }); lastMa200 = d.ma200.toFixed(1); }
-                        lastTime = d.time;
+        const MA_LINES = [['ma25', '#2962FF', 1], ['ma75', '#FF5252', 1], ['ma200', '#FF9800', 2]];
+
+        function renderChart(box, s) {
+            if (!s || !s.time.length) return null;
+            const chart = LightweightCharts.createChart(box, {
+                autoSize: true,
+                layout: { background: { type: 'solid', color: '#1e1e1e' }, textColor: '#d1d4dc', },
+                grid: { vertLines: { color: '#2b2b43' }, horzLines: { color: '#2b2b43' } },
+                rightPriceScale: { borderColor: '#2b2b43' },
+                timeScale: { borderColor: '#2b2b43', timeVisible: true },
+                handleScroll: false,
+                handleScale: false
+            });
+            const candleSeries = chart.addCandlestickSeries({
+                upColor: '#FF5252', downColor: '#26a69a', borderVisible: false,
+                wickUpColor: '#FF5252', wickDownColor: '#26a69a'
+            });
+            const maSeries = MA_LINES.map(([key, color, width]) => chart.addLineSeries({
+                color: color, lineWidth: width, lastValueVisible: false, priceLineVisible: false, crosshairMarkerVisible: false,
+            }));
+            const volumeSeries = chart.addHistogramSeries({
+                color: '#26a69a', lastValueVisible: false, priceLineVisible: false,
+                priceFormat: {
+                    type: 'custom',
+                    formatter: (price) => {
+                        if (price >= 100000000) return (price / 100000000).toFixed(1) + '億';
+                        if (price >= 10000) return (price / 10000).toFixed(1) + '万';
+                        return price.toString();
                     }
+                },
+                priceScaleId: 'volume_scale',
+            });
+            chart.priceScale('volume_scale').applyOptions({ scaleMargins: { top: 0.8, bottom: 0 }, });
+
+            const candleData = []; const volumeData = [];
+            const maData = MA_LINES.map(() => []); const lastMa = MA_LINES.map(() => null);
+            let lastTime = "";
+            for (let i = 0; i < s.time.length; i++) {
+                const t = s.time[i], o = s.open[i], c = s.close[i];
+                if (o == null || c == null || t === lastTime) continue;
+                candleData.push({ time: t, open: o, high: s.high[i], low: s.low[i], close: c });
+                volumeData.push({ time: t, value: s.volume[i] || 0, color: c >= o ? 'rgba(255, 82, 82, 0.5)' : 'rgba(38, 166, 154, 0.5)' });
+                MA_LINES.forEach(([key], j) => {
+                    const v = s[key][i];
+                    if (v != null) { maData[j].push({ time: t, value: v }); lastMa[j] = v.toFixed(1); }
+                });
+                lastTime = t;
+            }
+
+            candleSeries.setData(candleData); volumeSeries.setData(volumeData);
+            if (s.signal) {
+                // 過去にシグナルが成立した日に印を付ける（ルールの式は signal_rules.py と同じ）
+                const markers = [];
+                s.signal.forEach((name, i) => {
+                    const style = name && SIGNAL_MARKERS[name];
+                    if (style && s.open[i] != null && s.close[i] != null) markers.push({ time: s.time[i], ...style });
                 });
+                candleSeries.setMarkers(markers);
+            }
+            maSeries.forEach((series, j) => series.setData(maData[j]));
+            chart.timeScale().fitContent();
+            const legend = box.parentNode.querySelector('.chart-legend');
+            if (legend) {
+                legend.innerHTML = MA_LINES.map(([key, color], j) =>
+                    `<div><span style="color:${color}; font-weight:bold;">■</span> ${key.toUpperCase()}: ${lastMa[j]}</div>`).join('');
+            }
+            return chart;
+        }
+
+        // 共有株価系列（prices/{コード}.json の行形式）から、チャートファイルの期間を列形式に切り出して印を重ねる
+        function sliceSeries(p, o) {
+            const s = { signal: [] };
+            p.fields.forEach(f => s[f] = []);
+            const markers = new Map(o.markers || []);
+            p.rows.forEach(row => {
+                if (row[0] < o.since || row[0] > o.until) return;
+                p.fields.forEach((f, j) => s[f].push(row[j]));
+                s.signal.push(markers.get(row[0]) || null);
+            });
+            return s;
+        }
 
-                candleSeries.setData(candleData); volumeSeries.setData(volumeData);
-                ma25Series.setData(ma25Data); ma75Series.setData(ma75Data); ma200Series.setData(ma200Data);
-                chart.timeScale().fitContent();
-                const legend = document.getElementById('legend-' + item.code);
-                if(legend) {
-                    legend.innerHTML = `<div><span style="color:#2962FF; font-weight:bold;">■</span> MA25: ${lastMa25}</div>
-                                        <div><span style="color:#FF5252; font-weight:bold;">■</span> MA75: ${lastMa75}</div>
-                                        <div><span style="color:#FF9800; font-weight:bold;">■</span> MA200: ${lastMa200}</div>`;
-                }
+        const chartRequests = new Map();
+        function loadSeries(src) {
+            if (!chartRequests.has(src)) {
+                chartRequests.set(src, fetch(src).then(r => r.json())
+                        .then(o => fetch(o.prices).then(r => r.json()).then(p => sliceSeries(p, o))).catch(e => {
+                    chartRequests.delete(src);
+                    console.error('チャートデータの読み込みに失敗しました', src, e);
+                    return null;
+                }));
             }
+            return chartRequests.get(src);
+        }
+
+        function showChart(box) {
+            box.visible = true;
+            if (box.chart || box.loading) return;
+            box.loading = true;
+            loadSeries(box.dataset.src).then(s => {
+                box.loading = false;
+                // 読み込み中に画面外へ出たカードは描画しない
+                if (box.visible && !box.chart) box.chart = renderChart(box, s);
+            });
+        }
+
+        function hideChart(box) {
+            box.visible = false;
+            if (!box.chart) return;
+            box.chart.remove();
+            box.chart = null;
+            const legend = box.parentNode.querySelector('.chart-legend');
+            if (legend) legend.innerHTML = '';
         }
 
-        watchData.forEach(item => renderChart(item, 'watch'));
-        scanData.forEach(item => renderChart(item, 'scan'));
+        document.addEventListener('DOMContentLoaded', () => {
+            const boxes = document.querySelectorAll('.chart-box');
+            if (!('IntersectionObserver' in window)) {
+                boxes.forEach(showChart);
+                return;
+            }
+            // 画面の上下 1 画面分を先読み範囲にし、スクロールで出入りするたびに作り直さないようにする
+            const observer = new IntersectionObserver(entries => {
+                entries.forEach(entry => entry.isIntersecting ? showChart(entry.target) : hideChart(entry.target));
+            }, { rootMargin: '100% 0px' });
+            boxes.forEach(box => observer.observe(box));
+        });
     </script>
 </body></html>"""
-    
-    with open("public/index.html", "w", encoding="utf-8") as f:
-        f.write(html)
\ No newline at end of file
+
+BADGE_CLASSES = (("[BREAKOUT]", "badge-breakout"), ("[ALERT]", "badge-alert"), ("[REVERSAL]", "badge-reversal"),
+                 ("[PULLBACK]", "badge-pullback"), ("出来高", "badge-volume"))
+
+def load_previous_report(ctx=None):
+    """索引から前営業日の記録（A群・B群・監視銘柄の価格とシグナル）を返す。履歴JSON本体は開かない"""
+    ctx = ctx or RunContext()
+    try:
+        today_str = ctx.now.strftime('%Y-%m-%d')
+        return ctx.memo(("previous_report", today_str), lambda: previous_day(today_str))
+    except Exception as e:
+        print(f"前回レポートの読み込みに失敗: {e}")
+        return None
+
+def build_metrics_panel(path=RUN_METRICS_PATH, runs=14):
+    """直近の実行時間の推移（前回までの run_metrics.json）を横棒で表示するパネル。記録が無ければ空文字"""
+    history = [r for r in load_run_metrics(path).get("history", []) if r and r.get("duration_sec")][-runs:]
+    if not history:
+        return ""
+    longest = max(r["duration_sec"] for r in history)
+    rows = []
+    for run in reversed(history):
+        counters = run.get("counters", {})
+        requests = counters.get("price.requests", 0) + counters.get("news.requests", 0) + counters.get("ai.requests", 0)
+        retries = counters.get("price.retries", 0) + counters.get("ai.retries", 0)
+        rows.append(METRICS_ROW.render(
+            finished_at=run.get("finished_at", "")[:16], width=max(2, round(run["duration_sec"] / longest * 100)),
+            duration=run["duration_sec"], detail=f"HTTP {requests}回 / 再試行 {retries}回"))
+    stages = {name[6:]: stat["sec"] for name, stat in history[-1].get("timings", {}).items() if name.startswith("stage.")}
+    stage_text = " / ".join(f"{name} {sec:.0f}秒" for name, sec in stages.items())
+    return METRICS_PANEL.render(runs=len(history), rows="".join(rows), stage_text=stage_text or "-")
+
+def _diff_html(diff):
+    if diff > 0:
+        return DIFF_UP.render(diff=diff)
+    return DIFF_DOWN.render(diff=diff) if diff < 0 else DIFF_EVEN
+
+def _badge_class(signal):
+    return next((cls for key, cls in BADGE_CLASSES if key in signal), "badge-signal")
+
+def _write_card(write, item, chart_sources, watch=False):
+    """A群（scan）・監視銘柄（watch）のカード1枚を書き出す"""
+    if watch and item.get("error"):
+        CARD_ERROR.stream(write, code=item["code"], name=item.get("name", ""), error_msg=item.get("error_msg", "エラー"))
+        return
+    CARD_OPEN.stream(write, extra_class="" if watch else " highlight", code=item["code"], name=item.get("name", ""))
+    PRICE_LINE.stream(write, price=item.get("price", 0), diff_html=_diff_html(item.get("price_diff", 0)))
+
+    rsi = item.get("rsi", "-" if not watch else 50)
+    rsi_class = "rsi-high" if type(rsi) != str and rsi >= 70 else ("rsi-low" if type(rsi) != str and rsi <= 30 else "")
+    write(METRIC_ROW_OPEN)
+    if watch:
+        position = item.get("position", "")
+        POSITION_BADGE.stream(write, pos_class="badge-up" if "上" in position else "badge-down", position=position)
+    METRICS.stream(write, rsi_class=rsi_class, rsi=item.get("rsi", "-"), rsi_trend=item.get("rsi_trend", ""), vol_text=item.get("vol_text", ""))
+
+    if item.get("signals"):
+        write('<div class="badge-row">')
+        for sig in item["signals"]:
+            BADGE.stream(write, badge_class=_badge_class(sig), signal=sig)
+        write('</div>')
+
+    LINKS.stream(write, code=item["code"])
+    if item.get("ai_comment"):
+        AI_COMMENT.stream(write, ai_comment=item["ai_comment"])
+    if item["code"] in chart_sources:
+        CHART.stream(write, src=chart_sources[item["code"]])
+    write(CARD_CLOSE)
+
+def _read_bytes(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return f.read()
+
+def write_chart_files(items, chart_dir=CHART_DIR, prices_dir=PRICES_DIR):
+    """
+    各銘柄のチャートの表示期間と印を public/charts/{コード}.json に書き出し、{コード: ハッシュ付きの相対URL} を返す。
+    株価そのものは save_report が追記した共有系列 public/prices/{コード}.json をページ側で読む（同じ日足を2か所に置かない）。
+    内容が変わらないファイルは書き換えず、今回のページで使わない銘柄のファイルは消す。
+    """
+    os.makedirs(chart_dir, exist_ok=True)
+    sources = {}
+    for item in items:
+        code = item["code"]
+        rows = [row for row in item.get("history_data") or [] if row.get("time")]
+        if not rows or code in sources:
+            continue
+        series = _read_bytes(os.path.join(prices_dir, f"{code}.json"))
+        if series is None:
+            continue
+        overlay = {"prices": f"{os.path.basename(prices_dir)}/{code}.json?v={hashlib.sha1(series).hexdigest()[:10]}",
+                   "since": rows[0]["time"], "until": rows[-1]["time"],
+                   "markers": [[row["time"], row["signal"]] for row in rows if row.get("signal")]}
+        body = json.dumps(overlay, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        path = os.path.join(chart_dir, f"{code}.json")
+        if _read_bytes(path) != body:
+            tmp = f"{path}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(body)
+            os.replace(tmp, path)
+            count("render.chart_bytes", len(body))
+        sources[code] = f"{os.path.basename(chart_dir)}/{code}.json?v={hashlib.sha1(body).hexdigest()[:10]}"
+
+    for name in os.listdir(chart_dir):
+        if name.endswith(".json") and name[:-5] not in sources:
+            os.remove(os.path.join(chart_dir, name))
+    return sources
+
+@timer("render.dashboard")
+def generate_files(watch_data, scan_data_dict, prev_report=None, ctx=None):
+    ctx = ctx or RunContext()
+    os.makedirs("public", exist_ok=True)
+    os.makedirs(HISTORY_DIR, exist_ok=True)
+
+    now = ctx.now
+    now_str = now.strftime('%Y/%m/%d %H:%M')
+    date_str = now.strftime('%Y-%m-%d')
+
+    try:
+        with open("watchlist.json", "r", encoding="utf-8") as f:
+            order = list(json.load(f).keys())
+        watch_data = sorted(watch_data, key=lambda x: order.index(x['code']) if x['code'] in order else 999)
+    except Exception: pass
+
+    report_dict = {"updated_at": now_str, "date": date_str, "watch_data": watch_data, "scan_data": scan_data_dict}
+    # 💡 チャート用の株価は public/prices/ の共有系列へ追記し、日次JSONにはシグナルと数値だけを残す
+    save_report("public/report.json", report_dict, index=False)
+    save_report(f"{HISTORY_DIR}/{date_str}.json", report_dict)
+
+    summary = {"total_signals": 0, "win_rate": 0.0, "avg_return": 0.0, "expectancy": 0.0}
+    if os.path.exists(SUMMARY_PATH):
+        with open(SUMMARY_PATH, "r", encoding="utf-8") as f: summary = json.load(f)
+    portfolio = None
+    if os.path.exists(PORTFOLIO_PATH):
+        with open(PORTFOLIO_PATH, "r", encoding="utf-8") as f: portfolio = json.load(f)
+
+    market_info = scan_data_dict.get("market_info", {"text": "判定不能", "is_good": False, "nikkei_data": {}})
+    nikkei = market_info.get("nikkei_data", {})
+    scan_a = scan_data_dict.get("scan_a", [])
+    scan_b = scan_data_dict.get("scan_b", [])
+    chart_sources = write_chart_files(scan_a + watch_data)
+
+    # 💡 ページは部品ごとに一時ファイルへ逐次書き出し、最後に置き換える（巨大な文字列を組み立てない）
+    tmp = f"{INDEX_PATH}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        write = f.write
+        market_color = '#2e7d32' if market_info['is_good'] else ('#fbc02d' if '調整' in market_info['text'] else '#c62828')
+        PAGE_HEAD.stream(write, now_str=now_str, market_color=market_color, market_text=market_info['text'])
+        if nikkei:
+            diff = nikkei.get('diff', 0)
+            NIKKEI.stream(write, close=nikkei.get('close', 0), open=nikkei.get('open', 0), high=nikkei.get('high', 0), low=nikkei.get('low', 0),
+                          diff_str=f"+{diff:,}" if diff > 0 else f"{diff:,}",
+                          diff_color="#69f0ae" if diff > 0 else ("#ff5252" if diff < 0 else "#9e9e9e"))
+        write(MARKET_CLOSE)
+
+        if prev_report and prev_report.get("scan_a"):
+            REFLECTION_HEADER.stream(write, prev_date=prev_report.get("date", "前回"))
+            today_price_dict = {item["code"]: item.get("price") for item in watch_data + scan_a + scan_b if "code" in item}
+            for prev_item in prev_report["scan_a"]:
+                code = prev_item.get("code")
+                name = prev_item.get("name", "")
+                prev_price = prev_item.get("price", 0)
+                today_price = today_price_dict.get(code)
+
+                if today_price and prev_price > 0:
+                    diff = today_price - prev_price
+                    pct = (diff / prev_price) * 100
+                    REFLECTION_ROW.stream(
+                        write, code=code, name=name, prev_price=prev_price, today_price=today_price,
+                        diff_str=f"+{diff:,}円" if diff > 0 else (f"{diff:,}円" if diff < 0 else "±0円"),
+                        pct_str=f"+{pct:.2f}%" if pct > 0 else f"{pct:.2f}%",
+                        color_class="diff-up" if diff > 0 else ("diff-down" if diff < 0 else "diff-even"),
+                        color="#69f0ae" if diff > 0 else ("#ff5252" if diff < 0 else "#9e9e9e"))
+                else:
+                    REFLECTION_MISSING.stream(write, code=code, name=name)
+
+        if scan_a and scan_a[0].get("is_top_pick") and scan_a[0].get("bold_prediction"):
+            top_item = scan_a[0]
+            TOP_PICK.stream(write, code=top_item['code'], name=top_item.get('name', ''), price=top_item.get('price', 0),
+                            bold_prediction=top_item["bold_prediction"])
+
+        write(SCAN_HEADER)
+        if not scan_a:
+            write(SCAN_EMPTY)
+        for item in scan_a:
+            _write_card(write, item, chart_sources)
+
+        if scan_b:
+            B_GROUP_OPEN.stream(write, count=len(scan_b))
+            for item in scan_b:
+                diff = item.get("price_diff", 0)
+                B_GROUP_ITEM.stream(write, code=item["code"], name=item.get("name", ""), price=item["price"],
+                                    diff_str=f"+{diff}" if diff > 0 else str(diff),
+                                    signals=" ".join(f"[{s}]" for s in item.get("signals", [])))
+            write(B_GROUP_CLOSE)
+
+        STATS_OPEN.stream(write, total_signals=summary["total_signals"], win_rate=summary["win_rate"],
+                          avg_return=summary["avg_return"], expectancy=summary.get("expectancy", "-"))
+        strategies = summary.get("strategies", {})
+        ci = ci_settings(strategies)
+        if strategies:
+            STRATEGY_TABLE_OPEN.stream(write, ci_label=f"{ci[0]}%" if ci else "")
+            strategy_names = {"BREAKOUT": "🚀 上昇加速型", "PULLBACK": "🟢 押し目拾い型", "REVERSAL": "🔄 底打ち確認型"}
+            for st_name in ["BREAKOUT", "PULLBACK", "REVERSAL"]:
+                if st_name in strategies:
+                    st = strategies[st_name]
+                    STRATEGY_ROW.stream(write, display_name=strategy_names.get(st_name, st_name), total_signals=st["total_signals"],
+                                        win_rate=st["win_rate"], avg_return=st["avg_return"],
+                                        ci=f"{st['ci']['win_rate'][0]}〜{st['ci']['win_rate'][1]}%" if st.get("ci") else "-")
+            write(STRATEGY_TABLE_CLOSE)
+            if any(strategies[st_name].get("exits") for st_name in strategies):
+                write(EXIT_TABLE_OPEN)
+                for st_name in ["BREAKOUT", "PULLBACK", "REVERSAL"]:
+                    ex = strategies.get(st_name, {}).get("exits")
+                    if ex:
+                        EXIT_ROW.stream(write, display_name=strategy_names.get(st_name, st_name), rule=exit_rule_text(strategies[st_name].get("exit_profile", {})),
+                                        win_rate=ex["win_rate"], avg_return=ex["avg_return"], avg_days=ex["avg_days"])
+                write(STRATEGY_TABLE_CLOSE)
+        if portfolio:
+            PORTFOLIO.stream(write, initial_capital=portfolio["settings"]["initial_capital"], max_positions=portfolio["settings"]["max_positions"],
+                             total_return=portfolio["total_return"], max_drawdown=portfolio["max_drawdown"], turnover=portfolio["turnover"],
+                             trades=portfolio["trades"], skipped=portfolio["skipped_full"] + portfolio["skipped_cash"])
+        STATS_CLOSE.stream(write, ci_note=CI_NOTE.render(confidence=ci[0], resamples=ci[1]) if ci else "")
+
+        write(WATCH_HEADER)
+        for item in watch_data:
+            _write_card(write, item, chart_sources, watch=True)
+
+        write(build_metrics_panel())
+        write(GLOSSARY)
+        CHART_MARKERS.stream(write, markers=marker_styles_json())
+        write(CHART_SCRIPT)
+    os.replace(tmp, INDEX_PATH)
+    count("render.html_bytes", os.path.getsize(INDEX_PATH))
@@ -0,0 +1,62 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from price_store import get_history
+
+JST = timezone(timedelta(hours=9))
+
+# 営業日カレンダーの基準銘柄（7203 トヨタ）と、1回の取得で賄う日数（暦日）
+CALENDAR_SYMBOL = "7203.T"
+CALENDAR_DAYS = 60
+
+class RunContext:
+    """
+    1回の実行（main / backfill）で共有する市場全体のデータを、キーごとに1度だけ取得して使い回す。
+    営業日カレンダー・地合い判定・マクロ指標・マクロニュースなどを memo() 経由で読み、
+    同じキーの2回目以降は取得せずに返す（回数は report() で確認できる）。
+    """
+    def __init__(self, now=None):
+        self.now = now or datetime.now(JST)
+        self._values = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self.stats = {}
+
+    def memo(self, key, loader):
+        """key の値が未取得なら loader() を呼んで保存し、取得済みならそれを返す（スレッドセーフ）"""
+        with self._lock:
+            key_lock = self._locks.setdefault(key, threading.Lock())
+            stat = self.stats.setdefault(key, {"calls": 0, "loads": 0, "sec": 0.0})
+            stat["calls"] += 1
+        with key_lock:
+            if key in self._values:
+                return self._values[key]
+            started = time.perf_counter()
+            value = loader()
+            with self._lock:
+                stat["loads"] += 1
+                stat["sec"] += time.perf_counter() - started
+                self._values[key] = value
+            return value
+
+    def trading_days(self, days_back=CALENDAR_DAYS):
+        """基準銘柄の日足から、直近 days_back 日（暦日）の営業日リストを返す（当日分があれば含む）"""
+        span = max(days_back, CALENDAR_DAYS)
+        def load():
+            start_str = (self.now - timedelta(days=span)).strftime('%Y-%m-%d')
+            end_str = (self.now + timedelta(days=1)).strftime('%Y-%m-%d')
+            df = get_history(CALENDAR_SYMBOL, start_str, end_str)
+            return df.index.strftime('%Y-%m-%d').tolist()
+        since = (self.now - timedelta(days=days_back)).strftime('%Y-%m-%d')
+        return [d for d in self.memo(("trading_days", span), load) if d >= since]
+
+    def report(self):
+        """キーごとの呼び出し回数・実際の取得回数・取得時間（呼び出し回数 - 取得回数 = 省けた重複取得）"""
+        return {" / ".join(map(str, key)) if isinstance(key, tuple) else str(key): {**stat, "sec": round(stat["sec"], 2)}
+                for key, stat in self.stats.items()}
+
+    def print_report(self):
+        print("📋 実行コンテキスト（外部データの取得回数）:")
+        for key, stat in self.report().items():
+            saved = stat["calls"] - stat["loads"]
+            print(f"  {key}: 取得 {stat['loads']}回 / 参照 {stat['calls']}回 (重複 {saved}回を省略) / {stat['sec']}秒")
@@ -1,16 +1,31 @@
 import pandas as pd
-import yfinance as yf
+import numpy as np
+from price_store import get_history, get_histories, slice_frames
+from technical_calc import add_indicators, add_technicals, latest_indicators, stack_frames, compute_indicators
+from ai_analyzer import GeminiError, get_client, strip_markdown
+from news_fetcher import fetch_recent_news, fetch_top_macro_news
+from run_context import RunContext
+from signal_rules import DEFAULT_PARAMS, RULES, MARKER_RULES, chart_history, evaluate, frame_columns, market_frame, required_columns, stacked_columns
+from strategy_stats import stat_comment
 from datetime import datetime, timedelta, timezone
 import concurrent.futures
-import time
+import csv
 import json
-# 🚨 新規追加インポート
-import urllib.parse
-import feedparser
-import requests
+import os
+import time
 
 JST = timezone(timedelta(hours=9))
 
+# 出来高急増とみなす倍率（直近20日平均比）
+VOL_SPIKE_RATIO = DEFAULT_PARAMS["vol_spike_ratio"]
+# 全市場スキャンの当日判定（SCAN_A）に必要な指標
+SCAN_INDICATORS = ("MA5", "MA25", "MA200", "High_20", "Low_20", "Vol_Avg20", "Vol_Ratio", "RSI")
+
+# 💡 全市場スキャン用の銘柄ユニバース（JPX「東証上場銘柄一覧」をCSV保存したもの。同梱分は監視銘柄だけの雛形）
+UNIVERSE_PATH = "tse_universe.csv"
+# ETF・REIT等は対象外
+UNIVERSE_MARKETS = ("プライム（内国株式）", "スタンダード（内国株式）", "グロース（内国株式）")
+
 def load_watchlist():
     try:
         with open("watchlist.json", "r", encoding="utf-8") as f:
@@ -19,39 +34,43 @@ def load_watchlist():
         print(f"Watchlist load error: {e}")
         return {}
 
-# 🚨 個別ニュース取得
-def fetch_recent_news(ticker_code):
-    query = urllib.parse.quote(f"{ticker_code} 株")
-    url = f"https://news.google.com/rss/search?q={query}&hl=ja&gl=JP&ceid=JP:ja"
-    news_list = []
+def load_universe(path=UNIVERSE_PATH):
+    """銘柄コード → 銘柄名。CSVが無い場合は監視リストで代用する"""
+    if not os.path.exists(path):
+        return load_watchlist()
+    universe = {}
     try:
-        feed = feedparser.parse(url)
-        for entry in feed.entries[:3]:
-            news_list.append({"title": entry.title, "link": entry.link})
-    except Exception: pass
-    return news_list
-
-# 🚨 マクロニュース取得
-def fetch_top_macro_news(limit=3):
-    url = "https://news.yahoo.co.jp/rss/topics/business.xml"
-    news_list = []
-    try:
-        feed = feedparser.parse(url)
-        for entry in feed.entries[:limit]:
-            news_list.append({"title": entry.title, "link": entry.link})
-    except Exception: pass
-    return news_list
+        with open(path, "r", encoding="utf-8-sig") as f:
+            for row in csv.DictReader(f):
+                market = row.get("市場・商品区分", "")
+                if market and market not in UNIVERSE_MARKETS:
+                    continue
+                code = str(row.get("コード", "")).strip()
+                if code:
+                    universe[code] = row.get("銘柄名", "").strip()
+    except Exception as e:
+        print(f"Universe load error: {e}")
+        return load_watchlist()
+    return universe or load_watchlist()
+
+SCAN_UNIVERSE = load_universe()
 
 # 🚨 マクロデータ取得
 def fetch_macro_data():
     tickers = {"日経平均": "^N225", "S&P500": "^GSPC", "SOX指数": "^SOX", "VIX恐怖指数": "^VIX", "ドル円": "JPY=X"}
     macro_info = {}
+    now = datetime.now(JST)
+    start_str = (now - timedelta(days=10)).strftime('%Y-%m-%d')
+    end_str = (now + timedelta(days=1)).strftime('%Y-%m-%d')
+    try:
+        # 💡 5指標を1回のリクエストでまとめて取得
+        frames = get_histories(list(tickers.values()), start_str, end_str)
+    except Exception:
+        return macro_info
     for name, ticker in tickers.items():
         try:
-            data = yf.download(ticker, period="5d", progress=False)
+            data = frames[ticker]
             if not data.empty:
-                if isinstance(data.columns, pd.MultiIndex):
-                    data.columns = [col[0] for col in data.columns]
                 data = data.dropna(subset=['Close'])
                 if len(data) >= 2:
                     latest = float(data['Close'].iloc[-1])
@@ -66,12 +85,14 @@ def fetch_macro_data():
     return macro_info
 
 # 🚨 IPPOによる大胆予測（A群トップ銘柄専用）
-def get_ai_bold_prediction(ticker_code, name, price, tech_data, api_key):
+def get_ai_bold_prediction(ticker_code, name, price, tech_data, api_key, ctx=None):
     if not api_key: return ""
+    ctx = ctx or RunContext()
     
-    news_list = fetch_recent_news(ticker_code)
-    macro_news_list = fetch_top_macro_news(limit=3)
-    macro_data = fetch_macro_data()
+    news_list = fetch_recent_news(ticker_code, limit=3)
+    # マクロ指標・ニュースは市場全体の情報なので、実行中に1回だけ取得する
+    macro_news_list = ctx.memo(("macro_news", 3), lambda: fetch_top_macro_news(limit=3))
+    macro_data = ctx.memo("macro_data", fetch_macro_data)
     
     news_text = "\n".join([f"・{n['title']}" for n in news_list]) if news_list else "特になし"
     macro_text = "\n".join([f"・{k}: {v}" for k, v in macro_data.items()])
@@ -95,23 +116,17 @@ def get_ai_bold_prediction(ticker_code, name, price, tech_data, api_key):
     - チャートの形状、個別ニュース、そして【マクロ経済データや世界トップニュース】がこの銘柄にどう影響するかをロジカルかつドラマチックに説明すること。
     """
 
-    url = f"[https://generativelanguage.googleapis.com/v1/models/gemini-2.5-flash:generateContent?key=](https://generativelanguage.googleapis.com/v1/models/gemini-2.5-flash:generateContent?key=){api_key}"
-    payload = {"contents": [{"parts": [{"text": prompt}]}]}
-
     try:
-        response = requests.post(url, json=payload, timeout=30)
-        if response.status_code == 200:
-            answer = response.json()['candidates'][0]['content']['parts'][0]['text']
-            answer = answer.replace("```html\n", "").replace("```html", "").replace("```", "").strip()
-            answer = answer.replace("\n・", "<br><br>・")
-            return answer
-        else: return "【APIエラー】予測を取得できませんでした"
+        answer = strip_markdown(get_client(api_key).generate(prompt))
+        answer = answer.replace("\n・", "<br><br>・")
+        return answer
+    except GeminiError: return "【APIエラー】予測を取得できませんでした"
     except Exception: return "【通信エラー】予測を取得できませんでした"
 
 def generate_ai_comment(group, vol_ratio, is_yosen, is_above_ma200, rsi, is_breakout):
     comment = ""
     if group == "A" and is_breakout:
-        comment += f"【🚀上昇加速型】過去20日間の高値を明確にブレイクアウト！出来高も{vol_ratio}倍と大口の買いが明白です。過去の統計上、この条件達成時の5日後勝率は「51.4%（平均+0.71%）」であり、明日の寄り付きでの順張りエントリーに最も高い優位性が確認されています。"
+        comment += f"【🚀上昇加速型】過去20日間の高値を明確にブレイクアウト！出来高も{vol_ratio}倍と大口の買いが明白です。{stat_comment('BREAKOUT')}明日の寄り付きでの順張りエントリー候補です。"
     elif group == "A":
         comment += f"【本命シグナル】出来高急増（{vol_ratio}倍）を伴い前日高値を抜けました。200日線上の強い上昇トレンドに乗る形ですが、直近高値の更新（完全なブレイクアウト）には至っていません。"
     else:
@@ -126,15 +141,13 @@ def generate_ai_comment(group, vol_ratio, is_yosen, is_above_ma200, rsi, is_brea
         elif group == "A" and 40 <= rsi <= 70: comment += f" RSIも{rsi}と過熱感はなく、ここから上値余地が十分に狙える理想的な状態です。"
     return comment
 
-def check_market_trend(start_str, end_str):
+def check_market_trend(start_str, end_str, df=None):
     try:
-        ticker = yf.Ticker("^N225")
-        df = ticker.history(start=start_str, end=end_str)
+        if df is None:
+            df = get_history("^N225", start_str, end_str)
         if df.empty or len(df) < 200: return False, "判定不能", {}
         
-        df['MA5'] = df['Close'].rolling(window=5).mean()
-        df['MA25'] = df['Close'].rolling(window=25).mean()
-        df['MA200'] = df['Close'].rolling(window=200).mean()
+        df = add_technicals(df, ("MA5", "MA25", "MA200"))
         latest = df.iloc[-1]
         prev = df.iloc[-2]
         
@@ -154,108 +167,124 @@ def check_market_trend(start_str, end_str):
         return is_good, text, nikkei_data
     except Exception: return False, "データ取得エラー", {}
 
-def process_ticker(code, name, start_str, end_str, is_good_market):
-    max_retries = 3
-    base_wait = 2
-    for attempt in range(max_retries):
-        try:
-            ticker = yf.Ticker(f"{code}.T")
-            df = ticker.history(start=start_str, end=end_str)
-            if df.empty or len(df) < 200: return None
-                
-            df.index = df.index.tz_localize(None)
-            df['MA25'] = df['Close'].rolling(window=25).mean()
-            df['MA75'] = df['Close'].rolling(window=75).mean()
-            df['MA200'] = df['Close'].rolling(window=200).mean()
-            df['High_20'] = df['High'].rolling(window=20).max().shift(1)
-            
-            latest = df.iloc[-1]
-            prev = df.iloc[-2]
-            
-            vol_avg20 = df['Volume'].rolling(window=20).mean().iloc[-2]
-            if vol_avg20 == 0 or pd.isna(vol_avg20): return None
-            vol_ratio = latest['Volume'] / vol_avg20
+def process_ticker(code, name, df, is_good_market, nk_data=None):
+    """
+    df は technical_calc.add_indicators で指標列を追加済みの日足。
+    nk_data（signal_rules.market_frame）は過去日の地合い（チャートの印の上昇加速型）に使う。
+    """
+    if df is None or df.empty or len(df) < 200: return None
+    try:
+        latest = df.iloc[-1]
+        prev = df.iloc[-2]
+        
+        vol_avg20 = latest['Vol_Avg20']
+        if vol_avg20 == 0 or pd.isna(vol_avg20): return None
+        vol_ratio = latest['Volume'] / vol_avg20
+        
+        if vol_ratio >= VOL_SPIKE_RATIO:
+            price_diff = int(latest['Close'] - prev['Close'])
+            price = int(latest['Close'])
+
+            # 💡 判定は signal_rules の共通ルール（バックテストと同じ式）。当日の地合いは check_market_trend の判定を使う
+            cols = frame_columns(df, nk_data)
+            cols["Is_Good_Market"] = cols["Is_Good_Market"].copy()
+            cols["Is_Good_Market"][-1] = float(is_good_market)
+            masks = evaluate(cols, ("SCAN_A", "HIGH20_BREAK", "PREV_HIGH_BREAK", "ABOVE_MA200") + MARKER_RULES)
+            is_yosen = bool(masks["PREV_HIGH_BREAK"][-1])
+            is_above_ma200 = bool(masks["ABOVE_MA200"][-1])
+            is_breakout = bool(masks["HIGH20_BREAK"][-1])
+
+            signals = [f"🔥 出来高 ({round(vol_ratio, 1)}倍)"]
+            if is_breakout: signals.append(RULES["HIGH20_BREAK"].label)
+            elif is_yosen: signals.append(RULES["PREV_HIGH_BREAK"].label)
+            if is_above_ma200: signals.append(RULES["ABOVE_MA200"].label)
             
-            if vol_ratio >= 2.5:
-                price_diff = int(latest['Close'] - prev['Close'])
-                price = int(latest['Close'])
-                ma200 = latest['MA200']
-                
-                is_yosen = latest['Close'] > prev['High'] 
-                is_above_ma200 = price > ma200
-                is_breakout = latest['Close'] > latest['High_20'] if pd.notna(latest['High_20']) else False
-                
-                signals = [f"🔥 出来高 ({round(vol_ratio, 1)}倍)"]
-                if is_breakout: signals.append("👑 [🚀 上昇加速型] 20日高値更新")
-                elif is_yosen: signals.append("📈 前日高値抜け")
-                if is_above_ma200: signals.append("🟩 200日線上")
-                
-                df_clean = df.dropna(subset=['Open', 'High', 'Low', 'Close']).tail(120)
-                history_data = []
-                for date_index, row in df_clean.iterrows():
-                    history_data.append({
-                        "time": date_index.strftime('%Y-%m-%d'), "open": float(row['Open']), "high": float(row['High']), "low": float(row['Low']), "close": float(row['Close']), "volume": float(row['Volume']),
-                        "ma25": float(row['MA25']) if pd.notna(row['MA25']) else None, "ma75": float(row['MA75']) if pd.notna(row['MA75']) else None, "ma200": float(row['MA200']) if pd.notna(row['MA200']) else None
-                    })
-
-                delta = df['Close'].diff()
-                gain = delta.where(delta > 0, 0).ewm(alpha=1/14, adjust=False).mean()
-                loss = (-delta.where(delta < 0, 0)).ewm(alpha=1/14, adjust=False).mean()
-                rs = gain / loss
-                df['RSI'] = 100 - (100 / (1 + rs))
-
-                rsi = round(df.iloc[-1]['RSI'], 1)
-                prev_rsi = round(df.iloc[-2]['RSI'], 1) if pd.notna(df.iloc[-2]['RSI']) else rsi
-                rsi_diff = rsi - prev_rsi
-
-                if rsi_diff > 2: rsi_trend = f"RSI 上昇 (+{round(rsi_diff, 1)})"
-                elif rsi_diff < -2: rsi_trend = f"RSI 低下 ({round(rsi_diff, 1)})"
-                else: rsi_trend = "RSI 横ばい"
-
-                vol_latest = latest['Volume']
-                if vol_ratio >= 2.0: vol_comment = f"急増 ({round(vol_ratio, 1)}倍) "
-                elif vol_ratio <= 0.5: vol_comment = f"急減 ({round(vol_ratio, 1)}倍) "
-                else: vol_comment = ""
-                vol_text = f"{vol_comment}{vol_latest/10000:.1f}万株" if vol_latest < 100000000 else f"{vol_comment}{vol_latest/100000000:.1f}億株"
-
-                if rsi <= 30 and latest['Close'] < latest['MA25'] * 0.95 and latest['Close'] > latest['Open']:
-                    signals.append("🔄 [底打ち確認型] RSI低位・MA25乖離")
-
-                group = "A" if (is_good_market and is_yosen and is_above_ma200 and is_breakout) or ("底打ち" in str(signals)) else "B"
-                ai_comment = generate_ai_comment(group, round(float(vol_ratio), 1), is_yosen, is_above_ma200, rsi, is_breakout)
-
-                return {"group": group, "data": {
-                    "code": code, "name": name, "price": price, "vol_ratio": round(float(vol_ratio), 1),
-                    "price_diff": price_diff, "signals": signals, "history_data": history_data,
-                    "position": "200日線上" if is_above_ma200 else "200日線下",
-                    "rsi": rsi, "rsi_trend": rsi_trend, "vol_text": vol_text, "ai_comment": ai_comment
-                }}
-            return None
-        except Exception:
-            if attempt < max_retries - 1: time.sleep(base_wait * (2 ** attempt))
-            else: return None
+            history_data = chart_history(df, masks)
+
+            rsi = round(df.iloc[-1]['RSI'], 1)
+            prev_rsi = round(df.iloc[-2]['RSI'], 1) if pd.notna(df.iloc[-2]['RSI']) else rsi
+            rsi_diff = rsi - prev_rsi
+
+            if rsi_diff > 2: rsi_trend = f"RSI 上昇 (+{round(rsi_diff, 1)})"
+            elif rsi_diff < -2: rsi_trend = f"RSI 低下 ({round(rsi_diff, 1)})"
+            else: rsi_trend = "RSI 横ばい"
+
+            vol_latest = latest['Volume']
+            if vol_ratio >= 2.0: vol_comment = f"急増 ({round(vol_ratio, 1)}倍) "
+            elif vol_ratio <= 0.5: vol_comment = f"急減 ({round(vol_ratio, 1)}倍) "
+            else: vol_comment = ""
+            vol_text = f"{vol_comment}{vol_latest/10000:.1f}万株" if vol_latest < 100000000 else f"{vol_comment}{vol_latest/100000000:.1f}億株"
+
+            if masks["REVERSAL"][-1]:
+                signals.append(RULES["REVERSAL"].label)
+
+            group = "A" if masks["SCAN_A"][-1] else "B"
+            ai_comment = generate_ai_comment(group, round(float(vol_ratio), 1), is_yosen, is_above_ma200, rsi, is_breakout)
+
+            return {"group": group, "data": {
+                "code": code, "name": name, "price": price, "vol_ratio": round(float(vol_ratio), 1),
+                "price_diff": price_diff, "signals": signals, "history_data": history_data,
+                "position": "200日線上" if is_above_ma200 else "200日線下",
+                "rsi": rsi, "rsi_trend": rsi_trend, "vol_text": vol_text, "ai_comment": ai_comment
+            }}
+        return None
+    except Exception:
+        return None
 
 # 🚨【修正】api_key を受け取るように変更
-def scan_b_type(target_date_str=None, api_key=""):
+def scan_b_type(target_date_str=None, api_key="", frames=None, ctx=None):
+    """
+    target_date_str を指定するとその日の引け時点でスキャンする。
+    frames に取得済みの全期間データ（シンボル → 日足）を渡すと、ダウンロードせずに target_date 時点へ切り出す。
+    ctx（RunContext）を渡すと、地合い判定やマクロ情報を他のモジュールと共有する。
+    """
+    ctx = ctx or RunContext()
     watchlist = load_watchlist()
     if not watchlist:
         return {"market_info": {"is_good": False, "text": "監視リスト読込エラー", "nikkei_data": {}}, "scan_a": [], "scan_b": []}
 
-    end = datetime.now(JST)
+    if target_date_str:
+        end = datetime.strptime(target_date_str, '%Y-%m-%d').replace(tzinfo=JST)
+    else:
+        end = ctx.now
     start_str = (end - timedelta(days=500)).strftime('%Y-%m-%d')
     end_str = (end + timedelta(days=1)).strftime('%Y-%m-%d')
     
-    is_good_market, market_text, nikkei_data = check_market_trend(start_str, end_str)
+    # 💡 日経平均と監視リスト全銘柄の不足分を1回の一括リクエストで取得（以降はキャッシュから読むだけ）
+    # 💡 まず保存済みの指標状態を新しい足の分だけ進めて出来高倍率を求め、急増銘柄だけ全期間の指標を計算する
+    symbols = ["^N225"] + [f"{code}.T" for code in watchlist]
+    nikkei_df = None
+    try:
+        if frames is None:
+            frames = get_histories(symbols, start_str, end_str)
+        else:
+            frames = slice_frames({s: frames[s] for s in symbols if s in frames}, start_str, end_str)
+        nikkei_df = frames.get("^N225")
+        frames = {code: frames.get(f"{code}.T") for code in watchlist}
+        frames = {code: df for code, df in frames.items() if df is not None and not df.empty}
+        if target_date_str is None:
+            vol_ratio = {code: ind["Vol_Ratio"] for code, ind in latest_indicators(frames).items()}
+        else:
+            # 過去日のスキャン（バックフィル）では日次の指標状態を使わず（最新状態を過去の足で上書きしないため）、
+            # 全銘柄まとめて一括計算した出来高倍率の最終列を使う
+            keys, arrays = stack_frames(frames)
+            vol_ratio = dict(zip(keys, compute_indicators(arrays, ("Vol_Ratio",))["Vol_Ratio"][:, -1])) if keys else {}
+        frames = add_indicators({code: df for code, df in frames.items() if vol_ratio.get(code, 0) >= VOL_SPIKE_RATIO})
+    except Exception as e:
+        print(f"株価取得エラー: {e}")
+        frames = {}
+
+    is_good_market, market_text, nikkei_data = ctx.memo(("market_trend", end_str), lambda: check_market_trend(start_str, end_str, nikkei_df))
     
+    nk_data = market_frame(nikkei_df) if nikkei_df is not None and not nikkei_df.empty else None
+
     scan_a = []
     scan_b = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-        futures = {executor.submit(process_ticker, code, name, start_str, end_str, is_good_market): code for code, name in watchlist.items()}
-        for future in concurrent.futures.as_completed(futures):
-            result = future.result()
-            if result is not None:
-                if result["group"] == "A": scan_a.append(result["data"])
-                elif result["group"] == "B": scan_b.append(result["data"])
+    for code, name in watchlist.items():
+        result = process_ticker(code, name, frames.get(code), is_good_market, nk_data)
+        if result is not None:
+            if result["group"] == "A": scan_a.append(result["data"])
+            elif result["group"] == "B": scan_b.append(result["data"])
                 
     # 🚨【新規追加】A群から「一推し銘柄」を1つだけ選定し、大胆予測を取得
     if scan_a:
@@ -265,11 +294,108 @@ def scan_b_type(target_date_str=None, api_key=""):
             top_pick = scan_a[0]
             top_pick['is_top_pick'] = True
             tech_data = f"RSI:{top_pick.get('rsi')}, 出来高:{top_pick.get('vol_text')}, シグナル:{','.join(top_pick.get('signals', []))}"
-            bold_comment = get_ai_bold_prediction(top_pick['code'], top_pick['name'], top_pick['price'], tech_data, api_key)
+            bold_comment = get_ai_bold_prediction(top_pick['code'], top_pick['name'], top_pick['price'], tech_data, api_key, ctx)
             top_pick['bold_prediction'] = bold_comment
             
     return {
         "market_info": {"is_good": is_good_market, "text": market_text, "nikkei_data": nikkei_data},
         "scan_a": scan_a,
         "scan_b": scan_b
-    }
\ No newline at end of file
+    }
+
+# ==========================================
+# 💡 全市場スキャンモード（東証ユニバースをプロセス分割して一括判定）
+# 日次の main.py には組み込まず、python scanner.py で手動実行する。
+# 同梱の tse_universe.csv は監視銘柄だけの雛形なので、全市場を対象にするには JPX の上場銘柄一覧で置き換える
+# ==========================================
+
+def evaluate_scan_signals(arrays, ind, is_good_market):
+    """
+    (銘柄 × 日) 配列の最終日について、process_ticker と同じ条件をベクトルでまとめて判定する。
+    戻り値は銘柄ごとの出来高急増・A群判定のブール配列。
+    """
+    with np.errstate(invalid="ignore"):
+        listed_long = np.sum(~np.isnan(arrays["Close"]), axis=1) >= 200
+    cols = stacked_columns(arrays, ind, is_good_market, required_columns(("SCAN_A",)), last_only=True)
+    masks = evaluate(cols, ("SCAN_A",))
+    spike = listed_long & masks["VOL_SPIKE"]
+    group_a = spike & masks["SCAN_A"]
+    return spike, group_a
+
+def _scan_shard(shard_id, codes, start_str, end_str, is_good_market):
+    """1シャード分の株価取得 → 指標計算 → 条件判定（ProcessPoolExecutor のワーカーで実行）"""
+    t0 = time.perf_counter()
+    frames = get_histories([f"{code}.T" for code in codes], start_str, end_str)
+    frames = {code: frames[f"{code}.T"] for code in codes if not frames[f"{code}.T"].empty}
+    t1 = time.perf_counter()
+
+    hits = []
+    rows = n_group_a = 0
+    if frames:
+        keys, arrays = stack_frames(frames)
+        ind = compute_indicators(arrays, SCAN_INDICATORS)
+        spike, group_a = evaluate_scan_signals(arrays, ind, is_good_market)
+        hits = [keys[i] for i in np.flatnonzero(spike)]
+        n_group_a = int(np.sum(group_a))
+        rows = int(np.sum(~np.isnan(arrays["Close"])))
+    t2 = time.perf_counter()
+
+    return {
+        "shard": shard_id, "tickers": len(codes), "loaded": len(frames), "hits": hits, "group_a": n_group_a, "rows": rows,
+        "fetch_sec": round(t1 - t0, 2), "calc_sec": round(t2 - t1, 2),
+        "rows_per_sec": round(rows / (t2 - t0), 1) if t2 > t0 else 0.0
+    }
+
+def scan_market(universe=None, shard_size=200, max_workers=2, ctx=None):
+    """
+    東証ユニバース全体を shard_size 銘柄ずつに分けてプロセス並列でスキャンする。
+    条件を満たした銘柄だけ process_ticker で詳細データを作り、scan_b_type と同じ形で返す（scan_stats にシャード別の処理時間）。
+    """
+    universe = universe or load_universe()
+    ctx = ctx or RunContext()
+    end = ctx.now
+    start_str = (end - timedelta(days=500)).strftime('%Y-%m-%d')
+    end_str = (end + timedelta(days=1)).strftime('%Y-%m-%d')
+
+    is_good_market, market_text, nikkei_data = ctx.memo(("market_trend", end_str), lambda: check_market_trend(start_str, end_str))
+
+    codes = list(universe)
+    shards = [codes[i:i + shard_size] for i in range(0, len(codes), shard_size)]
+    started = time.perf_counter()
+    shard_stats = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_scan_shard, i, shard, start_str, end_str, is_good_market) for i, shard in enumerate(shards)]
+        for future in concurrent.futures.as_completed(futures):
+            stat = future.result()
+            shard_stats.append(stat)
+            print(f"  shard {stat['shard']:>3}: {stat['loaded']}/{stat['tickers']}銘柄 取得 {stat['fetch_sec']}s / 判定 {stat['calc_sec']}s / {stat['rows_per_sec']:,} rows/s / 該当 {len(stat['hits'])}")
+    elapsed = time.perf_counter() - started
+
+    # 該当銘柄だけキャッシュから読み直し、表示用の詳細（チャート・RSI等）を作る
+    hit_codes = [code for stat in shard_stats for code in stat["hits"]]
+    frames = get_histories(["^N225"] + [f"{code}.T" for code in hit_codes], start_str, end_str)
+    nk_data = market_frame(frames["^N225"]) if not frames["^N225"].empty else None
+    frames = add_indicators({code: frames[f"{code}.T"] for code in hit_codes})
+    scan_a, scan_b = [], []
+    for code in hit_codes:
+        result = process_ticker(code, universe[code], frames.get(code), is_good_market, nk_data)
+        if result is not None:
+            (scan_a if result["group"] == "A" else scan_b).append(result["data"])
+    scan_a = sorted(scan_a, key=lambda x: x.get('vol_ratio', 0), reverse=True)
+
+    total_rows = sum(stat["rows"] for stat in shard_stats)
+    print(f"✅ 全市場スキャン完了: {len(codes)}銘柄 / {elapsed:.1f}秒 / {total_rows / elapsed if elapsed else 0:,.0f} rows/s / A群 {len(scan_a)} / B群 {len(scan_b)}")
+
+    return {
+        "market_info": {"is_good": is_good_market, "text": market_text, "nikkei_data": nikkei_data},
+        "scan_a": scan_a,
+        "scan_b": scan_b,
+        "scan_stats": {"tickers": len(codes), "elapsed_sec": round(elapsed, 2), "rows": total_rows,
+                       "shards": sorted([{k: v for k, v in s.items() if k != "hits"} for s in shard_stats], key=lambda s: s["shard"])}
+    }
+
+if __name__ == "__main__":
+    universe = load_universe()
+    if len(universe) <= len(load_watchlist()):
+        print(f"⚠️ {UNIVERSE_PATH} は監視銘柄だけの雛形です（全市場をスキャンするには JPX の東証上場銘柄一覧をCSVで保存して置き換えてください）")
+    scan_market(universe)
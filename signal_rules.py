@@ -0,0 +1,179 @@
+import json
+import numpy as np
+import pandas as pd
+from technical_calc import add_technicals
+
+# 💡 シグナルの条件はここに1度だけ書く（監視銘柄・市場スキャン・バックテスト・チャートの印がすべてこの定義を使う）
+# 条件式は指標列・しきい値・先に定義したルール名を使った numpy の式で、1日分でも (銘柄 × 日) 全体でも同じ式で評価する
+
+# しきい値（parameter_sweep でグリッド探索する対象を含む）
+DEFAULT_PARAMS = {
+    "breakout_vol_ratio": 2.5,   # 上昇加速型: 出来高倍率
+    "pullback_ma_band": 1.03,    # 押し目拾い型: 安値がMA75/MA200の+3%以内
+    "reversal_rsi": 30,          # 底打ち確認型: RSI上限
+    "reversal_ma25_gap": 0.95,   # 底打ち確認型: 終値がMA25の-5%以下
+    "reversal_low_band": 1.05,   # 底打ち確認型: 安値が直近20日安値の+5%以内（割り込まない）
+    "top_warning_band": 0.97,    # 天井警戒型: 高値が直近20日高値の-3%以上
+    "top_warning_rsi": 65,       # 天井警戒型: 前日RSIの下限
+    "vol_spike_ratio": 2.5,      # 市場スキャン: 出来高急増とみなす倍率
+}
+
+class Rule:
+    """1つのシグナル。expr は import 時にコンパイルし、評価時は列・しきい値・依存ルールの名前空間で実行するだけ"""
+    def __init__(self, name, expr, label=None, marker=None):
+        self.name = name
+        self.expr = " ".join(expr.split())
+        self.code = compile(self.expr, f"<rule {name}>", "eval")
+        self.names = set(self.code.co_names)
+        self.label = label
+        self.marker = marker
+
+RULES = {}
+
+def rule(name, expr, label=None, marker=None):
+    """ルールを登録する。式中の名前は指標列・DEFAULT_PARAMS・登録済みルールのいずれか"""
+    RULES[name] = Rule(name, expr, label, marker)
+    return RULES[name]
+
+rule("YOSEN", "Close > Open")
+rule("INSEN", "Close < Open")
+rule("ABOVE_MA200", "Close > MA200", "🟩 200日線上")
+rule("PREV_HIGH_BREAK", "Close > Prev_High", "📈 前日高値抜け")
+rule("HIGH20_BREAK", "Close > High_20", "👑 [🚀 上昇加速型] 20日高値更新")
+rule("VOL_SPIKE", "(Vol_Avg20 > 0) & (Vol_Ratio >= vol_spike_ratio)")
+rule("BREAKOUT", """
+    (Is_Good_Market == 1) & (Vol_Ratio >= breakout_vol_ratio) & PREV_HIGH_BREAK & ABOVE_MA200 & HIGH20_BREAK""",
+    marker={"position": "belowBar", "shape": "arrowUp", "color": "#FF9800", "text": "B"})
+# 💡 底打ち確認型の超・厳格化（直近20日安値を割らずに反発し、MA5 を上抜け）
+rule("REVERSAL", """
+    (Low <= Low_20 * reversal_low_band) & (Low >= Low_20) & YOSEN &
+    (RSI <= reversal_rsi) & (Close < MA25 * reversal_ma25_gap) & (Close > MA5)""",
+    "🔄 [底打ち確認型] W底反転(MA5上抜)",
+    {"position": "belowBar", "shape": "arrowUp", "color": "#03a9f4", "text": "R"})
+rule("PULLBACK", """
+    (((Low <= MA75 * pullback_ma_band) & (Close > MA75)) | ((Low <= MA200 * pullback_ma_band) & (Close > MA200))) &
+    YOSEN & ~REVERSAL""",
+    "🟢 [押し目拾い型] MA支持線反発",
+    {"position": "belowBar", "shape": "circle", "color": "#4caf50", "text": "P"})
+rule("TOP_WARNING", "(High >= High_20 * top_warning_band) & INSEN & (Prev_RSI >= top_warning_rsi) & (RSI < Prev_RSI)",
+     "⚠️ [天井警戒型] ダブルトップ警戒",
+     {"position": "aboveBar", "shape": "arrowDown", "color": "#f44336", "text": "T"})
+rule("GOLDEN_CROSS", "(Prev_MA25 <= Prev_MA75) & (MA25 > MA75)", "🌟 ゴールデンクロス発生")
+rule("DEAD_CROSS", "(Prev_MA25 >= Prev_MA75) & (MA25 < MA75)", "⚠️ デッドクロス発生")
+# 市場スキャンの A群（本命）: 出来高急増のうち、上昇加速型か底打ち確認型
+rule("SCAN_A", "VOL_SPIKE & (BREAKOUT | REVERSAL)")
+
+# チャートに印を付けるルール（同じ日に複数あれば先のものを優先）
+MARKER_RULES = tuple(name for name, r in RULES.items() if r.marker)
+
+def _dependencies(names):
+    """names の評価に必要なルールを、登録順（依存先が先）に並べて返す"""
+    needed = set()
+    def visit(name):
+        if name in needed:
+            return
+        needed.add(name)
+        for dep in RULES[name].names & RULES.keys():
+            visit(dep)
+    for name in names:
+        visit(name)
+    return [name for name in RULES if name in needed]
+
+def required_columns(names):
+    """names のルールを評価するのに必要な列名"""
+    rules = _dependencies(names)
+    return tuple(sorted(set().union(*(RULES[n].names for n in rules)) - RULES.keys() - DEFAULT_PARAMS.keys()))
+
+def rule_source(names):
+    """names の評価に使う条件式（依存するルールを含む）。キャッシュのキーなど、ルールが変わったかの判定に使う"""
+    return {name: RULES[name].expr for name in _dependencies(names)}
+
+def evaluate(cols, names=None, params=None):
+    """
+    ルールを評価して {ルール名: ブール配列} を返す（names 省略時は全ルール、依存するルールも含む）。
+    cols は列名をキーにした同じ形の配列で、1銘柄の1次元でも (銘柄 × 日) の2次元でもよい（NaN を含む比較は False）。
+    """
+    namespace = {**DEFAULT_PARAMS, **(params or {}), **cols}
+    masks = {}
+    with np.errstate(invalid="ignore"):
+        for name in _dependencies(names or RULES):
+            masks[name] = namespace[name] = np.asarray(eval(RULES[name].code, {"__builtins__": {}}, namespace), dtype=bool)
+    return masks
+
+def market_frame(nikkei_df):
+    """日経平均の日足に、バックテストと同じ地合い判定（終値が200日線上）の列 Is_Good_Market を付ける"""
+    nk = add_technicals(nikkei_df, ("MA200",))
+    nk['Is_Good_Market'] = nk['Close'] > nk['MA200']
+    return nk
+
+def frame_columns(df, nk_data=None, columns=None):
+    """
+    指標列を追加済みの1銘柄の日足から、ルール評価用の列（1次元配列）を作る。
+    Prev_* は前日の値、Is_Good_Market は nk_data（market_frame の戻り値）から日付を合わせて取る（無ければ NaN）。
+    """
+    columns = columns or required_columns(RULES)
+    cols = {}
+    for col in columns:
+        if col.startswith("Prev_"):
+            cols[col] = df[col[5:]].shift(1).to_numpy(dtype=float)
+        elif col == "Is_Good_Market":
+            if nk_data is None:
+                cols[col] = np.full(len(df), np.nan)
+            else:
+                market = nk_data['Is_Good_Market'].astype(float)
+                cols[col] = market.reindex(df.index.union(nk_data.index)).ffill().reindex(df.index).to_numpy(dtype=float)
+        elif col in df.columns:
+            cols[col] = df[col].to_numpy(dtype=float)
+    return cols
+
+def stacked_columns(arrays, ind, is_good_market, columns=None, last_only=False):
+    """
+    (銘柄 × 日) の OHLCV 配列と指標配列から、ルール評価用の列を作る（Prev_* は1日ずらす）。
+    last_only=True なら最終日の1列だけを返す（市場スキャンの当日判定用）。
+    """
+    columns = columns or required_columns(RULES)
+    source = {**arrays, **ind}
+    cols = {}
+    for col in columns:
+        if col.startswith("Prev_"):
+            values = source[col[5:]]
+            cols[col] = values[:, -2] if last_only else np.concatenate([np.full((len(values), 1), np.nan), values[:, :-1]], axis=1)
+        elif col == "Is_Good_Market":
+            cols[col] = np.full(len(arrays["Close"]) if last_only else arrays["Close"].shape, float(is_good_market))
+        elif col in source:
+            cols[col] = source[col][:, -1] if last_only else source[col]
+    return cols
+
+def labels(masks, names, day=-1):
+    """day 日目に成立したルールの表示用ラベルを names の順に返す"""
+    return [RULES[name].label for name in names if masks[name][day]]
+
+def marker_codes(masks, names=MARKER_RULES):
+    """日ごとにチャートへ付ける印のルール名（無い日は None）"""
+    codes = np.full(len(masks[names[0]]), None, dtype=object)
+    for name in reversed(names):
+        codes[masks[name]] = name
+    return codes
+
+def chart_history(df, masks=None, bars=120):
+    """チャート用の直近 bars 本の日足（MA と、masks があればその日のシグナル印）"""
+    valid = df[['Open', 'High', 'Low', 'Close']].notna().all(axis=1).to_numpy()
+    codes = marker_codes(masks)[valid][-bars:] if masks is not None else None
+    df_clean = df[valid].tail(bars)
+    history_data = []
+    for i, (date_index, row) in enumerate(df_clean.iterrows()):
+        bar = {
+            "time": date_index.strftime('%Y-%m-%d'), "open": float(row['Open']), "high": float(row['High']), "low": float(row['Low']),
+            "close": float(row['Close']), "volume": float(row['Volume']),
+            "ma25": float(row['MA25']) if pd.notna(row['MA25']) else None,
+            "ma75": float(row['MA75']) if pd.notna(row['MA75']) else None,
+            "ma200": float(row['MA200']) if pd.notna(row['MA200']) else None
+        }
+        if codes is not None and codes[i]:
+            bar["signal"] = codes[i]
+        history_data.append(bar)
+    return history_data
+
+def marker_styles_json():
+    """ダッシュボードのチャートに埋め込む、ルール名 → 印の見た目"""
+    return json.dumps({name: RULES[name].marker for name in MARKER_RULES}, ensure_ascii=False)
@@ -0,0 +1,49 @@
+import json
+import os
+
+# 💡 定型コメントに載せる勝率・平均リターンは、バックテストの最新結果（performance_summary.json）から読む（数値を文章に直書きしない）
+SUMMARY_PATH = "public/performance_summary.json"
+
+_cache = {}
+
+def load_summary(path=SUMMARY_PATH):
+    """performance_summary.json を読む（更新されるまでは読み直さない。無ければ None）"""
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    cached = _cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            summary = json.load(f)
+    except (OSError, ValueError):
+        return None
+    _cache[path] = (mtime, summary)
+    return summary
+
+def strategy_stats(strategy, path=SUMMARY_PATH):
+    """戦術の成績（回数0・未集計なら None）"""
+    summary = load_summary(path) or {}
+    st = (summary.get("strategies") or {}).get(strategy)
+    return st if st and st.get("total_signals") else None
+
+def stat_comment(strategy, path=SUMMARY_PATH):
+    """
+    「過去の統計上、この条件達成時の5日後勝率は…」の一文（信頼区間があれば優位性の判定も添える）。成績が無ければ空文字。
+    """
+    st = strategy_stats(strategy, path)
+    if not st:
+        return ""
+    text = f"過去の統計上、この条件達成時の5日後勝率は「{st['win_rate']:.1f}%（平均{st['avg_return']:+.2f}%）」"
+    ci = st.get("ci")
+    if not ci:
+        return text + f"（{st['total_signals']}回）です。"
+    low, high = ci["win_rate"]
+    text += f"（{ci['confidence']}%信頼区間 {low:.1f}〜{high:.1f}%・{st['total_signals']}回）で、"
+    if low > 50:
+        return text + "偶然とは言いにくい優位性が確認されています。"
+    if high < 50:
+        return text + "統計上はむしろ不利な傾向が出ています。"
+    return text + "信頼区間が50%をまたぐため優位性はまだ確定的ではありません。"
@@ -1,42 +1,377 @@
-import pandas as pd
-import numpy as np
-
-def add_advanced_technicals(df):
-    if df is None or df.empty:
-        return df
-    df = df.copy()
-
-    # --- 1. 移動平均線 ---
-    df['MA25'] = df['Close'].rolling(window=25).mean()
-    df['MA75'] = df['Close'].rolling(window=75).mean()
-    df['MA200'] = df['Close'].rolling(window=200).mean()
-    
-    # --- 2. RSI (ワイルダー式: 機関投資家標準) ---
-    delta = df['Close'].diff()
-    up = delta.clip(lower=0)
-    down = -1 * delta.clip(upper=0)
-    ema_up = up.ewm(alpha=1/14, adjust=False).mean()
-    ema_down = down.ewm(alpha=1/14, adjust=False).mean()
-    rs = ema_up / ema_down
-    df['RSI'] = 100 - (100 / (1 + rs))
-
-    # --- 3. MACD (12, 26, 9) ---
-    ema12 = df['Close'].ewm(span=12, adjust=False).mean()
-    ema26 = df['Close'].ewm(span=26, adjust=False).mean()
-    df['MACD'] = ema12 - ema26
-    df['MACD_Signal'] = df['MACD'].ewm(span=9, adjust=False).mean()
-
-    # --- 4. ボリンジャーバンド (20日, ±2σ, ±3σ) ---
-    ma20 = df['Close'].rolling(window=20).mean()
-    std20 = df['Close'].rolling(window=20).std(ddof=0)
-    df['BB_upper2'] = ma20 + (std20 * 2)
-    df['BB_lower2'] = ma20 - (std20 * 2)
-    df['BB_upper3'] = ma20 + (std20 * 3)
-    df['BB_lower3'] = ma20 - (std20 * 3)
-
-    # --- 5. 出来高移動平均 (Volume MA 25日) ---
-    df['Vol_MA25'] = df['Volume'].rolling(window=25).mean()
-
-    # JSONでエラーにならないよう、NaNをNoneに置換（行自体は消さない）
-    df = df.replace({np.nan: None})
-    return df
\ No newline at end of file
+import os
+import pandas as pd
+import numpy as np
+from metrics import timer
+
+OHLCV_COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+
+# 監視・スキャン・バックテストで共通に使う指標セット
+BASE_INDICATORS = ("MA5", "MA25", "MA75", "MA200", "High_20", "Low_20", "Vol_Avg20", "Vol_Ratio", "RSI")
+ADVANCED_INDICATORS = ("MACD", "MACD_Signal", "BB_upper2", "BB_lower2", "BB_upper3", "BB_lower3", "Vol_MA25")
+ALL_INDICATORS = BASE_INDICATORS + ADVANCED_INDICATORS
+
+RSI_ALPHA = 1 / 14
+MACD_FAST_ALPHA = 2 / (12 + 1)
+MACD_SLOW_ALPHA = 2 / (26 + 1)
+MACD_SIGNAL_ALPHA = 2 / (9 + 1)
+
+def _shift(x):
+    out = np.full(x.shape, np.nan)
+    out[:, 1:] = x[:, :-1]
+    return out
+
+def _window_sums(x, window):
+    """累積和の差分で窓内合計と有効本数を求める（NaNは0として数え、有効本数で判定）"""
+    valid = ~np.isnan(x)
+    csum = np.cumsum(np.where(valid, x, 0.0), axis=1)
+    ccount = np.cumsum(valid, axis=1)
+    sums = np.full(x.shape, np.nan)
+    counts = np.zeros(x.shape, dtype=np.int64)
+    if x.shape[1] >= window:
+        sums[:, window - 1:] = csum[:, window - 1:]
+        sums[:, window:] -= csum[:, :-window]
+        counts[:, window - 1:] = ccount[:, window - 1:]
+        counts[:, window:] -= ccount[:, :-window]
+    return sums, counts
+
+def _rolling_mean(x, window):
+    sums, counts = _window_sums(x, window)
+    return np.where(counts == window, sums / window, np.nan)
+
+def _rolling_std(x, window):
+    """母標準偏差 (ddof=0)。平均と二乗平均の累積和から求める"""
+    sums, counts = _window_sums(x, window)
+    sq_sums, _ = _window_sums(x * x, window)
+    var = np.maximum(sq_sums / window - (sums / window) ** 2, 0.0)
+    return np.where(counts == window, np.sqrt(var), np.nan)
+
+def _rolling_extreme(x, window, func):
+    out = np.full(x.shape, np.nan)
+    if x.shape[1] >= window:
+        out[:, window - 1:] = func(np.lib.stride_tricks.sliding_window_view(x, window, axis=1), axis=2)
+    return out
+
+def _ewm_step(state, value, alpha):
+    """adjust=False の指数移動平均を1本進める（未開始の系列は最初の有効値から始める）"""
+    return np.where(np.isnan(state), value, np.where(np.isnan(value), state, (1 - alpha) * state + alpha * value))
+
+def _ewm(x, alpha):
+    out = np.full(x.shape, np.nan)
+    state = np.full(x.shape[:-1], np.nan)
+    for t in range(x.shape[-1]):
+        state = _ewm_step(state, x[..., t], alpha)
+        out[..., t] = state
+    return out
+
+def _gain_loss(close):
+    """RSI用の上昇幅・下落幅。初日の差分（NaN）は0として扱い、ワイルダー平滑化に含める"""
+    delta = close - _shift(close)
+    listed = ~np.isnan(close)
+    gain = np.where(listed, np.where(delta > 0, delta, 0.0), np.nan)
+    loss = np.where(listed, np.where(delta < 0, -delta, 0.0), np.nan)
+    return gain, loss
+
+def _rsi(avg_gain, avg_loss):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return 100 - (100 / (1 + avg_gain / avg_loss))
+
+@timer("compute.indicators")
+def compute_indicators(arrays, indicators=BASE_INDICATORS):
+    """
+    (銘柄 × 日) の2次元配列から、指定された指標をまとめて計算する。
+    arrays は OHLCV の列名をキーにした同じ形の配列（各行は右詰め・左側はNaN埋め）。
+    戻り値は指標名をキーにした同じ形の配列。
+    """
+    close, high, low, volume = arrays["Close"], arrays["High"], arrays["Low"], arrays["Volume"]
+    wanted = set(indicators)
+    out = {}
+
+    for name, window in (("MA5", 5), ("MA25", 25), ("MA75", 75), ("MA200", 200)):
+        if name in wanted:
+            out[name] = _rolling_mean(close, window)
+
+    # 直近20日の高値・安値・出来高平均は「前日まで」の値（当日を含めない）
+    if "High_20" in wanted:
+        out["High_20"] = _shift(_rolling_extreme(high, 20, np.max))
+    if "Low_20" in wanted:
+        out["Low_20"] = _shift(_rolling_extreme(low, 20, np.min))
+    if wanted & {"Vol_Avg20", "Vol_Ratio"}:
+        vol_avg20 = _shift(_rolling_mean(volume, 20))
+        if "Vol_Avg20" in wanted:
+            out["Vol_Avg20"] = vol_avg20
+        if "Vol_Ratio" in wanted:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                out["Vol_Ratio"] = volume / vol_avg20
+    if "Vol_MA25" in wanted:
+        out["Vol_MA25"] = _rolling_mean(volume, 25)
+
+    # 💡 RSI と MACD の指数平滑化は、系列を積み重ねて1回の時間ループで計算する
+    ewm_inputs, alphas = [], []
+    if "RSI" in wanted:
+        gain, loss = _gain_loss(close)
+        ewm_inputs += [gain, loss]
+        alphas += [RSI_ALPHA, RSI_ALPHA]
+    if wanted & {"MACD", "MACD_Signal"}:
+        ewm_inputs += [close, close]
+        alphas += [MACD_FAST_ALPHA, MACD_SLOW_ALPHA]
+    if ewm_inputs:
+        smoothed = _ewm(np.stack(ewm_inputs), np.array(alphas)[:, None])
+        smoothed = list(smoothed)
+        if "RSI" in wanted:
+            out["RSI"] = _rsi(smoothed.pop(0), smoothed.pop(0))
+        if wanted & {"MACD", "MACD_Signal"}:
+            macd = smoothed.pop(0) - smoothed.pop(0)
+            if "MACD" in wanted:
+                out["MACD"] = macd
+            if "MACD_Signal" in wanted:
+                out["MACD_Signal"] = _ewm(macd, MACD_SIGNAL_ALPHA)
+
+    if wanted & {"BB_upper2", "BB_lower2", "BB_upper3", "BB_lower3"}:
+        ma20 = _rolling_mean(close, 20)
+        std20 = _rolling_std(close, 20)
+        for sigma in (2, 3):
+            if f"BB_upper{sigma}" in wanted:
+                out[f"BB_upper{sigma}"] = ma20 + std20 * sigma
+            if f"BB_lower{sigma}" in wanted:
+                out[f"BB_lower{sigma}"] = ma20 - std20 * sigma
+
+    return out
+
+def stack_frames(frames):
+    """銘柄ごとの DataFrame を、最終行を揃えた (銘柄 × 日) の OHLCV 配列に積み重ねる"""
+    keys = list(frames)
+    length = max((len(df) for df in frames.values()), default=0)
+    arrays = {col: np.full((len(keys), length), np.nan) for col in OHLCV_COLUMNS}
+    for i, key in enumerate(keys):
+        df = frames[key]
+        block = df[OHLCV_COLUMNS].to_numpy(dtype=float)
+        for j, col in enumerate(OHLCV_COLUMNS):
+            arrays[col][i, length - len(df):] = block[:, j]
+    return keys, arrays
+
+def add_indicators(frames, indicators=BASE_INDICATORS):
+    """複数銘柄の DataFrame に指標列を一括で追加したコピーを返す（計算は全銘柄まとめて1回）"""
+    frames = {key: df for key, df in frames.items() if df is not None and not df.empty}
+    if not frames:
+        return {}
+    keys, arrays = stack_frames(frames)
+    values = compute_indicators(arrays, indicators)
+    names = list(values)
+    # 指標を (銘柄, 日, 指標) の1つの配列にまとめ、銘柄ごとに一度だけ DataFrame を組み立てる
+    stacked = np.stack([values[name] for name in names], axis=-1)
+    result = {}
+    for i, key in enumerate(keys):
+        df = frames[key]
+        n = len(df)
+        extra = pd.DataFrame(stacked[i, stacked.shape[1] - n:], index=df.index, columns=names)
+        result[key] = pd.concat([df.drop(columns=[c for c in names if c in df.columns]), extra], axis=1)
+    return result
+
+def add_technicals(df, indicators=BASE_INDICATORS):
+    """単一銘柄版の add_indicators"""
+    if df is None or df.empty:
+        return df
+    return add_indicators({"_": df}, indicators)["_"]
+
+def add_advanced_technicals(df):
+    if df is None or df.empty:
+        return df
+    df = add_technicals(df, ALL_INDICATORS)
+
+    # JSONでエラーにならないよう、NaNをNoneに置換（行自体は消さない）
+    df = df.replace({np.nan: None})
+    return df
+
+# ==========================================
+# 💡 インクリメンタル（1本ずつ更新）モード
+# ==========================================
+# 累積和・リングバッファ・指数平滑化の途中状態を銘柄ごとに保存し、新しい足だけを O(1) で反映する。
+# 状態を作った最初の足からの全期間を compute_indicators で再計算した結果と、ビット単位で一致する。
+
+STATE_PATH = "data_cache/indicator_state.npz"
+
+# 窓内合計を持つ系列: 名前 → (元の系列, 窓幅)
+_SUM_SPECS = {
+    "MA5": ("Close", 5), "MA25": ("Close", 25), "MA75": ("Close", 75), "MA200": ("Close", 200),
+    "BB20": ("Close", 20), "BB20_SQ": ("Close_SQ", 20), "VOL20": ("Volume", 20), "VOL25": ("Volume", 25),
+}
+_EXTREME_WINDOW = 20
+_EWM_KEYS = ("gain", "loss", "ema_fast", "ema_slow", "macd_signal")
+
+def _empty_state(n):
+    nan = lambda *shape: np.full((n,) + shape, np.nan)
+    return {
+        "keys": np.array([], dtype=str), "last_date": np.array([], dtype=str),
+        # 累積和と、直近 window 本分の累積和の履歴（古い順）。履歴の初期値0は「開始前の累積和」
+        "sums": {name: {"csum": np.zeros(n), "count": np.zeros(n, dtype=np.int64),
+                        "ring": np.zeros((n, window)), "ring_count": np.zeros((n, window), dtype=np.int64)}
+                 for name, (_, window) in _SUM_SPECS.items()},
+        "high_ring": nan(_EXTREME_WINDOW), "low_ring": nan(_EXTREME_WINDOW),
+        "ewm": {key: nan() for key in _EWM_KEYS},
+        "prev_close": nan(), "vol_mean20": nan(),
+        "out": {name: nan() for name in ALL_INDICATORS},
+    }
+
+def advance_state(state, bar):
+    """
+    全銘柄の状態を1本分進め、その足の指標値（指標名 → 銘柄ごとの1次元配列）を返す。
+    bar は OHLCV の列名をキーにした、銘柄数と同じ長さの配列。
+    """
+    close, high, low, volume = (np.asarray(bar[col], dtype=float) for col in ("Close", "High", "Low", "Volume"))
+    sources = {"Close": close, "Close_SQ": close * close, "Volume": volume}
+
+    sums, counts = {}, {}
+    for name, (source, window) in _SUM_SPECS.items():
+        s = state["sums"][name]
+        x = sources[source]
+        valid = ~np.isnan(x)
+        s["csum"] = s["csum"] + np.where(valid, x, 0.0)
+        s["count"] = s["count"] + valid
+        sums[name] = s["csum"] - s["ring"][:, 0]
+        counts[name] = s["count"] - s["ring_count"][:, 0]
+        s["ring"] = np.concatenate([s["ring"][:, 1:], s["csum"][:, None]], axis=1)
+        s["ring_count"] = np.concatenate([s["ring_count"][:, 1:], s["count"][:, None]], axis=1)
+
+    def mean(name):
+        window = _SUM_SPECS[name][1]
+        return np.where(counts[name] == window, sums[name] / window, np.nan)
+
+    out = {name: mean(name) for name in ("MA5", "MA25", "MA75", "MA200")}
+
+    # 前日までの20日高値・安値・出来高平均（当日の足を加える前の値）
+    out["High_20"] = np.max(state["high_ring"], axis=1)
+    out["Low_20"] = np.min(state["low_ring"], axis=1)
+    state["high_ring"] = np.concatenate([state["high_ring"][:, 1:], high[:, None]], axis=1)
+    state["low_ring"] = np.concatenate([state["low_ring"][:, 1:], low[:, None]], axis=1)
+    out["Vol_Avg20"] = state["vol_mean20"]
+    state["vol_mean20"] = mean("VOL20")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out["Vol_Ratio"] = volume / out["Vol_Avg20"]
+    out["Vol_MA25"] = mean("VOL25")
+
+    ewm = state["ewm"]
+    delta = close - state["prev_close"]
+    listed = ~np.isnan(close)
+    gain = np.where(listed, np.where(delta > 0, delta, 0.0), np.nan)
+    loss = np.where(listed, np.where(delta < 0, -delta, 0.0), np.nan)
+    ewm["gain"] = _ewm_step(ewm["gain"], gain, np.float64(RSI_ALPHA))
+    ewm["loss"] = _ewm_step(ewm["loss"], loss, np.float64(RSI_ALPHA))
+    out["RSI"] = _rsi(ewm["gain"], ewm["loss"])
+    ewm["ema_fast"] = _ewm_step(ewm["ema_fast"], close, np.float64(MACD_FAST_ALPHA))
+    ewm["ema_slow"] = _ewm_step(ewm["ema_slow"], close, np.float64(MACD_SLOW_ALPHA))
+    out["MACD"] = ewm["ema_fast"] - ewm["ema_slow"]
+    ewm["macd_signal"] = _ewm_step(ewm["macd_signal"], out["MACD"], MACD_SIGNAL_ALPHA)
+    out["MACD_Signal"] = ewm["macd_signal"]
+    state["prev_close"] = close
+
+    ma20 = mean("BB20")
+    with np.errstate(invalid="ignore"):
+        var = np.maximum(sums["BB20_SQ"] / 20 - (sums["BB20"] / 20) ** 2, 0.0)
+    std20 = np.where(counts["BB20"] == 20, np.sqrt(var), np.nan)
+    for sigma in (2, 3):
+        out[f"BB_upper{sigma}"] = ma20 + std20 * sigma
+        out[f"BB_lower{sigma}"] = ma20 - std20 * sigma
+
+    state["out"] = out
+    return out
+
+def init_state(frames):
+    """銘柄ごとの日足を先頭から1本ずつ流し込んで状態を作る（戻り値の out が最新足の指標値）"""
+    keys, arrays = stack_frames(frames)
+    state = _empty_state(len(keys))
+    for t in range(arrays["Close"].shape[1]):
+        advance_state(state, {col: arr[:, t] for col, arr in arrays.items()})
+    state["keys"] = np.array(keys, dtype=str)
+    state["last_date"] = np.array([frames[k].index[-1].strftime('%Y-%m-%d') for k in keys], dtype=str)
+    return state
+
+def _map_state(func, *states):
+    first = states[0]
+    if isinstance(first, dict):
+        return {k: _map_state(func, *(s[k] for s in states)) for k in first}
+    return func(*states)
+
+def _select_state(state, idx):
+    return _map_state(lambda a: a[idx], state)
+
+def _concat_states(states):
+    return _map_state(lambda *arrs: np.concatenate(arrs), *states)
+
+def save_state(state, path=STATE_PATH):
+    flat = {}
+    def walk(node, prefix):
+        for k, v in node.items():
+            if isinstance(v, dict):
+                walk(v, f"{prefix}{k}/")
+            else:
+                flat[f"{prefix}{k}"] = v
+    walk(state, "")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path, **flat)
+    os.replace(tmp_path, path)
+
+def load_state(path=STATE_PATH):
+    if not os.path.exists(path):
+        return None
+    try:
+        state = {}
+        with np.load(path) as data:
+            for flat_key in data.files:
+                node = state
+                *parents, leaf = flat_key.split("/")
+                for p in parents:
+                    node = node.setdefault(p, {})
+                node[leaf] = data[flat_key]
+        return state
+    except Exception as e:
+        print(f"指標状態の読込エラー（全期間で再計算します）: {e}")
+        return None
+
+@timer("compute.latest_indicators")
+def latest_indicators(frames, path=STATE_PATH, persist=True):
+    """
+    各銘柄の最新足の指標値を {銘柄: {指標名: 値}} で返す。
+    保存済み状態の最終足が日足に含まれ、終値も一致する銘柄はそれ以降の足だけを進め、
+    状態が無い・株価が再調整された銘柄は渡された日足の全期間から状態を作り直す。
+    """
+    frames = {key: df for key, df in frames.items() if df is not None and not df.empty}
+    state = load_state(path) if path else None
+    known = {str(k): i for i, k in enumerate(state["keys"])} if state is not None else {}
+
+    parts, rebuild, pending = [], {}, {}
+    for key, df in frames.items():
+        i = known.get(key)
+        if i is not None:
+            last_date = pd.Timestamp(str(state["last_date"][i]))
+            pos = df.index.searchsorted(last_date)
+            if pos < len(df) and df.index[pos] == last_date and df["Close"].iat[pos] == state["prev_close"][i]:
+                pending.setdefault(len(df) - pos - 1, []).append(key)
+                continue
+        rebuild[key] = df
+
+    for n_new, keys in pending.items():
+        sub = _select_state(state, np.array([known[k] for k in keys]))
+        # 新しい足だけを (銘柄, 本数, OHLCV) の配列に切り出して1本ずつ進める
+        new_bars = np.stack([frames[k][OHLCV_COLUMNS].to_numpy(dtype=float)[len(frames[k]) - n_new:] for k in keys])
+        for t in range(n_new):
+            advance_state(sub, {col: new_bars[:, t, j] for j, col in enumerate(OHLCV_COLUMNS)})
+        if n_new:
+            sub["last_date"] = np.array([frames[k].index[-1].strftime('%Y-%m-%d') for k in keys], dtype=str)
+        parts.append(sub)
+    if rebuild:
+        parts.append(init_state(rebuild))
+
+    if not parts:
+        return {}
+    merged = _concat_states(parts)
+    if persist and path:
+        # 今回扱わなかった銘柄の状態も残す
+        if state is not None:
+            others = np.array([i for k, i in known.items() if k not in frames], dtype=int)
+            if len(others):
+                merged = _concat_states([merged, _select_state(state, others)])
+        save_state(merged, path)
+
+    return {key: {name: float(merged["out"][name][i]) for name in ALL_INDICATORS}
+            for i, key in enumerate(merged["keys"]) if key in frames}
@@ -0,0 +1,30 @@
+import os
+import sys
+import pytest
+
+# 💡 テストはリポジトリ直下のモジュールをそのまま読み、キャッシュや public/ は一時ディレクトリに書く
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import replay
+from benchmark import synthetic_fixture
+
+class CountingFixture(replay.Fixture):
+    """再生した株価の要求回数（シンボルごと）を数える録画データ"""
+    def __init__(self, fixture):
+        super().__init__(fixture.name)
+        self.prices = fixture.prices
+        self.requests = []
+
+    def prices_between(self, symbol, start_str, end_str):
+        self.requests.append(symbol)
+        return super().prices_between(symbol, start_str, end_str)
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+@pytest.fixture
+def market(workdir):
+    """日経平均＋合成12銘柄の録画データ（今日まで）"""
+    return CountingFixture(synthetic_fixture(12, days=520, seed=1))
@@ -0,0 +1,119 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from ai_analyzer import BATCH_RESPONSE_SCHEMA, GeminiClient, GeminiError, TokenBucket, parse_batch_response
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+class FakeResponse:
+    def __init__(self, status_code, body, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.content = json.dumps(body).encode("utf-8")
+        self._body = body
+
+    def json(self):
+        return self._body
+
+class FakeSession:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def post(self, *args, **kwargs):
+        self.calls += 1
+        return self.responses.pop(0)
+
+def _ok(text):
+    return FakeResponse(200, {"candidates": [{"content": {"parts": [{"text": text}]}}]})
+
+def _client(responses, rpm=60, burst=1):
+    clock = FakeClock()
+    client = GeminiClient("key", rpm=rpm, burst=burst, sleep=clock.sleep)
+    client.bucket = TokenBucket(rpm, burst, clock=clock, sleep=clock.sleep)
+    client.session = FakeSession(responses)
+    return client, clock
+
+def test_429_waits_for_retry_after():
+    client, clock = _client([FakeResponse(429, {"error": {"message": "quota"}}, {"Retry-After": "7"}), _ok("done")])
+    assert client.generate("prompt") == "done"
+    assert client.session.calls == 2
+    assert client.stats["retries"] == 1
+    # 次のトークン（1秒）に加えて Retry-After の7秒ぶん待つ
+    assert sum(clock.slept) == pytest.approx(8.0)
+
+def test_5xx_without_retry_after_backs_off_exponentially():
+    client, clock = _client([FakeResponse(503, {}), FakeResponse(503, {}), _ok("done")], rpm=6000, burst=10)
+    assert client.generate("prompt") == "done"
+    assert clock.slept == [2.0, 4.0]
+
+def test_gives_up_after_max_retries_with_api_message():
+    client, _ = _client([FakeResponse(429, {"error": {"message": "quota"}}, {"Retry-After": "1"})] * 4)
+    with pytest.raises(GeminiError, match="quota"):
+        client.generate("prompt")
+    assert client.session.calls == 4
+
+def test_client_error_is_not_retried():
+    client, _ = _client([FakeResponse(400, {"error": {"message": "bad request"}})])
+    with pytest.raises(GeminiError, match="bad request"):
+        client.generate("prompt")
+    assert client.session.calls == 1
+
+class StubGemini(BaseHTTPRequestHandler):
+    """localhost の Gemini もどき。responses を先頭から1つずつ返し、受け取ったリクエストを requests に残す"""
+    responses = []
+    requests = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        type(self).requests.append((self.path, json.loads(body)))
+        status, headers, payload = type(self).responses.pop(0)
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        for key, value in {**headers, "Content-Type": "application/json", "Content-Length": str(len(data))}.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def stub_gemini():
+    StubGemini.responses, StubGemini.requests = [], []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubGemini)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+def test_real_http_retry_after_then_json_response(stub_gemini):
+    answer = [{"code": "7203", "indicators": ["RSI 45"], "analysis": "様子見"}]
+    StubGemini.responses = [
+        (429, {"Retry-After": "3"}, {"error": {"message": "quota"}}),
+        (200, {}, {"candidates": [{"content": {"parts": [{"text": json.dumps(answer, ensure_ascii=False)}]}}]}),
+    ]
+    clock = FakeClock()
+    client = GeminiClient("key", base_url=stub_gemini, model="stub", rpm=60, burst=1, sleep=clock.sleep)
+    client.bucket = TokenBucket(60, 1, clock=clock, sleep=clock.sleep)
+    config = {"responseMimeType": "application/json", "responseSchema": BATCH_RESPONSE_SCHEMA}
+
+    text = client.generate("prompt", config)
+    assert "7203" in parse_batch_response(text, ["7203"])
+    assert client.stats["retries"] == 1
+    # 本物の HTTP 応答ヘッダの Retry-After（3秒）と次のトークン（1秒）ぶん待つ
+    assert sum(clock.slept) == pytest.approx(4.0)
+    assert [path for path, _ in StubGemini.requests] == ["/models/stub:generateContent?key=key"] * 2
+    assert StubGemini.requests[-1][1]["generationConfig"] == config
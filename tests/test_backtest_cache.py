@@ -0,0 +1,40 @@
+from datetime import datetime, timedelta
+import pandas as pd
+import replay
+from analyze_performance import backtest_trades
+from backtest_cache import BacktestCache
+from price_store import JST, get_histories
+from signal_rules import market_frame
+from technical_calc import add_indicators
+
+def _load(market):
+    now = datetime.now(JST)
+    start_str = (now - timedelta(days=800)).strftime('%Y-%m-%d')
+    end_str = (now + timedelta(days=1)).strftime('%Y-%m-%d')
+    with replay.replaying(market):
+        frames = get_histories(list(market.prices), start_str, end_str)
+    nk = frames.pop("^N225")
+    return {symbol[:-2]: df for symbol, df in frames.items()}, nk
+
+def _backtest(frames, nk, n_days, cache=None):
+    frames = add_indicators({code: df.iloc[:n_days] for code, df in frames.items()})
+    universe = {code: code for code in frames}
+    return backtest_trades(frames, market_frame(nk.iloc[:n_days]), universe, cache=cache)
+
+def test_incremental_matches_full_recompute(market, workdir):
+    frames, nk = _load(market)
+    cache = BacktestCache(str(workdir / "backtest.pkl"))
+    for n_days in (470, 471, 471, 480, 520):
+        incremental = _backtest(frames, nk, n_days, cache)
+        full = _backtest(frames, nk, n_days)
+        assert len(full)
+        pd.testing.assert_frame_equal(incremental.reset_index(drop=True), full.reset_index(drop=True))
+
+def test_adjusted_ticker_is_recomputed(market, workdir):
+    frames, nk = _load(market)
+    cache = BacktestCache(str(workdir / "backtest.pkl"))
+    _backtest(frames, nk, 500, cache)
+    frames["1003"] = frames["1003"] * [0.5, 0.5, 0.5, 0.5, 2.0]
+    incremental = _backtest(frames, nk, 501, cache)
+    full = _backtest(frames, nk, 501)
+    pd.testing.assert_frame_equal(incremental.reset_index(drop=True), full.reset_index(drop=True))
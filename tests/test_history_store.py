@@ -0,0 +1,87 @@
+import gzip
+import json
+from datetime import datetime, timedelta
+import history_store
+import price_store
+import replay
+from history_store import PRICE_FIELDS, append_bars, load_series
+from price_store import JST, get_histories
+from signal_rules import chart_history
+from technical_calc import add_technicals
+
+def _history(df, bars=120):
+    return chart_history(add_technicals(df), bars=bars)
+
+def _fetch(market, symbols):
+    now = datetime.now(JST)
+    start_str = (now - timedelta(days=800)).strftime('%Y-%m-%d')
+    end_str = (now + timedelta(days=1)).strftime('%Y-%m-%d')
+    return get_histories(symbols, start_str, end_str)
+
+def test_daily_append_adds_one_line(market, workdir):
+    df = market.prices["1000.T"]
+    assert append_bars("1000", _history(df.iloc[:-1]))
+    path = workdir / "public" / "prices" / "1000.json"
+    before = path.read_text(encoding="utf-8").splitlines()
+    assert append_bars("1000", _history(df))
+    assert not append_bars("1000", _history(df))
+    after = path.read_text(encoding="utf-8").splitlines()
+    assert len(after) == len(before) + 1
+    assert after[:-3] == before[:-2]
+    assert json.loads(after[-2].rstrip(","))[0] == df.index[-1].strftime('%Y-%m-%d')
+
+def test_adjustment_rewrites_series(market, workdir, monkeypatch):
+    with replay.replaying(market):
+        frames = _fetch(market, ["1000.T"])
+        append_bars("1000", _history(frames["1000.T"]))
+        # 1:2 の株式分割で過去の株価がすべて調整し直された
+        adjusted = market.prices["1000.T"].copy()
+        adjusted[["Open", "High", "Low", "Close"]] /= 2
+        market.prices["1000.T"] = adjusted
+        monkeypatch.setattr(price_store, "TAIL_CHECK_TTL", 0)
+        frames = _fetch(market, ["1000.T"])
+    assert append_bars("1000", _history(frames["1000.T"]))
+    series = load_series("1000")
+    closes = {row[0]: row[4] for row in series["rows"]}
+    expected = frames["1000.T"]["Close"]
+    assert len(closes) == len(expected)
+    for date, close in expected.items():
+        assert closes[date.strftime('%Y-%m-%d')] == round(close, 2)
+    # 一度書き直したら、次の保存ではもう作り直さない
+    assert not append_bars("1000", _history(frames["1000.T"]))
+
+def test_legacy_gzip_series_is_converted(market, workdir):
+    rows = _history(market.prices["1000.T"], bars=5)
+    legacy = {"code": "1000", "time": [r["time"] for r in rows[:4]],
+              **{k: [history_store._round(r[k], d) for r in rows[:4]] for k, d in PRICE_FIELDS.items()}}
+    path = workdir / "public" / "prices" / "1000.json.gz"
+    path.parent.mkdir(parents=True)
+    path.write_bytes(gzip.compress(json.dumps(legacy).encode("utf-8")))
+    assert append_bars("1000", rows)
+    assert not path.exists()
+    assert [row[0] for row in load_series("1000")["rows"]] == [r["time"] for r in rows]
+
+def _rounded(rows):
+    # 共有系列は PRICE_FIELDS の桁数で丸めて保存するので、元のレポートも丸めた値で用意する
+    return [{**row, **{k: (float(history_store._round(row[k], d)) if row[k] is not None else None)
+                       for k, d in PRICE_FIELDS.items()}} for row in rows]
+
+def test_saved_report_loads_back_in_the_original_shape(market, workdir):
+    df = market.prices["1000.T"].iloc[:-5]
+    date_str = df.index[-1].strftime('%Y-%m-%d')
+    watch_rows = _rounded(_history(df))
+    watch_rows[-3]["signal"] = "BREAKOUT"
+    scan_rows = _rounded(_history(market.prices["1001.T"].iloc[:-5]))
+    report = {
+        "updated_at": f"{date_str} 19:45", "date": date_str,
+        "watch_data": [{"code": "1000", "name": "A", "price": watch_rows[-1]["close"], "signals": [], "history_data": watch_rows, "error": False},
+                       {"code": "1002", "name": "B", "error": True, "error_msg": "取得失敗"}],
+        "scan_data": {"market_info": {"is_good": True, "text": "良好", "nikkei_data": {}},
+                      "scan_a": [{"code": "1001", "name": "C", "price": scan_rows[-1]["close"], "history_data": scan_rows}], "scan_b": []},
+    }
+    original = json.loads(json.dumps(report))
+    history_store.save_report(f"{history_store.HISTORY_DIR}/{date_str}.json", report)
+    # 翌日以降の日足が共有系列に追記されても、その日時点の120本に戻る
+    append_bars("1000", _history(market.prices["1000.T"]))
+    assert history_store.load_report(date_str) == original
+    assert history_store.load_report("1999-01-01") is None
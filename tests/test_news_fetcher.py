@@ -0,0 +1,62 @@
+import io
+import news_fetcher
+from news_fetcher import fetch_feed
+
+URL = "https://example.com/rss"
+
+def _rss(*titles):
+    items = "".join(f"<item><title>{t}</title><link>https://example.com/{i}</link>"
+                    f"<pubDate>Tue, 27 Feb 2024 0{i}:00:00 GMT</pubDate></item>" for i, t in enumerate(titles))
+    return f"<rss><channel>{items}</channel></rss>".encode("utf-8")
+
+class FakeRaw(io.BytesIO):
+    decode_content = False
+
+class FakeResponse:
+    def __init__(self, status_code, body=b"", headers=None):
+        self.status_code = status_code
+        self.raw = FakeRaw(body)
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+class FakeSession:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, url, headers=None, **kwargs):
+        self.requests.append(headers or {})
+        return self.responses.pop(0)
+
+def _fetch(monkeypatch, workdir, responses, times):
+    session = FakeSession(responses)
+    monkeypatch.setattr(news_fetcher, "_session", session)
+    path = str(workdir / "news.db")
+    return [fetch_feed(URL, "Test", path=path) for _ in range(times)], session
+
+def test_duplicate_titles_are_merged(monkeypatch, workdir):
+    (items,), _ = _fetch(monkeypatch, workdir, [FakeResponse(200, _rss("決算 発表", " 決算  発表 ", "新製品"))], 1)
+    # 空白の違いだけの見出しは同じ記事として1件にまとめる
+    assert sorted(item["title"] for item in items) == ["新製品", "決算 発表"]
+
+def test_seen_items_keep_first_seen_and_304_reuses_stored(monkeypatch, workdir):
+    responses = [
+        FakeResponse(200, _rss("決算発表"), {"ETag": '"v1"'}),
+        FakeResponse(200, _rss("決算発表", "新製品"), {"ETag": '"v2"'}),
+        FakeResponse(304),
+    ]
+    (first, second, third), session = _fetch(monkeypatch, workdir, responses, 3)
+    seen = {item["title"]: item["first_seen"] for item in second}
+    assert seen["決算発表"] == first[0]["first_seen"]
+    assert seen["新製品"] >= seen["決算発表"]
+    assert sorted(item["title"] for item in third) == sorted(seen)
+    assert session.requests[1]["If-None-Match"] == '"v1"'
+    assert session.requests[2]["If-None-Match"] == '"v2"'
@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta
+import pandas as pd
+import price_store
+import replay
+from price_store import JST, get_histories
+
+def _range():
+    now = datetime.now(JST)
+    return (now - timedelta(days=800)).strftime('%Y-%m-%d'), (now + timedelta(days=1)).strftime('%Y-%m-%d')
+
+def test_second_call_hits_cache(market):
+    symbols = list(market.prices)
+    start_str, end_str = _range()
+    with replay.replaying(market):
+        first = get_histories(symbols, start_str, end_str)
+        assert market.requests
+        market.requests.clear()
+        second = get_histories(symbols, start_str, end_str)
+        third = get_histories(symbols[:3], start_str, end_str)
+    assert market.requests == []
+    for symbol in symbols:
+        pd.testing.assert_frame_equal(first[symbol], second[symbol])
+    assert list(third) == symbols[:3]
+
+def test_stale_tail_is_checked_again(market, monkeypatch):
+    symbols = list(market.prices)
+    start_str, end_str = _range()
+    with replay.replaying(market):
+        get_histories(symbols, start_str, end_str)
+        market.requests.clear()
+        monkeypatch.setattr(price_store, "TAIL_CHECK_TTL", 0)
+        get_histories(symbols, start_str, end_str)
+    assert sorted(set(market.requests)) == sorted(symbols)
+
+def test_adjusted_prices_are_refetched(market, monkeypatch):
+    symbol = "1000.T"
+    start_str, end_str = _range()
+    with replay.replaying(market):
+        get_histories([symbol], start_str, end_str)
+        # 1:2 の株式分割で過去の株価がすべて半分に調整し直された
+        adjusted = market.prices[symbol].copy()
+        adjusted[["Open", "High", "Low", "Close"]] /= 2
+        market.prices[symbol] = adjusted
+        monkeypatch.setattr(price_store, "TAIL_CHECK_TTL", 0)
+        df = get_histories([symbol], start_str, end_str)[symbol]
+    expected = market.prices_between(symbol, start_str, end_str)
+    assert len(df) == len(expected)
+    assert (df["Close"].to_numpy() == expected["Close"].to_numpy()).all()
@@ -0,0 +1,28 @@
+import json
+import replay
+import scanner
+from run_context import RunContext
+from technical_calc import add_indicators
+
+def test_past_date_scan_uses_vectorised_indicators(market, workdir, monkeypatch):
+    codes = [symbol[:-2] for symbol in market.prices if symbol.endswith(".T")]
+    (workdir / "watchlist.json").write_text(json.dumps({code: code for code in codes}), encoding="utf-8")
+    # バックフィルでは保存済みの指標状態（1本ずつ進める経路）を使わない
+    def fail(*args, **kwargs):
+        raise AssertionError("latest_indicators は過去日のスキャンで呼ばない")
+    monkeypatch.setattr(scanner, "latest_indicators", fail)
+
+    date = market.prices["^N225"].index[-30]
+    date_str = date.strftime('%Y-%m-%d')
+    # 出来高急増が十分に出るよう、対象日の出来高を半分の銘柄で4倍にする
+    for code in codes[::2]:
+        market.prices[f"{code}.T"].loc[date, "Volume"] *= 4
+    with replay.replaying(market):
+        result = scanner.scan_b_type(date_str, frames=market.prices, ctx=RunContext())
+
+    frames = add_indicators({code: market.prices[f"{code}.T"].loc[:date] for code in codes})
+    spikes = {code for code, df in frames.items() if df["Vol_Ratio"].iloc[-1] >= scanner.VOL_SPIKE_RATIO}
+    found = {item["code"] for item in result["scan_a"] + result["scan_b"]}
+    assert spikes
+    assert found == spikes
+    assert not (workdir / "data_cache" / "indicator_state.npz").exists()
@@ -0,0 +1,28 @@
+import numpy as np
+from technical_calc import ALL_INDICATORS, add_indicators, latest_indicators
+
+def _frames(market, n_days):
+    return {symbol: df.iloc[:n_days] for symbol, df in market.prices.items()}
+
+def _assert_latest_matches(latest, frames):
+    full = add_indicators(frames, ALL_INDICATORS)
+    assert set(latest) == set(frames)
+    for key, df in full.items():
+        expected = df[list(ALL_INDICATORS)].iloc[-1].to_numpy(dtype=float)
+        actual = np.array([latest[key][name] for name in ALL_INDICATORS])
+        np.testing.assert_allclose(actual, expected, rtol=1e-7, atol=1e-9, equal_nan=True, err_msg=key)
+
+def test_incremental_matches_full_recompute(market, workdir):
+    path = str(workdir / "state.npz")
+    _assert_latest_matches(latest_indicators(_frames(market, 480), path=path), _frames(market, 480))
+    # 1本ずつ・数本まとめて進めても、全期間から計算し直した最新足と一致する
+    for n_days in (481, 482, 490):
+        frames = _frames(market, n_days)
+        _assert_latest_matches(latest_indicators(frames, path=path), frames)
+
+def test_adjusted_prices_rebuild_state(market, workdir):
+    path = str(workdir / "state.npz")
+    latest_indicators(_frames(market, 480), path=path)
+    frames = _frames(market, 481)
+    frames["1000.T"] = frames["1000.T"] * [0.5, 0.5, 0.5, 0.5, 2.0]
+    _assert_latest_matches(latest_indicators(frames, path=path), frames)
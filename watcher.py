@@ -1,12 +1,16 @@
 import pandas as pd
-import yfinance as yf
 from datetime import datetime, timedelta, timezone
-import time
+import concurrent.futures
 import os
 
 # AI連携モジュールのインポート（GitHub上にこれらのファイルが必要です）
-from ai_analyzer import get_ai_analysis
-from news_fetcher import fetch_recent_news
+from ai_analyzer import get_ai_analysis_batch
+from news_fetcher import fetch_news_batch
+from price_store import get_histories, slice_frames
+from technical_calc import add_indicators
+from signal_rules import MARKER_RULES, chart_history, evaluate, frame_columns, labels, market_frame
+from strategy_stats import stat_comment
+from run_context import RunContext
 
 JST = timezone(timedelta(hours=9))
 
@@ -16,15 +20,18 @@ WATCH_TICKERS = {
     "7974": "任天堂", "6146": "ディスコ", "4063": "信越化学工業", "8411": "みずほFg"
 }
 
+# 監視銘柄カードに表示するシグナル（signal_rules のルール名、表示順）
+WATCH_SIGNALS = ("TOP_WARNING", "REVERSAL", "PULLBACK", "GOLDEN_CROSS", "DEAD_CROSS")
+
 def generate_watch_comment(signals, rsi, position, ma25_trend, vol_ratio):
     """【APIキー未設定時のフォールバック用】従来の定型文エンジン"""
     comment = ""
     if "⚠️ [天井警戒型]" in "".join(signals):
         comment += "【🚨天井警戒】直近高値付近で上値が重く反落（ダブルトップ形成の兆し）しており、RSIも過熱圏から下落に転じました。急な調整下落リスクが高まっています。\n"
     elif "🔄 [底打ち確認型]" in "".join(signals):
-        comment += "【🔄底打ち確認】直近安値を割らずに反発し、さらに5日移動平均線（MA5）を明確に上抜けました！「落ちるナイフ」のダマシを回避したこの条件の過去勝率は「50.9%（平均+0.05%）」に改善しており、下落トレンドからの転換を狙う打診買いの候補となります。\n"
+        comment += f"【🔄底打ち確認】直近安値を割らずに反発し、さらに5日移動平均線（MA5）を明確に上抜けました！「落ちるナイフ」のダマシを避ける厳しい条件です。{stat_comment('REVERSAL')}下落トレンドからの転換を狙う打診買いの候補となります。\n"
     elif "🟢 [押し目拾い型]" in "".join(signals):
-        comment += "【🎯押し目拾い】主要な移動平均線（75日/200日）の強固なサポートライン付近まで調整し、本日反発を見せました。過去の統計上、この条件達成時の5日後勝率は「52.1%（平均+0.32%）」と最も安定しており、順張りの絶好のエントリーポイントです。\n"
+        comment += f"【🎯押し目拾い】主要な移動平均線（75日/200日）の強固なサポートライン付近まで調整し、本日反発を見せました。{stat_comment('PULLBACK')}順張りのエントリーポイント候補です。\n"
     
     if "🌟 ゴールデンクロス発生" in signals:
         comment += "中期線(MA25)が長期線(MA75)を上抜けるゴールデンクロスも発生し、中長期的な上昇トレンドの形成を後押ししています。"
@@ -43,147 +50,87 @@ def generate_watch_comment(signals, rsi, position, ma25_trend, vol_ratio):
             
     return comment
 
-def process_watch_ticker(code, name, start_str, end_str, api_key):
-    max_retries = 3
-    base_wait = 2
-
-    for attempt in range(max_retries):
-        try:
-            ticker = yf.Ticker(f"{code}.T")
-            df = ticker.history(start=start_str, end=end_str)
-            
-            if df.empty or len(df) < 200:
-                return {"code": code, "name": name, "error": True, "error_msg": "データ不足（新規上場など）"}
-                
-            df.index = df.index.tz_localize(None)
-            
-            df['MA5'] = df['Close'].rolling(window=5).mean()
-            df['MA25'] = df['Close'].rolling(window=25).mean()
-            df['MA75'] = df['Close'].rolling(window=75).mean()
-            df['MA200'] = df['Close'].rolling(window=200).mean()
-            
-            df['High_20'] = df['High'].rolling(window=20).max().shift(1)
-            df['Low_20'] = df['Low'].rolling(window=20).min().shift(1)
-            
-            delta = df['Close'].diff()
-            gain = delta.where(delta > 0, 0).ewm(alpha=1/14, adjust=False).mean()
-            loss = (-delta.where(delta < 0, 0)).ewm(alpha=1/14, adjust=False).mean()
-            rs = gain / loss
-            df['RSI'] = 100 - (100 / (1 + rs))
-            
-            latest = df.iloc[-1]
-            prev = df.iloc[-2]
-            
-            price = int(latest['Close'])
-            price_diff = int(latest['Close'] - prev['Close'])
-            rsi = round(latest['RSI'], 1)
-            prev_rsi = round(prev['RSI'], 1) if pd.notna(prev['RSI']) else rsi
-            ma200 = latest['MA200']
-            
-            rsi_diff = rsi - prev_rsi
-            if rsi_diff > 2:
-                rsi_trend = f"RSI 上昇 (+{round(rsi_diff, 1)})"
-            elif rsi_diff < -2:
-                rsi_trend = f"RSI 低下 ({round(rsi_diff, 1)})"
-            else:
-                rsi_trend = "RSI 横ばい"
-
-            vol_avg20 = df['Volume'].rolling(window=20).mean().iloc[-2]
-            vol_latest = latest['Volume']
-            vol_comment = ""
-            vol_ratio = 1.0
-            if vol_avg20 > 0 and not pd.isna(vol_avg20):
-                vol_ratio = vol_latest / vol_avg20
-                if vol_ratio >= 2.0:
-                    vol_comment = f"急増 ({round(vol_ratio, 1)}倍) "
-                elif vol_ratio <= 0.5:
-                    vol_comment = f"急減 ({round(vol_ratio, 1)}倍) "
-            
-            vol_text = f"{vol_comment}{vol_latest/10000:.1f}万株" if vol_latest < 100000000 else f"{vol_comment}{vol_latest/100000000:.1f}億株"
-
-            position = "200日線上" if price >= ma200 else "200日線下"
-            ma25_trend = "UP" if latest['MA25'] > prev['MA25'] else "DOWN"
-
-            signals = []
-            is_yosen = latest['Close'] > latest['Open']
-            is_insen = latest['Close'] < latest['Open']
-            
-            if pd.notna(latest['High_20']):
-                if latest['High'] >= latest['High_20'] * 0.97 and is_insen and prev_rsi >= 65 and rsi < prev_rsi:
-                    signals.append("⚠️ [天井警戒型] ダブルトップ警戒")
-
-            if pd.notna(latest['Low_20']) and pd.notna(latest['MA5']) and pd.notna(latest['MA25']):
-                if (latest['Low'] <= latest['Low_20'] * 1.05 and 
-                    latest['Low'] >= latest['Low_20'] and 
-                    is_yosen and 
-                    rsi <= 30 and 
-                    latest['Close'] < latest['MA25'] * 0.95 and 
-                    latest['Close'] > latest['MA5']):
-                    signals.append("🔄 [底打ち確認型] W底反転(MA5上抜)")
-
-            ma_support = False
-            if pd.notna(latest['MA75']) and latest['Low'] <= latest['MA75'] * 1.03 and latest['Close'] > latest['MA75']:
-                ma_support = True
-            if pd.notna(latest['MA200']) and latest['Low'] <= latest['MA200'] * 1.03 and latest['Close'] > latest['MA200']:
-                ma_support = True
-                
-            if ma_support and is_yosen:
-                if "🔄 [底打ち確認型] W底反転(MA5上抜)" not in signals:
-                    signals.append("🟢 [押し目拾い型] MA支持線反発")
-
-            if prev['MA25'] <= prev['MA75'] and latest['MA25'] > latest['MA75']:
-                signals.append("🌟 ゴールデンクロス発生")
-            if prev['MA25'] >= prev['MA75'] and latest['MA25'] < latest['MA75']:
-                signals.append("⚠️ デッドクロス発生")
-
-            # 💡 【追加】本物のAI (IPPO) による分析を実行
-            if api_key:
-                tech_data = {
-                    'RSI': f"{rsi} ({rsi_trend})",
-                    'ポジション': position,
-                    'シグナル': ", ".join(signals) if signals else "特になし",
-                    '出来高': vol_text
-                }
-                news_list = fetch_recent_news(code, limit=3) # 最新ニュースを3件取得
-                ai_comment = get_ai_analysis(code, price, tech_data, news_list, api_key)
-            else:
-                # APIキーがない場合は従来の定型文を使う
-                ai_comment = generate_watch_comment(signals, rsi, position, ma25_trend, vol_ratio)
-
-            df_clean = df.dropna(subset=['Open', 'High', 'Low', 'Close']).tail(120)
-            history_data = []
-            for date_index, row in df_clean.iterrows():
-                history_data.append({
-                    "time": date_index.strftime('%Y-%m-%d'),
-                    "open": float(row['Open']),
-                    "high": float(row['High']),
-                    "low": float(row['Low']),
-                    "close": float(row['Close']),
-                    "volume": float(row['Volume']),
-                    "ma25": float(row['MA25']) if pd.notna(row['MA25']) else None,
-                    "ma75": float(row['MA75']) if pd.notna(row['MA75']) else None,
-                    "ma200": float(row['MA200']) if pd.notna(row['MA200']) else None
-                })
-
-            return {
-                "code": code, "name": name, "price": price, "price_diff": price_diff,
-                "rsi": rsi, "rsi_trend": rsi_trend, "vol_text": vol_text, "position": position, "signals": signals,
-                "history_data": history_data, "ai_comment": ai_comment, "error": False
-            }
-        except Exception as e:
-            if attempt < max_retries - 1:
-                time.sleep(base_wait * (2 ** attempt)) 
-            else:
-                return {"code": code, "name": name, "error": True, "error_msg": f"取得失敗: {str(e)}"}
-
-def analyze_watch_tickers(target_date_str=None):
+def watch_tech_data(result):
+    """AI に渡すテクニカルデータ（process_watch_ticker の結果から作る）"""
+    return {
+        'RSI': f"{result['rsi']} ({result['rsi_trend']})",
+        'ポジション': result['position'],
+        'シグナル': ", ".join(result['signals']) if result['signals'] else "特になし",
+        '出来高': result['vol_text']
+    }
+
+def process_watch_ticker(code, name, df, nk_data=None):
+    """
+    df は technical_calc.add_indicators で指標列を追加済みの日足。
+    nk_data（signal_rules.market_frame）を渡すと、地合いを条件に含むシグナルもチャートに印を付ける。
+    """
+    if df is None or df.empty or len(df) < 200:
+        return {"code": code, "name": name, "error": True, "error_msg": "データ不足（新規上場など）"}
+
+    try:
+        latest = df.iloc[-1]
+        prev = df.iloc[-2]
+        
+        price = int(latest['Close'])
+        price_diff = int(latest['Close'] - prev['Close'])
+        rsi = round(latest['RSI'], 1)
+        prev_rsi = round(prev['RSI'], 1) if pd.notna(prev['RSI']) else rsi
+        ma200 = latest['MA200']
+        
+        rsi_diff = rsi - prev_rsi
+        if rsi_diff > 2:
+            rsi_trend = f"RSI 上昇 (+{round(rsi_diff, 1)})"
+        elif rsi_diff < -2:
+            rsi_trend = f"RSI 低下 ({round(rsi_diff, 1)})"
+        else:
+            rsi_trend = "RSI 横ばい"
+
+        vol_avg20 = latest['Vol_Avg20']
+        vol_latest = latest['Volume']
+        vol_comment = ""
+        vol_ratio = 1.0
+        if vol_avg20 > 0 and not pd.isna(vol_avg20):
+            vol_ratio = vol_latest / vol_avg20
+            if vol_ratio >= 2.0:
+                vol_comment = f"急増 ({round(vol_ratio, 1)}倍) "
+            elif vol_ratio <= 0.5:
+                vol_comment = f"急減 ({round(vol_ratio, 1)}倍) "
+        
+        vol_text = f"{vol_comment}{vol_latest/10000:.1f}万株" if vol_latest < 100000000 else f"{vol_comment}{vol_latest/100000000:.1f}億株"
+
+        position = "200日線上" if price >= ma200 else "200日線下"
+        ma25_trend = "UP" if latest['MA25'] > prev['MA25'] else "DOWN"
+
+        # 💡 シグナルは signal_rules の共通ルールを全期間で評価し、最終日の成立分を表示する（過去の成立日はチャートの印に使う）
+        masks = evaluate(frame_columns(df, nk_data), WATCH_SIGNALS + MARKER_RULES)
+        signals = labels(masks, WATCH_SIGNALS)
+
+        # 💡 AI コメントは analyze_watch_tickers が全銘柄分をまとめて取得して差し替える（ここでは定型文）
+        ai_comment = generate_watch_comment(signals, rsi, position, ma25_trend, vol_ratio)
+
+        history_data = chart_history(df, masks)
+
+        return {
+            "code": code, "name": name, "price": price, "price_diff": price_diff,
+            "rsi": rsi, "rsi_trend": rsi_trend, "vol_text": vol_text, "position": position, "signals": signals,
+            "history_data": history_data, "ai_comment": ai_comment, "error": False
+        }
+    except Exception as e:
+        return {"code": code, "name": name, "error": True, "error_msg": f"取得失敗: {str(e)}"}
+
+def analyze_watch_tickers(target_date_str=None, frames=None, ctx=None):
+    """
+    frames に取得済みの全期間データ（シンボル → 日足）を渡すと、ダウンロードせずに target_date 時点へ切り出して分析する。
+    ctx（RunContext）を渡すと、実行全体で同じ基準時刻を使う。
+    """
+    ctx = ctx or RunContext()
     results = []
     
     if target_date_str:
         target_date = datetime.strptime(target_date_str, '%Y-%m-%d').replace(tzinfo=JST)
         end = target_date + timedelta(hours=23, minutes=59)
     else:
-        end = datetime.now(JST)
+        end = ctx.now
 
     start = end - timedelta(days=500)
     start_str = start.strftime('%Y-%m-%d')
@@ -192,12 +139,36 @@ def analyze_watch_tickers(target_date_str=None):
     # 💡 【重要変更】APIキーを環境変数から取得
     api_key = os.environ.get("GEMINI_API_KEY")
 
-    # 💡 【重要変更】API制限(15RPM)を回避するため、並列処理をやめて直列処理＋ウェイト(4秒)に変更
-    for code, name in WATCH_TICKERS.items():
-        res = process_watch_ticker(code, name, start_str, end_str, api_key)
-        results.append(res)
-        if api_key:
-            time.sleep(4) # AIに負荷をかけないための安全装置
+    # 💡 全銘柄の不足分を1回の一括リクエストで取得（以降の個別処理はキャッシュから読むだけ）
+    # 💡 指標は全銘柄分を technical_calc でまとめて1回で計算する
+    try:
+        symbols = ["^N225"] + [f"{code}.T" for code in WATCH_TICKERS]
+        if frames is None:
+            frames = get_histories(symbols, start_str, end_str)
+        else:
+            frames = slice_frames({s: frames[s] for s in symbols if s in frames}, start_str, end_str)
+        nikkei_df = frames.pop("^N225", None)
+        nk_data = market_frame(nikkei_df) if nikkei_df is not None and not nikkei_df.empty else None
+        frames = add_indicators(frames)
+    except Exception as e:
+        print(f"株価取得エラー: {e}")
+        frames, nk_data = {}, None
+
+    # 💡 指標・シグナルを全銘柄分先に求め、AI分析は数銘柄ずつ1リクエストにまとめて取得する
+    #    （ニュースは先読みしておき、AIの往復は12回から1〜2回になる）
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        news_future = executor.submit(fetch_news_batch, WATCH_TICKERS.keys(), 3) if api_key else None
+        for code, name in WATCH_TICKERS.items():
+            results.append(process_watch_ticker(code, name, frames.get(f"{code}.T"), nk_data=nk_data))
+        news = news_future.result() if news_future else {}
+
+    if api_key:
+        items = [{"code": r["code"], "price": r["price"], "tech_data": watch_tech_data(r), "news": news.get(r["code"])}
+                 for r in results if not r["error"]]
+        comments = get_ai_analysis_batch(items, api_key)
+        for r in results:
+            if r["code"] in comments:
+                r["ai_comment"] = comments[r["code"]]
             
     order = list(WATCH_TICKERS.keys())
     results.sort(key=lambda x: order.index(x['code']))